@@ -21,134 +21,23 @@ AGPLv3
 
 """
 
+from BattleMap import BattleMap
 from CharacterClasses import Monster, PlayerCharacter
-from GameConstructs import Team
-from random import randint
+from CombatEngine import get_scores, run_combat
+from CombatEvents import CounterSink, LogSink, MultiSink, NULL_SINK, TextSink
+from CombatProfiler import CombatProfiler
+from CommonRandomNumbers import compare_encounters
+from DangerRating import DangerAggregator
+from Dice import BACKENDS, make_dice
+from EncounterConstructs import load_encounter
+from GameConstructs import CombatState, Team
+from ParallelRunner import run_parallel, run_until_precise
+from ResultCache import ResultCache, run_cached
+from ResultRecords import ResultWriter
+from StatusEffects import effect_engine
+import argparse
 import logging
-
-
-def d20_with_modifier(modifier=0):
-  """Rolls a d20 (20 sided dice) and adds the given modifier.
-
-  Args:
-      modifier (int): The number to add the random roll to.
-
-  Returns:
-      roll: random number between 1 and 20 + the modifier
-  """
-  roll = randint(1, 20)
-  logging.info('d20 roll is {} and the modifier is {}'.format(roll, modifier))
-  roll = roll + modifier
-  return roll
-
-
-def are_there_any_opponents(own_team, initiative_order):
-  """Returns True if there are any opponents still with health.
-
-  Args:
-      own_team (GameConstructs/Team): The team as reference to check if other teams have living combatants.
-      initiative_order (list): A list of BaseCreature or its subclass objects all taking place in the combat.
-
-  Returns:
-      bool: If any members of other teams in the combat are alive return True, if not return False
-  """
-  for creature in initiative_order:
-    if creature.team is own_team:
-      continue
-    else:
-      if creature.current_hp > 0:
-        return True
-  # If we get here then there are no creatures with > 0 hit points of another team
-  return False
-
-
-def get_potential_opponents(teams, active_creature):
-  """Returns a list of the potential opponents for a character.
-
-  Args:
-      teams (list): List of GameConstructs/Team participating in the combat.
-      active_creature (BaseCreature or subclass of): The character who's turn it is in the combat order.
-
-  Returns:
-      list: The list of BaseCreature or subclass thereof that are viable targets of the active_creature.
-  """
-  potential_opponents = []
-
-  for team in teams:
-    if active_creature not in team.team_members:
-      for creature in team.team_members:
-        if creature.current_hp > 0:
-          potential_opponents.append(creature)
-
-  logging.info('{}s list of potential opponents: {}'.format(active_creature.name, potential_opponents))
-  return potential_opponents
-
-
-def print_initiative_order_and_character_state(combatants_with_initiative):
-  """Prints and returns the combat initiative order and current state of the combat.
-
-  Args:
-      combatants_with_initiative (list): List of the combatants in the combat with BaseCreature and its subclasses
-      with BaseCreature.initiative parameter.
-
-  Returns:
-      string: The state of the combat, including creature initiative order, HP etc.
-  """
-  initiative_order_string = '\nInitiative Order and Creature States:'
-  initiative_number = 0
-  for combatant in combatants_with_initiative:
-    initiative_number += 1
-    if combatant.current_hp > 0:
-      initiative_order_string = initiative_order_string + '\n' + \
-                                str(initiative_number) + '(' + str(combatant.initiative) + '): ' + repr(combatant)
-    else:
-      text = '\n' + str(initiative_number) + '(' + str(combatant.initiative) + '): ' + repr(combatant)
-      struck_text = ''
-      for char in text:
-        struck_text = struck_text + char + '\u0336'
-      initiative_order_string = initiative_order_string + struck_text
-
-  print(initiative_order_string)
-  logging.info(initiative_order_string)
-  return initiative_order_string
-
-
-def get_initiative_order(list_of_combatants):
-  """Take in a list of combatants, roll initiative for each, return an ordered list.
-
-  Args:
-      list_of_combatants (list): A list of BaseCreature or its subclasses that will participate in the combat.
-
-  Returns:
-      initiative_order: A list of the combatants ordered by the reverse of the newly created BaseCreature.initiative
-      parameter (so that the highest initiative is first and lowest is last).
-  """
-  initiative_order = []
-
-  for character in list_of_combatants:
-    logging.info('Character dexterity: {}, Character dexterity bonus: {}'.format(str(character.dexterity),
-                 str(character.get_bonus(character.dexterity))))
-    character.initiative = d20_with_modifier(character.get_bonus(character.dexterity))
-    print('{} gets an initiative score of {}'.format(character.name, character.initiative))
-    initiative_order.append(character)
-
-  initiative_order.sort(key=lambda x: x.initiative, reverse=True)
-  return initiative_order
-
-
-def get_scores(teams):
-  """Gets the text describing the current scores of which teams have won how many combats.
-
-  Args:
-      teams (list): List of GameConstructs/Teams objects.
-
-  Returns:
-      string: The text output of the current state of the multi-combat experience.
-  """
-  score_text = 'And the scores: '
-  for team in teams:
-    score_text = score_text + '\n{}: {}'.format(team.name, team.score)
-  return score_text
+import random
 
 
 def get_players():
@@ -209,94 +98,211 @@ def get_monsters():
   return team_members
 
 
-def characters_from_multiple_teams_alive(teams):
-  """Returns True if there are characters with > 0 hit points from multiple teams.
+def parse_arguments(argv=None):
+  """Reads the command line options.
 
   Args:
-      teams (list of GameConstructs/Team): The list of teams to check for alive combatants.
+      argv (list of str, optional): The arguments to parse, defaults to the ones the script was called with.
 
   Returns:
-      bool: If there are living creatures from multiple teams this will return True, meaning the battle continues.
-      Otherwise it returns False, allowing this iteration of the combat to end.
+      argparse.Namespace: The parsed options.
   """
-  teams_with_characters_alive = 0
-  for team in teams:
-    current_team_alive = False
-    for character in team.team_members:
-      if character.current_hp > 0:
-        current_team_alive = True
-    if current_team_alive:
-      teams_with_characters_alive += 1
-
-  if teams_with_characters_alive > 1:
-    return True
-  else:
-    return False
+  parser = argparse.ArgumentParser(description='Simulate a 5e encounter many times and count the wins per team.')
+  parser.add_argument('-e', '--encounter', default=None,
+                      help='An encounter file (.json, or .toml on Python 3.11+) to fight instead of the teams in '
+                           'get_players() and get_monsters(), e.g. encounters/hill_giants.json.')
+  parser.add_argument('-n', '--attempts', type=int, default=10, help='The number of combats to simulate.')
+  parser.add_argument('--engine', choices=['serial', 'batch', 'parallel', 'squad'], default='serial',
+                      help='serial fights one narrated combat at a time, batch fights them all in lockstep with '
+                           'NumPy, parallel splits them over a pool of processes and squad fights identical creatures '
+                           'as squads, for mass battles. Only serial narrates.')
+  parser.add_argument('--seed', type=int, default=None, help='Seed for the random rolls, the same seed gives the '
+                                                             'same results.')
+  parser.add_argument('--dice', choices=BACKENDS, default='random',
+                      help='How the serial and parallel engines roll: one random module call per die, or numpy '
+                           'which rolls large blocks of dice at once with NumPy and hands them out.')
+  parser.add_argument('--output', choices=['text', 'log', 'counters', 'none'], default='text',
+                      help='What the serial engine does with the events of each combat: print the narration, write '
+                           'it to game_log.log, only count attacks, hits and knockdowns, or nothing at all.')
+  parser.add_argument('--precision', type=float, default=None,
+                      help='Ignore --attempts and keep running batches of combats until the confidence interval of '
+                           'the measured rate is within +/- this value, e.g. 0.01.')
+  parser.add_argument('--confidence', type=float, default=0.95, help='The confidence level used with --precision.')
+  parser.add_argument('--measure', choices=['player-win', 'tpk'], default='player-win',
+                      help='The rate --precision is about: the players winning or a total party kill.')
+  parser.add_argument('--workers', type=int, default=None, help='The number of processes for the parallel engine, '
+                                                                'defaults to the number of cores.')
+  parser.add_argument('--compare', default=None, metavar='FILE',
+                      help='Compare the encounter with a variant from an encounter file, fighting --attempts pairs '
+                           'of combats on common random numbers, and print the difference in the --measure rate.')
+  parser.add_argument('--antithetic', action='store_true',
+                      help='With --compare, also fight every pair on antithetic random numbers.')
+  parser.add_argument('--records', default=None, metavar='DIRECTORY',
+                      help='Stream the winner, rounds, surviving hit points, player characters downed and damage '
+                           'dealt of every combat of the serial or parallel engine to .npy column files in DIRECTORY.')
+  parser.add_argument('--cache', default=None, metavar='DIRECTORY',
+                      help='Keep the tallies of every run in DIRECTORY and only fight the combats that are not cached '
+                           'yet for the same creatures, seed and dice. Fights like the parallel engine.')
+  parser.add_argument('--cache-size', type=int, default=16, help='The most megabytes the --cache may take up before '
+                                                                 'the least recently used runs are deleted.')
+  parser.add_argument('--profile', nargs='?', const='', default=None, metavar='FILE',
+                      help='Time the phases of every combat of the serial engine (initiative, targeting, attacks, '
+                           'output...) and count rounds, attacks, crits and knockdowns. Prints a table at the end and '
+                           'writes the profile as JSON to FILE if one is given.')
+  parser.add_argument('--map', type=int, default=None, metavar='FEET',
+                      help='Fight the serial combats on a grid map with every team lined up FEET apart, the creatures '
+                           'move to reach their opponents and shoot with their ranged weapons. The map has the '
+                           '"terrain" of the encounter file if it has one.')
+  parser.add_argument('--danger', action='store_true',
+                      help='Measure every combat of the serial or parallel engine (player characters downed, damage '
+                           'taken, hits and misses, rounds and remaining party hit points) and print the danger '
+                           'rating of the encounter.')
+  options = parser.parse_args(argv)
+  if options.map is not None:
+    # only the serial loop fights on a map, the other engines and modes would silently fight without it
+    others = ['--engine {}'.format(options.engine)] if options.engine != 'serial' else []
+    others += [flag for flag, value in (('--compare', options.compare), ('--precision', options.precision),
+                                         ('--cache', options.cache)) if value is not None]
+    if others:
+      parser.error('--map only works with the serial engine, not with {}'.format(', '.join(others)))
+  return options
+
+
+def get_teams(options):
+  """Builds the teams to fight, from the encounter file if one was given or get_players() and get_monsters() if not.
 
+  Args:
+      options (argparse.Namespace): The parsed command line options.
 
-def main():
-
-  logging.basicConfig(level=logging.DEBUG, format='%(asctime)s : %(levelname)s : %(message)s',
-                      filename='game_log.log', filemode='w+')
+  Returns:
+      list of GameConstructs/Team: The teams, the players first.
+  """
+  if options.encounter:
+    return load_encounter(options.encounter).build()
 
-  # Get the teams
   player_team = Team('Players')
   monster_team = Team('Monsters')
-  teams = [player_team, monster_team]
+  player_team.team_members = get_players()
+  monster_team.team_members = get_monsters()
+  return [player_team, monster_team]
+
+
+def get_battle_map(options, teams):
+  """Builds the map to fight on if --map was given, on the terrain of the encounter file if it has one.
+
+  Args:
+      options (argparse.Namespace): The parsed command line options.
+      teams (list of GameConstructs/Team): The teams, lined up options.map feet apart.
 
-  combat_attempts = 10
+  Returns:
+      BattleMap/BattleMap: The map, or None without --map.
+  """
+  if options.map is None:
+    return None
+  terrain = load_encounter(options.encounter).build_terrain() if options.encounter else None
+  return BattleMap.line_up(teams, options.map, terrain=terrain)
+
+
+def main(argv=None):
+
+  options = parse_arguments(argv)
+
+  # Get the teams, they are built once and reset between combats
+  teams = get_teams(options)
+
+  if options.engine == 'batch':
+    # imported here so the serial engine keeps working without NumPy installed
+    from BatchEngine import run_batch
+    run_batch(teams, options.attempts, options.seed)
+    print(get_scores(teams))
+    return
+
+  if options.engine == 'squad':
+    from SquadEngine import run_squads
+    run_squads(teams, options.attempts, options.seed)
+    print(get_scores(teams))
+    return
+
+  if options.compare:
+    outcome = 'win' if options.measure == 'player-win' else 'loss'
+    comparison = compare_encounters(teams, load_encounter(options.compare).build(), options.attempts, 0, outcome,
+                                    options.antithetic, options.confidence, options.seed or 0)
+    print(comparison)
+    return
+
+  if options.precision is not None:
+    outcome = 'win' if options.measure == 'player-win' else 'loss'
+    summary = run_until_precise(teams, options.precision, options.confidence, 0, outcome,
+                                seed=options.seed or 0, workers=options.workers or 1, dice=options.dice)
+    low, high = summary.interval(0, outcome, options.confidence)
+    print(get_scores(teams))
+    print('{} rate between {:.2%} and {:.2%} ({:.0%} confidence) after {} combats'.format(
+      options.measure, low, high, options.confidence, summary.fights))
+    return
+
+  if options.cache:
+    cache = ResultCache(options.cache, options.cache_size * 1024 * 1024)
+    summary = run_cached(teams, options.attempts, cache, options.seed or 0, options.workers, options.dice)
+    print(get_scores(teams))
+    print('Average rounds per combat: {:.2f} over {} combats'.format(summary.average_rounds(), summary.fights))
+    return
+
+  if options.engine == 'parallel':
+    summary = run_parallel(teams, options.attempts, options.seed or 0, options.workers, options.dice, options.records,
+                           danger=options.danger)
+    print(get_scores(teams))
+    print('Average rounds per combat: {:.2f}'.format(summary.average_rounds()))
+    if summary.danger is not None:
+      print(summary.danger.report())
+    return
+
+  if options.output == 'text':
+    sink = TextSink()
+  elif options.output == 'log':
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s : %(levelname)s : %(message)s',
+                        filename='game_log.log', filemode='w+')
+    sink = LogSink()
+  elif options.output == 'counters':
+    sink = counters = CounterSink()
+  else:
+    sink = NULL_SINK
+
+  if options.seed is None and options.dice == 'random':
+    rng = random
+  else:
+    rng = make_dice(options.dice, options.seed)
+  combat_attempts = options.attempts
+  state = CombatState(teams)
+  profiler = CombatProfiler() if options.profile is not None else None
+  writer = ResultWriter(options.records, state) if options.records else None
+  battle_map = get_battle_map(options, teams)
+  danger = DangerAggregator(teams) if options.danger else None
+  effects = effect_engine(teams)
+  if danger is not None:
+    sink = MultiSink([sink, danger])
 
   for i in range(combat_attempts):
     # reset the team members
-    player_team.team_members = get_players()
-    monster_team.team_members = get_monsters()
-
-    # All the combatants to send for initiative oder
-    combatants = []
-
-    for player in player_team.team_members:
-      combatants.append(player)
-    for monster in monster_team.team_members:
-      combatants.append(monster)
-    initiative_order = get_initiative_order(combatants)
-
-    round_number = 0
-
-    while characters_from_multiple_teams_alive(teams):
-
-      print_initiative_order_and_character_state(initiative_order)
-
-      round_number += 1
-      print('\nRound {} FIGHT!\n'.format(round_number))
-
-      for creature in initiative_order:
-        if creature.current_hp < 1:
-          logging.info('{} is down'.format(creature.name))
-          continue
-        potential_targets = get_potential_opponents(teams, creature)
-
-        if not potential_targets:
-          break
-
-        target = creature.pick_target(potential_targets)
-        print('{} targets {} {} times'.format(creature.name, target.name, creature.num_attacks))
-        for attack in range(creature.num_attacks):
-          text = creature.melee_attack(target)
-          print(text)
-          if target.current_hp < 1:
-            print('Putting {} on death saving throws!'.format(target.name))
-            break
-
-      if not characters_from_multiple_teams_alive(teams):
-        # find the team with living members
-        for team in teams:
-          for creature in team.team_members:
-            if creature.current_hp > 0:
-              team.score += 1
-              break
-      print('Player wins: {}'.format(str(player_team.score)))
-      print('Monster wins: {}'.format(str(monster_team.score)))
-
+    state.reset()
+
+    result = run_combat(teams, rng, sink, state, profiler, battle_map, effects)
+    if writer:
+      writer.add(result, state)
+
+    if options.output == 'text':
+      for team in teams:
+        print('{} wins: {}'.format(team.name, team.score))
+
+  if writer:
+    writer.close()
+  if options.output == 'counters':
+    print(counters)
+  if profiler is not None:
+    print(profiler.format_table())
+    if options.profile:
+      profiler.to_json(options.profile)
+  if danger is not None:
+    print(danger.report())
   print(get_scores(teams))
 
 
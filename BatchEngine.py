@@ -0,0 +1,205 @@
+"""Vectorised combat engine that resolves many encounters in lockstep with NumPy.
+
+The serial loop in '5e_combat_simulator.py' walks one encounter at a time through the BaseCreature objects. This
+module compiles the same GameConstructs/Team definitions once into arrays and then plays N copies of the encounter
+side by side. Every per-encounter quantity (current HP, initiative, the active creature's target) is an array of shape
+(encounters, combatants) or (encounters,), and each step of a round is a handful of array operations.
+
+The rules follow the serial engine exactly so that the win ratios agree:
+  * Initiative is a d20 plus the dexterity bonus, ties keep the team order (players before monsters).
+  * Every creature picks a random living opponent on its turn and makes all of its attacks against that target,
+    stopping early if the target drops.
+  * A natural 20 always hits and doubles the damage dice, a natural 1 always misses for player characters.
+  * Monsters with several weapons pick one at random for every attack.
+
+Use it like so:
+  wins = run_batch([player_team, monster_team], 100000, seed=42)
+"""
+
+import numpy as np
+import logging
+
+
+class CompiledEncounter:
+  """The static arrays describing an encounter, built once from a list of GameConstructs/Team objects.
+
+  All arrays are indexed by combatant, combatants are ordered team by team in the order they appear in the teams
+  list (which is also the order the serial engine hands them to initiative).
+  """
+
+  def __init__(self, teams):
+    """Compiles the teams into arrays.
+
+    Args:
+        teams (list of GameConstructs/Team): The teams that fight each other. The creatures are read but not changed,
+          apart from a PlayerCharacter picking its preferred melee weapon if it had not done so yet.
+    """
+    self.teams = teams
+    self.combatants = []
+    team_index = []
+    for index, team in enumerate(teams):
+      for creature in team.team_members:
+        self.combatants.append(creature)
+        team_index.append(index)
+
+    if not self.combatants:
+      raise ValueError('Cannot compile an encounter without any combatants')
+
+    attack_profiles = [creature.get_attack_profiles() for creature in self.combatants]
+    for creature, profiles in zip(self.combatants, attack_profiles):
+      if not profiles:
+        raise ValueError('{} has no melee weapon to attack with'.format(creature.name))
+      if creature.spells:
+        raise ValueError('{} has spells, which need the serial engine'.format(creature.name))
+    num_weapons = max(len(profiles) for profiles in attack_profiles)
+    num_dice = max(len(profile.dice) for profiles in attack_profiles for profile in profiles)
+
+    num_combatants = len(self.combatants)
+    self.team = np.array(team_index, dtype=np.int64)
+    self.team_one_hot = np.zeros((num_combatants, len(teams)), dtype=np.int64)
+    self.team_one_hot[np.arange(num_combatants), self.team] = 1
+    self.max_hp = np.array([creature.hp for creature in self.combatants], dtype=np.int64)
+    self.ac = np.array([creature.ac for creature in self.combatants], dtype=np.int64)
+    self.dexterity_bonus = np.array([creature.get_bonus(creature.dexterity) for creature in self.combatants],
+                                    dtype=np.int64)
+    self.num_attacks = np.array([creature.num_attacks for creature in self.combatants], dtype=np.int64)
+
+    self.num_weapons = np.array([len(profiles) for profiles in attack_profiles], dtype=np.int64)
+    self.to_hit = np.zeros((num_combatants, num_weapons), dtype=np.int64)
+    self.damage_bonus = np.zeros((num_combatants, num_weapons), dtype=np.int64)
+    self.natural_one_misses = np.zeros((num_combatants, num_weapons), dtype=bool)
+    # dice sizes padded with 0 which never roll any damage
+    self.dice = np.zeros((num_combatants, num_weapons, max(num_dice, 1)), dtype=np.int64)
+    for creature_index, profiles in enumerate(attack_profiles):
+      for weapon_index, profile in enumerate(profiles):
+        self.to_hit[creature_index, weapon_index] = profile.to_hit
+        self.damage_bonus[creature_index, weapon_index] = profile.damage_bonus
+        self.natural_one_misses[creature_index, weapon_index] = profile.natural_one_misses
+        self.dice[creature_index, weapon_index, :len(profile.dice)] = profile.dice
+
+    self.max_attacks = int(self.num_attacks.max())
+
+  def teams_alive(self, hp):
+    """Returns the number of teams with living members per encounter.
+
+    Args:
+        hp (numpy.ndarray): Current hit points with shape (encounters, combatants).
+
+    Returns:
+        numpy.ndarray: The number of teams with at least one creature above 0 hit points, shape (encounters,).
+    """
+    return (((hp > 0).astype(np.int64) @ self.team_one_hot) > 0).sum(axis=1)
+
+
+def roll_dice(rng, dice):
+  """Rolls a padded array of dice and returns the total per row.
+
+  Args:
+      rng (numpy.random.Generator): The random generator to draw from.
+      dice (numpy.ndarray): Dice sizes with shape (rows, dice), a size of 0 rolls nothing.
+
+  Returns:
+      numpy.ndarray: The sum of the rolls in each row.
+  """
+  rolls = np.floor(rng.random(dice.shape) * dice).astype(np.int64) + 1
+  return np.where(dice > 0, rolls, 0).sum(axis=1)
+
+
+def simulate_encounters(encounter, num_encounters, rng):
+  """Fights num_encounters copies of a compiled encounter to the end.
+
+  Args:
+      encounter (CompiledEncounter): The compiled teams.
+      num_encounters (int): How many independent encounters to run in lockstep.
+      rng (numpy.random.Generator): The random generator to draw all the rolls from.
+
+  Returns:
+      tuple: The winning team index per encounter (-1 if nobody survived) and the number of rounds each encounter
+      lasted, both with shape (num_encounters,).
+  """
+  num_combatants = len(encounter.combatants)
+  hp = np.tile(encounter.max_hp, (num_encounters, 1))
+
+  initiative = rng.integers(1, 21, size=(num_encounters, num_combatants)) + encounter.dexterity_bonus
+  # a stable sort on the negated initiative keeps the team order for ties, like list.sort(reverse=True) does
+  initiative_order = np.argsort(-initiative, axis=1, kind='stable')
+
+  rounds = np.zeros(num_encounters, dtype=np.int64)
+  finished = encounter.teams_alive(hp) <= 1
+
+  while not finished.all():
+    # only carry the encounters that are still going through the round
+    active = np.flatnonzero(~finished)
+    active_hp = hp[active]
+    active_order = initiative_order[active]
+    active_finished = np.zeros(len(active), dtype=bool)
+    rows = np.arange(len(active))
+    rounds[active] += 1
+
+    for slot in range(num_combatants):
+      actor = active_order[:, slot]
+      acting = ~active_finished & (active_hp[rows, actor] > 0)
+      if not acting.any():
+        continue
+
+      # pick a random living opponent: the k-th valid target where k is uniform over the number of valid targets
+      valid_targets = (active_hp > 0) & (encounter.team[None, :] != encounter.team[actor][:, None])
+      num_targets = valid_targets.sum(axis=1)
+      acting &= num_targets > 0
+      pick = np.floor(rng.random(len(active)) * num_targets).astype(np.int64)
+      target = np.argmax(np.cumsum(valid_targets, axis=1) > pick[:, None], axis=1)
+      target_ac = encounter.ac[target]
+
+      for attack in range(encounter.max_attacks):
+        attacking = acting & (attack < encounter.num_attacks[actor]) & (active_hp[rows, target] > 0)
+        if not attacking.any():
+          break
+
+        weapon = np.floor(rng.random(len(active)) * encounter.num_weapons[actor]).astype(np.int64)
+        d20_roll = rng.integers(1, 21, size=len(active))
+        critical_hit = d20_roll == 20
+        hit = critical_hit | (d20_roll + encounter.to_hit[actor, weapon] >= target_ac)
+        hit &= ~(encounter.natural_one_misses[actor, weapon] & (d20_roll == 1))
+
+        dice = encounter.dice[actor, weapon]
+        damage = roll_dice(rng, dice) + encounter.damage_bonus[actor, weapon]
+        damage += np.where(critical_hit, roll_dice(rng, dice), 0)
+        active_hp[rows, target] -= np.where(attacking & hit, damage, 0)
+
+      active_finished |= encounter.teams_alive(active_hp) <= 1
+
+    hp[active] = active_hp
+    finished[active] = active_finished
+
+  alive_per_team = (hp > 0).astype(np.int64) @ encounter.team_one_hot
+  winner = np.where(alive_per_team.any(axis=1), np.argmax(alive_per_team > 0, axis=1), -1)
+  return winner, rounds
+
+
+def run_batch(teams, num_encounters, seed=None, chunk_size=100000):
+  """Runs num_encounters fights between the teams and adds the wins to each Team.score.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat.
+      num_encounters (int): How many encounters to fight.
+      seed (int, optional): Seed for the NumPy random generator, the same seed gives the same results.
+      chunk_size (int, optional): The maximum number of encounters held in memory at once.
+
+  Returns:
+      list of int: The number of encounters each team won, in the same order as teams.
+  """
+  encounter = CompiledEncounter(teams)
+  rng = np.random.default_rng(seed)
+  wins = np.zeros(len(teams), dtype=np.int64)
+
+  remaining = num_encounters
+  while remaining > 0:
+    chunk = min(chunk_size, remaining)
+    winner, rounds = simulate_encounters(encounter, chunk, rng)
+    wins += np.bincount(winner[winner >= 0], minlength=len(teams))
+    logging.info('Batch of {} encounters finished, longest took {} rounds'.format(chunk, rounds.max()))
+    remaining -= chunk
+
+  for team, team_wins in zip(teams, wins):
+    team.score += int(team_wins)
+  return [int(team_wins) for team_wins in wins]
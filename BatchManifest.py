@@ -0,0 +1,237 @@
+"""Runs every encounter of a manifest on one pool of worker processes and writes all the results to a single file.
+
+A manifest lists encounters, from encounter files or inline specs (see EncounterConstructs), and how many combats to
+fight for each (encounter files are relative to the manifest):
+
+  {
+    "seed": 0,
+    "dice": "random",
+    "encounters": [
+      {"file": "../encounters/hill_giants.json", "fights": 20000},
+      {"file": "../encounters/three_hill_giants.json", "fights": 5000, "seed": 7},
+      {"name": "Lone giant", "encounter": {"teams": [...]}, "fights": 1000}
+    ]
+  }
+
+The encounters are not fought one after the other. They are cut into chunks of roughly the same cost, so that every
+worker stays busy until the very end, and all the chunks go to the same pool:
+  * the cost of a combat is estimated as the number of combatants times the expected number of rounds,
+  * the expected number of rounds comes from a pilot chunk of every encounter, all of them queued first (and counted),
+  * as soon as the pilot of an encounter is back the rest of its combats are split into chunks and queued, without
+    waiting for the other pilots. A chunk costs about 1 / (4 x workers) of the total cost, estimated up front with
+    EXPECTED_ROUNDS rounds per combat.
+The workers keep the creatures they have built between chunks (see ParameterSweep.run_cell). Chunk i of an encounter
+is seeded with ParallelRunner.derive_seed(seed, i) and the chunks of an encounter only depend on its own pilot, so a
+manifest gives the same results for the same number of workers.
+
+Use it like so:
+  python BatchManifest.py manifests/example.json -o results.json
+"""
+
+from EncounterConstructs import EncounterTemplate, canonical_json, load_encounter
+from ParallelRunner import SimulationSummary, derive_seed, split_fights
+from ParameterSweep import run_cell
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+
+# the typical length of a combat in rounds, only used for the total cost the chunks are sized from
+EXPECTED_ROUNDS = 5.0
+
+
+class ManifestEntry:
+  """An encounter of a manifest and the tallies of its combats."""
+
+  def __init__(self, name, template, fights, seed):
+    """Stores the entry.
+
+    Args:
+        name (str): The name of the entry in the results.
+        template (EncounterConstructs/EncounterTemplate): The encounter.
+        fights (int): The number of combats to fight.
+        seed (int): The seed of the entry.
+    """
+    self.name = name
+    self.template = template
+    self.spec_json = canonical_json(template.to_spec())
+    self.combatants = sum(member.spec.get('count', 1) for _, members in template.teams for member in members)
+    self.fights = fights
+    self.seed = seed
+    self.summary = SimulationSummary(len(template.teams))
+    self.chunks = 0
+
+  def __repr__(self):
+    return 'ManifestEntry({}, {} combats)'.format(self.name, self.fights)
+
+  def cost_per_combat(self):
+    """Returns the estimated cost of a combat, the number of combatants times the expected number of rounds."""
+    return self.combatants * max(self.summary.average_rounds(), 1.0)
+
+  def as_dict(self, confidence=0.95):
+    """Returns the results of the entry as a dictionary that can be written as JSON."""
+    low, high = self.summary.interval(0, 'win', confidence)
+    return {'name': self.name,
+            'teams': [team_name for team_name, _ in self.template.teams],
+            'fights': self.summary.fights,
+            'wins': self.summary.wins,
+            'player_win_rate': self.summary.wins[0] / self.summary.fights if self.summary.fights else 0.0,
+            'low': low,
+            'high': high,
+            'average_rounds': self.summary.average_rounds(),
+            'max_rounds': self.summary.max_rounds,
+            'chunks': self.chunks}
+
+
+def load_manifest(path):
+  """Reads a manifest file.
+
+  Args:
+      path (str): The path of the JSON manifest, encounter files in it are relative to the manifest.
+
+  Returns:
+      tuple: The list of ManifestEntry and the dice of the manifest.
+  """
+  with open(path) as manifest_file:
+    manifest = json.load(manifest_file)
+  directory = os.path.dirname(path)
+  entries = []
+  for number, entry in enumerate(manifest.get('encounters', [])):
+    if 'file' in entry:
+      template = load_encounter(os.path.join(directory, entry['file']))
+    elif 'encounter' in entry:
+      template = EncounterTemplate.from_spec(entry['encounter'])
+    else:
+      raise ValueError('Encounter {} of {} needs a "file" or an "encounter"'.format(number, path))
+    name = entry.get('name') or template.name or 'encounter {}'.format(number)
+    if int(entry.get('fights', 1000)) < 1:
+      raise ValueError('Encounter {} of {} needs at least one combat'.format(name, path))
+    entries.append(ManifestEntry(name, template, int(entry.get('fights', 1000)),
+                                 int(entry.get('seed', manifest.get('seed', 0)))))
+  if not entries:
+    raise ValueError('The manifest {} has no encounters'.format(path))
+  return entries, manifest.get('dice', 'random')
+
+
+def chunk_cost(entries, workers, chunks_per_worker=4):
+  """Returns the cost a chunk should have, worked out before any combat is fought.
+
+  Args:
+      entries (list of ManifestEntry): The entries.
+      workers (int): The number of worker processes.
+      chunks_per_worker (int, optional): How many chunks every worker should get on average.
+
+  Returns:
+      float: The total cost of the manifest with EXPECTED_ROUNDS rounds per combat, split over the chunks.
+  """
+  total_cost = sum(entry.combatants * entry.fights for entry in entries) * EXPECTED_ROUNDS
+  return max(total_cost / (workers * chunks_per_worker), 1.0)
+
+
+def plan_chunks(entry_index, entry, target_cost):
+  """Splits the combats that are left of an entry after its pilot chunk into chunks of about the target cost.
+
+  Args:
+      entry_index (int): The index of the entry in the manifest.
+      entry (ManifestEntry): The entry, with its pilot chunk merged.
+      target_cost (float): The cost of a chunk, see chunk_cost.
+
+  Returns:
+      list of tuple: (estimated cost, entry index, number of combats, chunk number) for every chunk.
+  """
+  fights = entry.fights - entry.summary.fights
+  if fights <= 0:
+    return []
+  num_chunks = min(fights, max(1, math.ceil(entry.cost_per_combat() * fights / target_cost)))
+  chunks = []
+  for size in split_fights(fights, num_chunks):
+    chunks.append((entry.cost_per_combat() * size, entry_index, size, entry.chunks))
+    entry.chunks += 1
+  return chunks
+
+
+def run_manifest(entries, workers=None, dice='random', pilot_fights=50):
+  """Fights the combats of every entry on one pool of worker processes.
+
+  Args:
+      entries (list of ManifestEntry): The entries, their summaries are filled in.
+      workers (int, optional): The number of worker processes, defaults to the number of cores.
+      dice (str, optional): The Dice backend.
+      pilot_fights (int, optional): The number of combats of the pilot chunk of every entry.
+
+  Returns:
+      list of ManifestEntry: The entries.
+  """
+  if workers is None:
+    workers = os.cpu_count() or 1
+  target_cost = chunk_cost(entries, workers)
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    # the pilot chunks tell how many rounds the combats of every entry take
+    pilots = {executor.submit(run_cell, entry.spec_json, min(pilot_fights, entry.fights), derive_seed(entry.seed, 0),
+                              dice): index for index, entry in enumerate(entries)}
+    chunks = []
+    for pilot in as_completed(pilots):
+      # the rest of an entry is queued as soon as its own pilot is back, the pool never waits for the slowest pilot
+      index = pilots[pilot]
+      entry = entries[index]
+      entry.summary.merge(pilot.result())
+      entry.chunks = 1
+      for chunk in plan_chunks(index, entry, target_cost):
+        chunks.append((chunk, executor.submit(run_cell, entry.spec_json, chunk[2], derive_seed(entry.seed, chunk[3]),
+                                              dice)))
+    logging.info('Fighting {} chunks of {} encounters over {} workers'.format(len(chunks), len(entries), workers))
+    # merge in chunk order so the results do not depend on which worker finished first
+    chunks.sort(key=lambda item: (item[0][1], item[0][3]))
+    for (_, index, _, _), future in chunks:
+      entries[index].summary.merge(future.result())
+  return entries
+
+
+def write_results(entries, path, dice, workers, seconds, confidence=0.95):
+  """Writes the results of every entry to one JSON file."""
+  with open(path, 'w') as results_file:
+    json.dump({'dice': dice,
+               'workers': workers,
+               'seconds': seconds,
+               'fights': sum(entry.summary.fights for entry in entries),
+               'encounters': [entry.as_dict(confidence) for entry in entries]}, results_file, indent=2)
+    results_file.write('\n')
+
+
+def parse_arguments(argv=None):
+  """Parses the command line options of the manifest runner."""
+  parser = argparse.ArgumentParser(description='Fight every encounter of a manifest on one pool of worker processes '
+                                               'and write the results to a single file.')
+  parser.add_argument('manifest', help='The manifest file, e.g. manifests/example.json.')
+  parser.add_argument('-o', '--output', default='results.json', help='The JSON file to write the results to.')
+  parser.add_argument('--workers', type=int, default=None, help='The number of processes, defaults to the number '
+                                                                'of cores.')
+  parser.add_argument('--pilot', type=int, default=50, help='The number of combats of the pilot chunk of every '
+                                                            'encounter, used to estimate its cost.')
+  parser.add_argument('--confidence', type=float, default=0.95, help='The confidence level of the intervals.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  options = parse_arguments(argv)
+  entries, dice = load_manifest(options.manifest)
+  workers = options.workers or os.cpu_count() or 1
+  start = time.perf_counter()
+  run_manifest(entries, workers, dice, options.pilot)
+  seconds = time.perf_counter() - start
+  write_results(entries, options.output, dice, workers, seconds, options.confidence)
+  for entry in entries:
+    low, high = entry.summary.interval(0, 'win', options.confidence)
+    print('{:<30} {:>8} combats  player win {:>7.2%} ({:.2%} to {:.2%})'.format(entry.name, entry.summary.fights,
+                                                                               entry.summary.wins[0] /
+                                                                               entry.summary.fights, low, high))
+  print('{} combats in {:.1f}s, results written to {}'.format(sum(entry.summary.fights for entry in entries), seconds,
+                                                             options.output))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,453 @@
+"""A grid map for combats with positions, movement, reach and ranged attacks.
+
+Without a map every creature can attack every opponent. Fought on a BattleMap (see CombatEngine.run_combat) every
+creature stands on a square of the grid, 5 feet to a side, and on its turn it:
+  * attacks an opponent within reach (the next square) in melee if there is one,
+  * else shoots an opponent within the short range of one of its RangedWeapons, or within the long range with
+    disadvantage (a ranged attack with an opponent within reach has disadvantage too),
+  * else moves up to its speed towards the nearest opponent, and attacks in melee if that brings one within reach.
+Distances follow the usual grid rule that a diagonal step is 5 feet, so the distance is the larger of the two offsets.
+
+The map keeps the positions of the creatures standing in a SpatialHash, a dictionary of square cells of a few grid
+squares each. "Opponents within 60 feet" only looks at the cells that overlap the range and "the nearest opponent"
+searches outwards ring by ring, so both cost in proportion to the creatures nearby instead of all of the combatants.
+Distances are kept in a table for the round, a creature that moves only drops its own entries.
+
+A map can have Terrain (see Terrain.py): creatures do not stand on or walk through walls, walk around them along the
+distance field of the square they head for, pay double for difficult terrain and only shoot opponents they can see.
+The terrain keeps its line of sight and distance fields between combats, so a map fought over and over works them out
+once. An encounter file can draw the terrain of its map, see EncounterConstructs.
+
+Use it like so:
+  battle_map = BattleMap.line_up(teams, distance=60)
+  run_combat(teams, rng, sink, state, battle_map=battle_map)
+or place the creatures one by one with battle_map.place(creature, x, y). Every combat starts from the placed positions.
+line_up(teams, 60, terrain=Terrain.from_rows(rows)) lines the teams up in the middle of a terrain.
+"""
+
+from ItemConstructs import RangedWeapon
+
+
+FEET_PER_SQUARE = 5
+# with this few opponents left standing looking at each of them beats searching the SpatialHash
+FEW_OPPONENTS = 16
+
+
+def grid_distance(position, other):
+  """Returns the distance between two squares in squares, a diagonal step counts as one."""
+  return max(abs(position[0] - other[0]), abs(position[1] - other[1]))
+
+
+class SpatialHash:
+  """Indexes points on the grid by the square cell of cell_size x cell_size squares they fall in."""
+
+  def __init__(self, cell_size=4):
+    """Creates an empty index.
+
+    Args:
+        cell_size (int, optional): The width of a cell in grid squares, about the most common query radius works
+          best.
+    """
+    self.cell_size = cell_size
+    self.cells = {}
+    self.positions = {}
+    # the bounding box of the cells ever used, where the search for the nearest point stops
+    self.low = None
+    self.high = None
+
+  def __len__(self):
+    return len(self.positions)
+
+  def cell_of(self, position):
+    """Returns the cell a square falls in."""
+    return position[0] // self.cell_size, position[1] // self.cell_size
+
+  def insert(self, key, position):
+    """Adds a point, e.g. a combatant by its index."""
+    self.positions[key] = position
+    cell = self.cell_of(position)
+    self.cells.setdefault(cell, []).append(key)
+    if self.low is None:
+      self.low, self.high = cell, cell
+    else:
+      self.low = (min(self.low[0], cell[0]), min(self.low[1], cell[1]))
+      self.high = (max(self.high[0], cell[0]), max(self.high[1], cell[1]))
+
+  def remove(self, key):
+    """Removes a point, if it is in the index."""
+    position = self.positions.pop(key, None)
+    if position is None:
+      return
+    cell = self.cell_of(position)
+    members = self.cells[cell]
+    members.remove(key)
+    if not members:
+      del self.cells[cell]
+
+  def move(self, key, position):
+    """Moves a point, only touching the cells if it moves to another one."""
+    if self.cell_of(self.positions[key]) == self.cell_of(position):
+      self.positions[key] = position
+    else:
+      self.remove(key)
+      self.insert(key, position)
+
+  def candidates(self, position, radius):
+    """Yields the points in the cells that overlap the square of radius squares around a position.
+
+    Some of them can be further away than radius, the caller checks their distance.
+    """
+    cell_size = self.cell_size
+    cells = self.cells
+    for cell_x in range((position[0] - radius) // cell_size, (position[0] + radius) // cell_size + 1):
+      for cell_y in range((position[1] - radius) // cell_size, (position[1] + radius) // cell_size + 1):
+        members = cells.get((cell_x, cell_y))
+        if members:
+          yield from members
+
+  def ring(self, cell, ring):
+    """Yields the points in the cells exactly ring cells away from a cell, skipping the cells never used."""
+    cells = self.cells
+    cell_x, cell_y = cell
+    (low_x, low_y), (high_x, high_y) = self.low, self.high
+    if ring == 0:
+      yield from cells.get(cell, ())
+      return
+    first_x, last_x = max(cell_x - ring, low_x), min(cell_x + ring, high_x)
+    for row in (cell_y - ring, cell_y + ring):
+      if low_y <= row <= high_y:
+        for column in range(first_x, last_x + 1):
+          yield from cells.get((column, row), ())
+    first_y, last_y = max(cell_y - ring + 1, low_y), min(cell_y + ring - 1, high_y)
+    for column in (cell_x - ring, cell_x + ring):
+      if low_x <= column <= high_x:
+        for row in range(first_y, last_y + 1):
+          yield from cells.get((column, row), ())
+
+  def nearest(self, position, accept=None):
+    """Returns the key of the nearest (accepted) point and its distance, (None, None) if there is none.
+
+    Args:
+        position (tuple of int): The (x, y) square to search from.
+        accept (callable, optional): Takes a key and returns True for the points that count, all of them by default.
+
+    Returns:
+        tuple: The key and the distance in squares, ties go to the lowest key.
+    """
+    if self.low is None:
+      return None, None
+    cell = self.cell_of(position)
+    # beyond this ring there are no cells that were ever used
+    last_ring = max(abs(cell[0] - self.low[0]), abs(cell[0] - self.high[0]),
+                    abs(cell[1] - self.low[1]), abs(cell[1] - self.high[1]))
+    best, best_distance = None, None
+    for ring in range(last_ring + 1):
+      # every square in this ring is at least this far away
+      if best is not None and (ring - 1) * self.cell_size + 1 > best_distance:
+        break
+      for key in self.ring(cell, ring):
+        if accept is not None and not accept(key):
+          continue
+        distance = grid_distance(position, self.positions[key])
+        if best is None or distance < best_distance or (distance == best_distance and key < best):
+          best, best_distance = key, distance
+    return best, best_distance
+
+
+class BattleMap:
+  """The grid, the starting positions of the creatures and their positions during a combat."""
+
+  def __init__(self, width, height, cell_size=4, terrain=None):
+    """Creates an empty map.
+
+    Args:
+        width (int): The width of the map in squares.
+        height (int): The height of the map in squares.
+        cell_size (int, optional): The cell size of the SpatialHash, in squares.
+        terrain (Terrain/Terrain, optional): The walls and difficult terrain of the map, of the same size. Without it
+          every square is open ground.
+    """
+    if terrain is not None and (terrain.width, terrain.height) != (width, height):
+      raise ValueError('The {}x{} terrain does not fit the {}x{} map'.format(terrain.width, terrain.height, width,
+                                                                            height))
+    self.width = width
+    self.height = height
+    self.cell_size = cell_size
+    self.terrain = terrain
+    self.start_positions = {}
+    self.speeds = {}
+    # filled in by start_combat
+    self.state = None
+    # a SpatialHash of the creatures standing per team, so searches for opponents never look at allies
+    self.indexes = []
+    self.positions = []
+    self.occupied = set()
+    self.team = None
+    self.steps = []
+    self.melee = []
+    self.ranged = []
+    self.distances = {}
+    self.distance_keys = []
+    # True until somebody attacks or moves in the round
+    self.stalled = False
+
+  def __repr__(self):
+    return 'BattleMap({}x{} squares, {} creatures placed)'.format(self.width, self.height, len(self.start_positions))
+
+  @classmethod
+  def line_up(cls, teams, distance=60, spacing=1, terrain=None):
+    """Builds a map with every team standing in a line, the lines distance feet apart with as much room at their ends.
+
+    Args:
+        teams (list of GameConstructs/Team): The teams, the first line is the first team.
+        distance (int, optional): The distance between the lines in feet.
+        spacing (int, optional): The number of squares between two creatures of a line.
+        terrain (Terrain/Terrain, optional): The terrain of the map. The map takes its size and the lines stand in
+          the middle of it, so it has to be large enough for them and have no walls where the creatures stand.
+
+    Returns:
+        BattleMap: The map with every creature placed.
+    """
+    gap = max(1, distance // FEET_PER_SQUARE)
+    longest = max(len(team.team_members) for team in teams)
+    width, length = gap * (len(teams) - 1) + 1, (longest - 1) * spacing + 1
+    if terrain is None:
+      # leave room on both ends of the lines to walk around them
+      left, top = 0, gap
+      battle_map = cls(width, length + 2 * gap)
+    else:
+      if terrain.width < width or terrain.height < length:
+        raise ValueError('The {}x{} terrain is too small for lines of {} squares {} squares apart'.format(
+          terrain.width, terrain.height, length, gap))
+      left, top = (terrain.width - width) // 2, (terrain.height - length) // 2
+      battle_map = cls(terrain.width, terrain.height, terrain=terrain)
+    for team_number, team in enumerate(teams):
+      # centre the shorter lines on the longer ones
+      offset = top + (longest - len(team.team_members)) * spacing // 2
+      for member_number, creature in enumerate(team.team_members):
+        battle_map.place(creature, left + team_number * gap, offset + member_number * spacing)
+    return battle_map
+
+  def place(self, creature, x, y, speed=30):
+    """Places a creature on the square it starts every combat on.
+
+    Args:
+        creature (BaseCreature or subclass): The creature.
+        x (int): The column of the square, from 0 to width - 1.
+        y (int): The row of the square, from 0 to height - 1.
+        speed (int, optional): How many feet the creature moves per turn.
+    """
+    if not (0 <= x < self.width and 0 <= y < self.height):
+      raise ValueError('({}, {}) is not on the {}x{} map'.format(x, y, self.width, self.height))
+    if self.terrain is not None and not self.terrain.passable((x, y)):
+      raise ValueError('({}, {}) is a wall'.format(x, y))
+    self.start_positions[creature] = (x, y)
+    self.speeds[creature] = speed
+
+  def start_combat(self, state):
+    """Puts the creatures standing back on their starting squares, CombatEngine.run_combat calls this.
+
+    Args:
+        state (GameConstructs/CombatState): The state of the combat, after its reset.
+    """
+    combatants = state.combatants
+    missing = [creature.name for creature in combatants if creature not in self.start_positions]
+    if missing:
+      raise ValueError('{} are not placed on the map'.format(', '.join(missing)))
+    self.state = state
+    self.team = state.team
+    self.positions = [self.start_positions[creature] for creature in combatants]
+    self.steps = [self.speeds[creature] // FEET_PER_SQUARE for creature in combatants]
+    self.melee = []
+    self.ranged = []
+    for creature in combatants:
+      weapons = creature.get_attack_weapons()
+      self.melee.append(any(not isinstance(weapon, RangedWeapon) for weapon in weapons))
+      # (weapon, profile, short range, long range) in squares, the longest reaching first
+      ranged = [(weapon, creature.get_weapon_attack_profile(weapon), weapon.range_short // FEET_PER_SQUARE,
+                 weapon.range_long // FEET_PER_SQUARE)
+                for weapon in creature.weapons if isinstance(weapon, RangedWeapon)]
+      ranged.sort(key=lambda attack: attack[3], reverse=True)
+      self.ranged.append(ranged)
+    self.indexes = [SpatialHash(self.cell_size) for _ in state.teams]
+    self.occupied = set()
+    for index, position in enumerate(self.positions):
+      if state.alive[index]:
+        self.indexes[self.team[index]].insert(index, position)
+        self.occupied.add(position)
+    self.distances = {}
+    self.distance_keys = [[] for _ in combatants]
+
+  def new_round(self):
+    """Starts a new distance table."""
+    self.stalled = True
+    self.distances = {}
+    for keys in self.distance_keys:
+      del keys[:]
+
+  def distance(self, index, other):
+    """Returns the distance between two combatants in squares, from the table of the round."""
+    key = (index, other) if index < other else (other, index)
+    distance = self.distances.get(key)
+    if distance is None:
+      distance = self.distances[key] = grid_distance(self.positions[index], self.positions[other])
+      self.distance_keys[index].append(key)
+      self.distance_keys[other].append(key)
+    return distance
+
+  def remove(self, index):
+    """Takes a combatant that dropped off the map."""
+    self.indexes[self.team[index]].remove(index)
+    self.occupied.discard(self.positions[index])
+
+  def revive(self, index):
+    """Puts a combatant that got back up on the map, where it dropped or on the nearest free square to it."""
+    position = self.positions[index]
+    for radius in range(max(self.width, self.height)):
+      free = [(x, y) for x in range(position[0] - radius, position[0] + radius + 1)
+              for y in range(position[1] - radius, position[1] + radius + 1)
+              if grid_distance((x, y), position) == radius and 0 <= x < self.width and 0 <= y < self.height
+              and (x, y) not in self.occupied and (self.terrain is None or self.terrain.passable((x, y)))]
+      if free:
+        position = min(free, key=lambda square: (square[1], square[0]))
+        break
+    else:
+      raise ValueError('No free square on the map for {}'.format(self.state.combatants[index].name))
+    self.positions[index] = position
+    self.indexes[self.team[index]].insert(index, position)
+    self.occupied.add(position)
+    for key in self.distance_keys[index]:
+      self.distances.pop(key, None)
+    del self.distance_keys[index][:]
+
+  def opponents_within(self, index, squares):
+    """Returns the opponents standing within a number of squares of a combatant, in combatant order."""
+    own_team = self.team[index]
+    position = self.positions[index]
+    return sorted(other for team_index, team_hash in enumerate(self.indexes) if team_index != own_team
+                  for other in team_hash.candidates(position, squares) if self.distance(index, other) <= squares)
+
+  def nearest_opponent(self, index):
+    """Returns the nearest opponent standing and its distance in squares, (None, None) if there is none."""
+    own_team = self.team[index]
+    state = self.state
+    best, best_distance = None, None
+    if sum(state.alive_count) - state.alive_count[own_team] > FEW_OPPONENTS:
+      for team_index, team_hash in enumerate(self.indexes):
+        if team_index != own_team:
+          other, distance = team_hash.nearest(self.positions[index])
+          if other is not None and (best is None or (distance, other) < (best_distance, best)):
+            best, best_distance = other, distance
+      return best, best_distance
+    for team_index, members in enumerate(state.alive_members):
+      if team_index != own_team:
+        for other in members:
+          distance = self.distance(index, other)
+          if best is None or distance < best_distance or (distance == best_distance and other < best):
+            best, best_distance = other, distance
+    return best, best_distance
+
+  def move_towards(self, index, goal):
+    """Moves a combatant up to its speed towards a square, stopping next to it, and returns the new position."""
+    if self.terrain is not None:
+      return self.walk_towards(index, goal)
+    x, y = self.positions[index]
+    occupied = self.occupied
+    for _ in range(self.steps[index]):
+      distance = grid_distance((x, y), goal)
+      if distance <= 1:
+        break
+      # the free square next to this one that gets closest to the goal, straight towards it on a tie
+      best, best_key = None, None
+      for step_x in (-1, 0, 1):
+        for step_y in (-1, 0, 1):
+          square = (x + step_x, y + step_y)
+          if square in occupied or not (0 <= square[0] < self.width and 0 <= square[1] < self.height):
+            continue
+          offset_x, offset_y = abs(square[0] - goal[0]), abs(square[1] - goal[1])
+          key = (max(offset_x, offset_y), offset_x + offset_y)
+          if key[0] < distance and (best_key is None or key < best_key):
+            best, best_key = square, key
+      if best is None:
+        break
+      x, y = best
+    return self.move_to(index, (x, y))
+
+  def walk_towards(self, index, goal):
+    """Moves a combatant towards a square around the walls of the terrain, down its distance field."""
+    terrain = self.terrain
+    width = terrain.width
+    costs = terrain.costs
+    field = terrain.distance_field(goal)
+    occupied = self.occupied
+    x, y = self.positions[index]
+    budget = self.steps[index]
+    while budget > 0 and grid_distance((x, y), goal) > 1:
+      # the free square next to this one that is the cheapest walk from the goal, the closest to it on a tie
+      best, best_key = None, None
+      for step_x in (-1, 0, 1):
+        for step_y in (-1, 0, 1):
+          square = (x + step_x, y + step_y)
+          if square in occupied or not terrain.passable(square):
+            continue
+          key = (field[square[1] * width + square[0]], grid_distance(square, goal))
+          if key[0] < field[y * width + x] and (best_key is None or key < best_key):
+            best, best_key = square, key
+      if best is None or costs[best[1] * width + best[0]] > budget:
+        break
+      budget -= costs[best[1] * width + best[0]]
+      x, y = best
+    return self.move_to(index, (x, y))
+
+  def move_to(self, index, position):
+    """Puts a combatant on a new square, dropping its distances from the table, and returns the square."""
+    if position != self.positions[index]:
+      self.occupied.discard(self.positions[index])
+      self.occupied.add(position)
+      self.positions[index] = position
+      self.indexes[self.team[index]].move(index, position)
+      for key in self.distance_keys[index]:
+        self.distances.pop(key, None)
+      del self.distance_keys[index][:]
+    return position
+
+  def plan_turn(self, index, creature, sink):
+    """Moves a combatant if it has to and returns what it can attack this turn.
+
+    Args:
+        index (int): The combatant slot of the creature whose turn it is.
+        creature (BaseCreature or subclass): The creature.
+        sink (CombatEvents/NullSink or subclass): Receives the move.
+
+    Returns:
+        tuple: The indices of the opponents it can attack, in combatant order (empty if none), the (weapon,
+          AttackProfile) of its ranged attack or None for melee, and whether the attacks have disadvantage.
+    """
+    for moved in (False, True):
+      if self.melee[index]:
+        in_reach = self.opponents_within(index, 1)
+        if in_reach:
+          self.stalled = False
+          return in_reach, None, False
+      for weapon, profile, range_short, range_long in self.ranged[index]:
+        in_range = self.opponents_within(index, range_long)
+        if in_range and self.terrain is not None:
+          position = self.positions[index]
+          in_range = [other for other in in_range if self.terrain.can_see(position, self.positions[other])]
+        if in_range:
+          close = [other for other in in_range if self.distance(index, other) <= range_short]
+          # shooting with an opponent within reach or beyond the short range has disadvantage
+          engaged = bool(self.opponents_within(index, 1))
+          self.stalled = False
+          return close or in_range, (weapon, profile), engaged or not close
+      if moved:
+        break
+      nearest, _ = self.nearest_opponent(index)
+      if nearest is None:
+        break
+      position = self.positions[index]
+      if self.move_towards(index, self.positions[nearest]) == position:
+        break
+      self.stalled = False
+      sink.move(creature, self.positions[index])
+    return [], None, False
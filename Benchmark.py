@@ -0,0 +1,398 @@
+"""Measures how fast the engines fight encounters, to catch performance regressions.
+
+Every scenario is the encounter of get_players() and get_monsters() in '5e_combat_simulator.py', as is (4v3) or
+scaled to other sizes by taking more (or fewer) copies of the same creatures: 1v1, 4v3, 20v20 and 200v200. Each
+scenario is fought by every engine:
+
+  * serial/none, serial/counters and serial/text: the loop of main() with each of its output modes (the narration is
+    written to os.devnull).
+  * serial/map: the loop of main() without output, on a BattleMap/BattleMap with the teams lined up 60 feet apart.
+  * serial/terrain: the same on a map with Terrain/Terrain, broken walls and difficult terrain between the lines.
+  * parallel: ParallelRunner.run_parallel over all the cores.
+  * serial/numpy-dice: the loop of main() without output, rolling with the Dice/NumpyDice backend.
+  * batch: BatchEngine.run_batch.
+  * squad: SquadEngine.run_squads, the identical creatures of a scenario fought as squads.
+The engines that need NumPy are skipped if it is not installed.
+
+For each of them it records the encounters per second and the attacks per second, and, in a separate pass so the
+tracing does not slow down the timings, the peak traced memory of fighting the encounters and the memory blocks a fight
+leaves allocated (which should be 0, anything else is a leak or a cache growing without bound).
+
+Run it like so:
+  python Benchmark.py --save                 # measure and write benchmarks/baseline.json
+  python Benchmark.py                        # measure and compare against the baseline
+  python Benchmark.py --scenario 4v3 --threshold 0.1
+
+It exits with status 1 if the encounters per second of any benchmark fell by more than the threshold (20% by
+default) compared to the baseline. Baselines are only comparable on the same machine.
+"""
+
+from BattleMap import BattleMap
+from CombatEngine import run_combat
+from CombatEvents import CounterSink, NULL_SINK, TextSink
+from Dice import make_dice
+from GameConstructs import CombatState, Team
+from ParallelRunner import run_parallel
+from Terrain import DIFFICULT, Terrain, WALL
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+
+SCENARIOS = {'1v1': (1, 1), '4v3': (4, 3), '20v20': (20, 20), '200v200': (200, 200)}
+SERIAL_OUTPUTS = ('none', 'counters', 'text')
+# every engine get_engines can return, the ones after 'parallel' need NumPy
+ENGINES = tuple('serial/{}'.format(output) for output in SERIAL_OUTPUTS) + ('serial/map', 'serial/terrain', 'parallel',
+                                                                            'serial/numpy-dice', 'batch', 'squad')
+DEFAULT_BASELINE = os.path.join('benchmarks', 'baseline.json')
+
+
+def load_simulator():
+  """Imports '5e_combat_simulator.py', which can not be imported by name as it starts with a digit."""
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '5e_combat_simulator.py')
+  spec = importlib.util.spec_from_file_location('combat_simulator', path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def repeat_creatures(build, count):
+  """Takes count creatures from as many fresh lists built by build() as needed, in order.
+
+  Args:
+      build (function): Returns a new list of creatures every time it is called, e.g. get_players.
+      count (int): The number of creatures wanted.
+
+  Returns:
+      list of BaseCreature or its subclasses: The creatures.
+  """
+  creatures = []
+  while len(creatures) < count:
+    creatures.extend(build()[:count - len(creatures)])
+  return creatures
+
+
+def build_scenario(name, simulator=None):
+  """Builds new teams for a scenario.
+
+  Args:
+      name (str): One of the keys of SCENARIOS.
+      simulator (module, optional): The loaded '5e_combat_simulator.py', loaded here if not given.
+
+  Returns:
+      list of GameConstructs/Team: The players and the monsters, with a score of 0.
+  """
+  simulator = simulator or load_simulator()
+  num_players, num_monsters = SCENARIOS[name]
+  player_team = Team('Players')
+  monster_team = Team('Monsters')
+  player_team.team_members = repeat_creatures(simulator.get_players, num_players)
+  monster_team.team_members = repeat_creatures(simulator.get_monsters, num_monsters)
+  return [player_team, monster_team]
+
+
+def serial_fights(output, dice='random'):
+  """Returns a function that fights combats like the serial loop of main() does, with one of its output modes.
+
+  Args:
+      output (str): 'none', 'counters' or 'text'.
+      dice (str, optional): The Dice backend to roll with.
+
+  Returns:
+      function: fight(teams, num_fights, seed), returns the number of attacks made.
+  """
+  def fight(teams, num_fights, seed):
+    counter = CounterSink()
+    if output == 'text':
+      stream = open(os.devnull, 'w')
+      sink = TextSink(stream)
+    else:
+      stream = None
+      sink = counter if output == 'counters' else NULL_SINK
+    rng = make_dice(dice, seed)
+    state = CombatState(teams)
+    try:
+      for _ in range(num_fights):
+        state.reset()
+        run_combat(teams, rng, sink, state)
+    finally:
+      # leave the creatures at their starting hit points for the next run
+      state.reset()
+      if stream:
+        stream.close()
+    return counter.attacks if output == 'counters' else None
+  return fight
+
+
+def map_fights(teams, num_fights, seed, battle_map=None):
+  """Fights combats on a BattleMap/BattleMap, by default with the teams lined up 60 feet apart, uncounted."""
+  if battle_map is None:
+    battle_map = BattleMap.line_up(teams, 60)
+  rng = make_dice('random', seed)
+  state = CombatState(teams)
+  try:
+    for _ in range(num_fights):
+      state.reset()
+      run_combat(teams, rng, state=state, battle_map=battle_map)
+  finally:
+    state.reset()
+  return None
+
+
+def terrain_fights(teams, num_fights, seed):
+  """Fights combats like map_fights with a broken wall and difficult terrain between the lines, uncounted.
+
+  The creatures walk through the gaps of the wall and only shoot the opponents they can see past it.
+  """
+  open_map = BattleMap.line_up(teams, 60)
+  terrain = Terrain(open_map.width, open_map.height)
+  middle = open_map.width // 2
+  for y in range(open_map.height):
+    # two squares of wall, then two of gap
+    if y % 4 < 2:
+      terrain.set_square((middle, y), WALL)
+    for x in (middle - 1, middle + 1):
+      terrain.set_square((x, y), DIFFICULT)
+  return map_fights(teams, num_fights, seed, BattleMap.line_up(teams, 60, terrain=terrain))
+
+
+def parallel_fights(teams, num_fights, seed):
+  """Fights combats with ParallelRunner.run_parallel over all the cores, the attacks are not counted."""
+  run_parallel(teams, num_fights, seed)
+  return None
+
+
+def batch_fights(teams, num_fights, seed):
+  """Fights combats with BatchEngine.run_batch, the attacks are not counted."""
+  from BatchEngine import run_batch
+  run_batch(teams, num_fights, seed)
+  return None
+
+
+def squad_fights(teams, num_fights, seed):
+  """Fights combats with SquadEngine.run_squads, the attacks are not counted."""
+  from SquadEngine import run_squads
+  run_squads(teams, num_fights, seed)
+  return None
+
+
+def get_engines():
+  """Returns the engines to benchmark keyed by name, the ones that need NumPy only if it is installed."""
+  engines = {'serial/{}'.format(output): serial_fights(output) for output in SERIAL_OUTPUTS}
+  engines['serial/map'] = map_fights
+  engines['serial/terrain'] = terrain_fights
+  engines['parallel'] = parallel_fights
+  try:
+    import numpy
+  except ImportError:
+    logging.info('NumPy is not installed, skipping the engines that need it')
+  else:
+    engines['serial/numpy-dice'] = serial_fights('none', 'numpy')
+    engines['batch'] = batch_fights
+    engines['squad'] = squad_fights
+  return engines
+
+
+def count_attacks(teams, num_fights, seed, dice='random'):
+  """Returns the number of attacks the serial engine makes in num_fights combats from this seed."""
+  return serial_fights('counters', dice)(teams, num_fights, seed)
+
+
+def time_fights(fight, teams, min_seconds, seed):
+  """Fights more and more combats until the run takes at least min_seconds.
+
+  Args:
+      fight (function): fight(teams, num_fights, seed) from one of the engines.
+      teams (list of GameConstructs/Team): The teams, fresh from build_scenario.
+      min_seconds (float): The shortest run that is long enough to time.
+      seed (int): The seed of every run.
+
+  Returns:
+      tuple: The number of combats of the last run and the seconds it took.
+  """
+  num_fights = 1
+  while True:
+    start = time.perf_counter()
+    fight(teams, num_fights, seed)
+    seconds = time.perf_counter() - start
+    if seconds >= min_seconds:
+      return num_fights, seconds
+    # aim a little past min_seconds with the next run, at most 10 times as many combats
+    num_fights = max(num_fights + 1, min(num_fights * 10, int(num_fights * 1.2 * min_seconds / max(seconds, 1e-6))))
+
+
+def measure_memory(fight, teams, num_fights, seed):
+  """Returns the peak traced memory of fighting combats and the memory blocks left allocated per combat.
+
+  The combats are fought once before measuring, so the caches that fill up on the first combat are not counted.
+  """
+  fight(teams, num_fights, seed)
+  tracemalloc.start()
+  try:
+    blocks = sys.getallocatedblocks()
+    fight(teams, num_fights, seed)
+    retained_blocks = sys.getallocatedblocks() - blocks
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return peak, retained_blocks / num_fights
+
+
+def run_benchmark(scenario, engine, fight, min_seconds=1.0, seed=0, simulator=None):
+  """Measures one engine on one scenario.
+
+  Args:
+      scenario (str): One of the keys of SCENARIOS.
+      engine (str): The name of the engine, see get_engines.
+      fight (function): fight(teams, num_fights, seed) of the engine.
+      min_seconds (float, optional): How long the timed run takes at least.
+      seed (int, optional): The seed of every run.
+      simulator (module, optional): The loaded '5e_combat_simulator.py'.
+
+  Returns:
+      dict: The measurements.
+  """
+  simulator = simulator or load_simulator()
+  num_fights, seconds = time_fights(fight, build_scenario(scenario, simulator), min_seconds, seed)
+  encounters_per_second = num_fights / seconds
+
+  # the serial engine with the same seed makes exactly the same attacks whatever its output mode
+  attacks_per_second = None
+  if engine.startswith('serial'):
+    dice = 'numpy' if engine.endswith('numpy-dice') else 'random'
+    attacks = count_attacks(build_scenario(scenario, simulator), num_fights, seed, dice)
+    attacks_per_second = attacks / seconds
+
+  memory_fights = max(1, min(num_fights, 100))
+  peak_memory, retained_blocks = measure_memory(fight, build_scenario(scenario, simulator), memory_fights, seed)
+
+  result = {'fights': num_fights,
+            'seconds': round(seconds, 4),
+            'encounters_per_second': round(encounters_per_second, 2),
+            'attacks_per_second': round(attacks_per_second, 2) if attacks_per_second is not None else None,
+            'peak_memory_bytes': peak_memory,
+            'retained_blocks_per_fight': round(retained_blocks, 3)}
+  logging.info('{} {}: {}'.format(scenario, engine, result))
+  return result
+
+
+def run_suite(scenarios=None, engines=None, min_seconds=1.0, seed=0):
+  """Runs every engine on every scenario.
+
+  Args:
+      scenarios (list of str, optional): The scenarios to run, all of SCENARIOS by default.
+      engines (list of str, optional): The engines to run, all of get_engines() by default.
+      min_seconds (float, optional): How long each timed run takes at least.
+      seed (int, optional): The seed of every run.
+
+  Returns:
+      dict: The environment and the measurements keyed by 'scenario/engine'.
+  """
+  simulator = load_simulator()
+  available = get_engines()
+  results = {}
+  for scenario in scenarios or SCENARIOS:
+    for engine in engines or available:
+      if engine not in available:
+        raise ValueError('Unknown or unavailable engine {}, pick from {}'.format(engine, ', '.join(available)))
+      results['{}/{}'.format(scenario, engine)] = run_benchmark(scenario, engine, available[engine], min_seconds,
+                                                                seed, simulator)
+  return {'python': platform.python_version(),
+          'machine': platform.machine(),
+          'cpus': os.cpu_count(),
+          'results': results}
+
+
+def compare(report, baseline, threshold=0.2):
+  """Compares the encounters per second of a report against a baseline.
+
+  Args:
+      report (dict): The output of run_suite.
+      baseline (dict): A previous output of run_suite.
+      threshold (float, optional): The largest allowed relative drop, e.g. 0.2 for 20%.
+
+  Returns:
+      list of str: A description of every benchmark that regressed past the threshold, empty if none did.
+  """
+  regressions = []
+  for key, result in report['results'].items():
+    previous = baseline.get('results', {}).get(key)
+    if not previous or not previous.get('encounters_per_second'):
+      continue
+    change = result['encounters_per_second'] / previous['encounters_per_second'] - 1
+    if change < -threshold:
+      regressions.append('{}: {:.2f} encounters/s, was {:.2f} ({:+.1%})'.format(
+        key, result['encounters_per_second'], previous['encounters_per_second'], change))
+  return regressions
+
+
+def format_report(report, baseline=None):
+  """Renders the measurements as a table, with the change against the baseline if there is one."""
+  lines = ['{:<28} {:>10} {:>14} {:>12} {:>12} {:>9}'.format('benchmark', 'fights/s', 'attacks/s', 'peak KiB',
+                                                             'blocks/fight', 'change')]
+  for key, result in report['results'].items():
+    previous = (baseline or {}).get('results', {}).get(key)
+    change = ''
+    if previous and previous.get('encounters_per_second'):
+      change = '{:+.1%}'.format(result['encounters_per_second'] / previous['encounters_per_second'] - 1)
+    attacks = result['attacks_per_second']
+    lines.append('{:<28} {:>10.2f} {:>14} {:>12.1f} {:>12.3f} {:>9}'.format(
+      key, result['encounters_per_second'], '{:.0f}'.format(attacks) if attacks is not None else '-',
+      result['peak_memory_bytes'] / 1024, result['retained_blocks_per_fight'], change))
+  return '\n'.join(lines)
+
+
+def parse_arguments(argv=None):
+  """Parses the command line options of the benchmark suite."""
+  parser = argparse.ArgumentParser(description='Benchmark the combat engines and compare against a baseline.')
+  parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                      help='A scenario to run, may be given several times. Defaults to all of them.')
+  parser.add_argument('--engine', action='append',
+                      help='An engine to run ({}), may be given several times. Defaults to all of them.'.format(
+                        ', '.join(ENGINES)))
+  parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='The baseline JSON file.')
+  parser.add_argument('--save', action='store_true', help='Write the results to the baseline file instead of '
+                                                          'comparing against it.')
+  parser.add_argument('--threshold', type=float, default=0.2,
+                      help='Fail if the encounters per second drop by more than this fraction, e.g. 0.2.')
+  parser.add_argument('--min-seconds', type=float, default=1.0, help='How long each timed run takes at least.')
+  parser.add_argument('--seed', type=int, default=0, help='The seed of every run.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  options = parse_arguments(argv)
+  report = run_suite(options.scenario, options.engine, options.min_seconds, options.seed)
+
+  baseline = None
+  if not options.save and os.path.exists(options.baseline):
+    with open(options.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+  print(format_report(report, baseline))
+
+  if options.save:
+    if os.path.dirname(options.baseline):
+      os.makedirs(os.path.dirname(options.baseline), exist_ok=True)
+    with open(options.baseline, 'w') as baseline_file:
+      json.dump(report, baseline_file, indent=2)
+      baseline_file.write('\n')
+    print('Saved the baseline to {}'.format(options.baseline))
+    return 0
+
+  if baseline is None:
+    print('No baseline at {}, run with --save to create one'.format(options.baseline))
+    return 0
+  regressions = compare(report, baseline, options.threshold)
+  for regression in regressions:
+    print('REGRESSION {}'.format(regression))
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
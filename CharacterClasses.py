@@ -1,7 +1,9 @@
-from DamageConstructs import DamageDie
+from CombatEvents import CombatEvent, NULL_SINK
+from DamageConstructs import AttackProfile
+from DamageDistribution import dice_pmf, expected_damage, pmf_mean
 from ItemConstructs import Weapon, RangedWeapon, MonsterWeapon, Armor, Shield
-from random import choice, randint
 import logging
+import random
 
 
 class BaseCreature:
@@ -14,8 +16,22 @@ class BaseCreature:
   Create a BaseCreature like so:
   creature = BaseCreature('NAME', Max_HP, Level, Str, Dex, Con, Int, Wis, Cha, Attacks_per_round,
   ancillary_characteristics)
+
+  The stat block of a creature does not change during a combat. current_hp is the hit points the creature starts a
+  combat with, everything that changes while it is fought (hit points, initiative, targets) lives in a
+  GameConstructs/CombatState, and the AC and to hit changes of status effects in a StatusEffects/EffectEngine that
+  passes them to the attacks. Creatures use __slots__ to keep them small when thousands of encounters are held in
+  memory.
+
+  Everything an attack needs from the stat block is added up once by compile_attacks into AttackProfiles, every
+  attack after that is only the rolls and a comparison against the target's AC. Giving the creature weapons or a
+  shield throws the compiled attacks away so they are compiled again on the next attack.
   """
 
+  __slots__ = ('name', 'hp', 'current_hp', 'strength', 'dexterity', 'constitution', 'intelligence', 'wisdom',
+               'charisma', 'ac', 'num_attacks', 'weapons', 'preferred_melee_weapon', 'battle_style',
+               'resistances', 'immunities', 'compiled_attacks', 'spells')
+
   def __init__(self, name, max_hp, strength, dexterity, constitution, intelligence, wisdom, charisma,
                attacks_per_action, ancillary_characteristics):
     """Creating objects of this class need many attributes in order to complete a combat.
@@ -55,6 +71,12 @@ class BaseCreature:
     # give a preferred melee weapon slot
     self.preferred_melee_weapon = None
 
+    # (weapon, AttackProfile) pairs built by compile_attacks
+    self.compiled_attacks = None
+
+    # StatusEffects/Spell objects the creature can cast instead of attacking
+    self.spells = []
+
     try:
       self.battle_style = ancillary_characteristics['battle_style']
     except (KeyError, TypeError):
@@ -66,7 +88,7 @@ class BaseCreature:
       self.resistances = []
 
     try:
-      self.resistances = ancillary_characteristics['immunities']
+      self.immunities = ancillary_characteristics['immunities']
     except (KeyError, TypeError):
       self.immunities = []
 
@@ -101,25 +123,19 @@ class BaseCreature:
     else:
       return int(stat_score / 2) - 5
 
-  def pick_target(self, potential_opponents):
+  def pick_target(self, potential_opponents, rng=random):
     """basic logic for a creature to determine what its target is.
 
     Args:
         potential_opponents (`list` of :obj:`BaseCreature` or subclasses): A list of BaseCreature or subclass objects
           that are potential targets of the current creature.
+        rng (random.Random or module, optional): The source of the random choice of target.
 
     Returns:
       :obj: `BaseCreature` or subclasses: The target of the current attack
     """
-    try:
-      if self.previous_opponent.current_hp > 0:
-        # TODO: insert logic to find out if the creature would change its previous target
-        return self.previous_opponent
-      else:
-        return choice(potential_opponents)
-    except AttributeError:
-      # If there is no previous opponent then the creature must decide a new target
-      return choice(potential_opponents)
+    # TODO: insert logic to find out if the creature would stick to its previous target
+    return rng.choice(potential_opponents)
 
   def get_relevant_bonus(self, weapon):
     """Depending on the weapon, the bons used for attack rolls may be strength or dexterity.
@@ -132,8 +148,11 @@ class BaseCreature:
     Returns:
         (int): The best ability score bonus that the creature has for the given weapon.
     """
+    # Ranged weapons always use dexterity
+    if isinstance(weapon, RangedWeapon):
+      relevant_stat_bonus = self.get_bonus(self.dexterity)
     # If strength is the best relevant ability modifier just use that even if the weapon is finesse
-    if self.get_bonus(self.strength) > self.get_bonus(self.dexterity):
+    elif self.get_bonus(self.strength) > self.get_bonus(self.dexterity):
       relevant_stat_bonus = self.get_bonus(self.strength)
     # If the strength bonus is NOT greater and the weapon is finesse then use the dex bonus as bonus
     elif weapon.finesse:
@@ -144,47 +163,169 @@ class BaseCreature:
     return relevant_stat_bonus
 
   def get_average_melee_weapon_damage(self, damage_die):
-    """Takes in a list of damage die and returns an integer of the average damage.
+    """Takes in a list of damage die and returns the average damage.
 
     Args:
         damage_die (list of :obj:DamageDie): A list of DamageDie objects for which to get the average damage, therefore
         choosing the one with the highest average damage.
 
     Returns:
-        The calculated average damage of the damage die, and adding the relevant bonus (strength or dex depending on
-        the ability scores of the creature.
+        The exact average damage of the damage die, without the relevant bonus (strength or dex depending on the ability
+        scores of the creature).
+    """
+    return pmf_mean(dice_pmf(tuple(die.dice_size for die in damage_die)))
+
+  def give_spell(self, spell):
+    """Gives the creature a spell it casts instead of attacking when it has something to do, see StatusEffects.
+
+    Args:
+        spell (:obj:StatusEffects/Spell): The spell, with the number of times it can be cast per combat.
+    """
+    self.spells.append(spell)
+
+  def get_attack_weapons(self):
+    """Returns the weapons the creature chooses from when it attacks.
+
+    Returns:
+        (list of :obj:Weapon or :obj:MonsterWeapon): The weapons, a creature without weapons has none.
+    """
+    return []
+
+  def get_weapon_attack_profile(self, weapon):
+    """Adds up all the bonuses of attacking with a weapon.
+
+    Abstract: how the bonuses add up depends on the kind of creature, so every subclass overrides it (PlayerCharacter
+    adds its proficiency and ability bonus, a Monster's weapons come with their bonuses). A BaseCreature has no weapons
+    to attack with (see get_attack_weapons), so it never gets here.
+
+    Args:
+        weapon (:obj:Weapon or :obj:MonsterWeapon): The weapon to attack with.
+
+    Returns:
+        (:obj:AttackProfile): The attack with the weapon.
+    """
+    raise NotImplementedError('{} does not know how to attack with {}'.format(type(self).__name__, weapon))
+
+  def get_attack_profiles(self):
+    """Returns the attacks the creature chooses from when it attacks.
+
+    Returns:
+        (list of :obj:AttackProfile): One profile per weapon the creature may attack with, with all of its bonuses
+          added up. A creature without weapons has no profiles.
     """
-    average_damage = 0
-    for die in damage_die:
-      average_damage = average_damage + (die.dice_size / 2)
-    return average_damage
+    return [self.get_weapon_attack_profile(weapon) for weapon in self.get_attack_weapons()]
+
+  def compile_attacks(self):
+    """Adds up the attacks of the creature once, melee_attack uses them until the weapons change.
+
+    Returns:
+        (tuple): (weapon, AttackProfile) pairs, one per weapon the creature may attack with.
+    """
+    self.compiled_attacks = tuple((weapon, self.get_weapon_attack_profile(weapon))
+                                  for weapon in self.get_attack_weapons())
+    return self.compiled_attacks
+
+  def melee_attack(self, target, rng=random, sink=NULL_SINK, to_hit=0, target_ac=None):
+    """Performs melee attack with one of the compiled attacks, picked at random if there are several.
+
+    A natural 20 always hits and rolls the damage dice twice. A natural 1 always misses if the attack profile says so,
+    which is the case for player characters. A hit never deals less than 0 damage.
 
-  def choose_melee_weapon(self):
+    Args:
+        target (:obj:BaseCreature or subclass): The target of the melee attack.
+        rng (random.Random or module, optional): The source of the attack and damage rolls.
+        sink (CombatEvents/NullSink or subclass, optional): Receives the CombatEvent of the attack.
+        to_hit (int, optional): Added to the attack roll, e.g. from the effects on the creature this combat.
+        target_ac (int, optional): The AC of the target this combat if effects change it, target.ac by default.
+
+    Returns:
+        (:obj:CombatEvent): The outcome of the attack.
+    """
+    attacks = self.compiled_attacks
+    if attacks is None:
+      attacks = self.compile_attacks()
+    if len(attacks) > 1:
+      weapon_to_use, profile = rng.choice(attacks)
+    elif attacks:
+      weapon_to_use, profile = attacks[0]
+    else:
+      # TODO add fist logic for creatures without weapons
+      raise ValueError('{} has no melee weapon to attack with'.format(self.name))
+    return self.resolve_attack(weapon_to_use, profile, target, rng, sink, False, to_hit, target_ac)
+
+  def resolve_attack(self, weapon, profile, target, rng=random, sink=NULL_SINK, disadvantage=False, to_hit=0,
+                     target_ac=None):
+    """Rolls an attack with a compiled attack profile against a target, see melee_attack for the rules.
+
+    The target is not changed, the engine takes the damage of the event off its hit points in the
+    GameConstructs/CombatState.
+
+    Args:
+        weapon (:obj:Weapon or :obj:MonsterWeapon): The weapon the attack is made with.
+        profile (:obj:AttackProfile): The compiled attack with the weapon.
+        target (:obj:BaseCreature or subclass): The target of the attack.
+        rng (random.Random or module, optional): The source of the attack and damage rolls.
+        sink (CombatEvents/NullSink or subclass, optional): Receives the CombatEvent of the attack.
+        disadvantage (bool, optional): Roll the d20 twice and use the lower roll, e.g. for a ranged attack at long
+          range.
+        to_hit (int, optional): Added to the attack roll, on top of the to hit bonus of the profile.
+        target_ac (int, optional): The AC of the target this combat if effects change it, target.ac by default.
+
+    Returns:
+        (:obj:CombatEvent): The outcome of the attack.
+    """
+    damage_type = profile.damage_types[0] if profile.damage_types else None
+
+    d20_roll = rng.randint(1, 20)
+    if disadvantage:
+      d20_roll = min(d20_roll, rng.randint(1, 20))
+    critical_hit = d20_roll == 20
+    attack_roll = d20_roll + profile.to_hit + to_hit
+    if target_ac is None:
+      target_ac = target.ac
+
+    if (d20_roll == 1 and profile.natural_one_misses) or (not critical_hit and attack_roll < target_ac):
+      event = CombatEvent(self, target, weapon, d20_roll, attack_roll, False, False, 0, damage_type)
+      sink.attack(event)
+      return event
+
+    damage = profile.damage_bonus
+    for dice_size in profile.dice:
+      damage = damage + rng.randint(1, dice_size)
+    if critical_hit:
+      for dice_size in profile.dice:
+        damage = damage + rng.randint(1, dice_size)
+    # a negative damage bonus never heals the target, the same as DamageDistribution
+    damage = max(0, damage)
+
+    event = CombatEvent(self, target, weapon, d20_roll, attack_roll, critical_hit, True, damage, damage_type)
+    sink.attack(event)
+    return event
+
+  def choose_melee_weapon(self, target_ac=None):
     """Picks and returns a weapon to use.
 
+    Args:
+        target_ac (int, optional): If given the weapon with the highest exact expected damage against this armour class
+          is picked, otherwise the one with the highest exact average damage of a hit.
+
     Returns:
         (:obj:Weapon) Picks the best weapon based on the creatures ability scores and the power of the weapons.
     """
-    highest_average_damage = 0
+    highest_average_damage = None
     weapon_to_use = None
-    for weapon in self.weapons:
-      average_weapon_damage = 0
-      if weapon.versatile and self.shield:
-        average_weapon_damage = weapon.get_average_damage(True)
-      else:
-        average_weapon_damage = weapon.get_average_damage()
-      logging.debug(str(weapon) + 'average weapon damage = '.format(str(average_weapon_damage)))
-
-      weapon_bonus = self.get_relevant_bonus(weapon)
-      logging.debug('strength or dexterity modifier: ' + str(weapon_bonus))
-      logging.debug('average weapon damage' + str(average_weapon_damage))
-      average_weapon_damage = average_weapon_damage + weapon_bonus
-      logging.debug('average weapon damage' + str(average_weapon_damage))
-
-      if average_weapon_damage > highest_average_damage:
+    # ranged weapons are only used in melee when the creature has nothing else
+    melee_weapons = [weapon for weapon in self.weapons if not isinstance(weapon, RangedWeapon)] or self.weapons
+    for weapon in melee_weapons:
+      average_weapon_damage = expected_damage(self.get_weapon_attack_profile(weapon), target_ac)
+      logging.debug('%s average weapon damage = %s', weapon, average_weapon_damage)
+
+      if highest_average_damage is None or average_weapon_damage > highest_average_damage:
+        highest_average_damage = average_weapon_damage
         weapon_to_use = weapon
 
     self.preferred_melee_weapon = weapon_to_use
+    self.compiled_attacks = None
     return weapon_to_use
 
 
@@ -196,6 +337,8 @@ class PlayerCharacter(BaseCreature):
   Bonus_action_attack)
   """
 
+  __slots__ = ('proficiency', 'armour', 'shield')
+
   def __init__(self, name, max_hp, strength, dexterity, constitution, intelligence, wisdom,
                charisma, attacks_per_action, ancillary_characteristics, level, bonus_action_attack=False):
     """Creating objects of this class has the same attributes needed as BaseCreature object plus its level.
@@ -273,6 +416,50 @@ class PlayerCharacter(BaseCreature):
                                              self.current_hp,
                                              self.ac)
 
+  def get_weapon_damage_die(self, weapon):
+    """Returns the damage die the character rolls with a weapon, a versatile weapon is used two handed without a shield.
+
+    Args:
+        weapon (:obj:Weapon): The weapon to attack with.
+
+    Returns:
+        (list of :obj:DamageDie): The damage die rolled on a hit.
+    """
+    if not self.shield and weapon.versatile:
+      return weapon.get_appropriate_damage_die(True)
+    return weapon.get_appropriate_damage_die()
+
+  def get_weapon_attack_profile(self, weapon):
+    """Adds up the proficiency, ability and magic bonuses of attacking with a weapon.
+
+    Args:
+        weapon (:obj:Weapon): The weapon to attack with.
+
+    Returns:
+        (:obj:AttackProfile): The attack with the weapon.
+    """
+    damage_die = self.get_weapon_damage_die(weapon)
+    relevant_bonus = self.get_relevant_bonus(weapon)
+    return AttackProfile(weapon.name,
+                         weapon.magic_bonus + self.proficiency + relevant_bonus,
+                         weapon.magic_bonus + relevant_bonus,
+                         tuple(die.dice_size for die in damage_die),
+                         tuple(die.damage_type for die in damage_die),
+                         True)
+
+  def get_attack_weapons(self):
+    """Returns the preferred melee weapon, picking the one with the highest average damage first if needed.
+
+    Returns:
+        (list of :obj:Weapon): The preferred melee weapon, empty if the character has none.
+    """
+    weapon = self.preferred_melee_weapon
+    if not weapon:
+      weapon = self.choose_melee_weapon()
+    if weapon is None:
+      return []
+    return [weapon]
+
   def give_melee_weapon(self, name, finesse, versatile, magic_bonus, damage_die, baseline_magic=False):
     """Gives the Player creature a weapon to add to their self.weapon list.
 
@@ -289,6 +476,7 @@ class PlayerCharacter(BaseCreature):
     """
     weapon = Weapon(name, finesse, versatile, magic_bonus, damage_die, baseline_magic)
     self.weapons.append(weapon)
+    self.compiled_attacks = None
 
   def give_ranged_weapon(self, name, magic_bonus, damage_die, range_short, range_long, baseline_magic=False):
     """Give the creature a ranged weapon.
@@ -305,6 +493,7 @@ class PlayerCharacter(BaseCreature):
     """
     ranged_weapon = RangedWeapon(name, magic_bonus, damage_die, range_short, range_long, baseline_magic)
     self.weapons.append(ranged_weapon)
+    self.compiled_attacks = None
 
   def give_light_armor(self, name, base_ac):
     """Gives the player character light armour and applies the relevant new Armour Class (AC).
@@ -356,64 +545,8 @@ class PlayerCharacter(BaseCreature):
 
     self.shield = shield
     self.ac = self.ac + 2 + shield.magic_bonus
-
-  def melee_attack(self, target):
-    """Performs melee attack.
-
-    Args:
-        target (:obj:BaseCreature or subclass): The target of the melee attack.
-    """
-    # If the creature has no preferred weapon, get the one with the highest average damage
-    if not self.preferred_melee_weapon:
-      weapon_to_use = self.choose_melee_weapon()
-    else:
-      weapon_to_use = self.preferred_melee_weapon
-
-    damage_die = []
-    damage = 0
-    if not self.shield and weapon_to_use.versatile:
-      damage_die = weapon_to_use.get_appropriate_damage_die(True)
-    else:
-      damage_die = weapon_to_use.get_appropriate_damage_die()
-
-    flavor_text = '{} attacks with the {}'.format(self.name, weapon_to_use)
-
-    critical_hit = False
-    d20_roll = randint(1, 20)
-    if d20_roll is 20:
-      flavor_text = flavor_text + ' and CRITICAL HIT! Rolls '
-      critical_hit = True
-
-    if d20_roll is 1:
-      flavor_text = flavor_text + ' and OH NO critical miss'
-      return flavor_text
-
-    d20_roll_plus_modifiers = d20_roll + weapon_to_use.magic_bonus \
-                              + self.proficiency + self.get_relevant_bonus(weapon_to_use)
-
-    if critical_hit:
-      for die in damage_die:
-        die_roll = randint(1, die.dice_size)
-        damage = damage + die_roll
-        flavor_text = flavor_text + str(die_roll) + '({})'.format(die.dice_size)
-      for die in damage_die:
-        die_roll = randint(1, die.dice_size)
-        damage = damage + die_roll
-        flavor_text = flavor_text + str(die_roll) + '({})'.format(die.dice_size)
-    elif d20_roll_plus_modifiers < target.ac:
-      flavor_text = flavor_text + ' and misses with a {}'.format(str(d20_roll_plus_modifiers))
-      return damage, flavor_text
-    else:
-      for die in damage_die:
-        die_roll = randint(1, die.dice_size)
-        damage = damage + die_roll
-        flavor_text = flavor_text + str(die_roll) + '({})'.format(str(die.dice_size))
-
-    damage = damage + weapon_to_use.magic_bonus + self.get_relevant_bonus(weapon_to_use)
-    flavor_text = flavor_text + ' dealing {} damage'.format(damage)
-    target.current_hp = target.current_hp - damage
-
-    return flavor_text
+    # a versatile weapon is used one handed with a shield
+    self.compiled_attacks = None
 
 
 class Monster(BaseCreature):
@@ -423,6 +556,8 @@ class Monster(BaseCreature):
   creature = Monster('NAME', Max_HP, Str, Dex, Con, Int, Wis, Cha, Attacks_per_round, ancillary_characteristics, AC)
   """
 
+  __slots__ = ()
+
   def __init__(self, name, max_hp, strength, dexterity, constitution, intelligence, wisdom,
                charisma, attacks_per_action, ancillary_characteristics, ac):
     """Creating objects of this class has the same attributes needed as BaseCreature object plus monster properties.
@@ -445,6 +580,11 @@ class Monster(BaseCreature):
 
     self.ac = ac
 
+  def __repr__(self):
+    return 'Name: {}, HP: {}, AC: {}'.format(self.name,
+                                             self.current_hp,
+                                             self.ac)
+
   def give_melee_weapon(self, name, to_hit_bonus, damage_bonus, damage_die, baseline_magic=False):
     """Gives the Monster creature a weapon to add to their self.weapon list.
 
@@ -458,56 +598,28 @@ class Monster(BaseCreature):
     """
     weapon = MonsterWeapon(name, to_hit_bonus, damage_bonus, damage_die, baseline_magic)
     self.weapons.append(weapon)
+    self.compiled_attacks = None
 
-  def melee_attack(self, target):
-    """Performs melee attack.
+  def get_attack_weapons(self):
+    """Returns all of the monster's weapons, it picks one of them at random for every attack.
 
-    Args:
-        target (:obj:BaseCreature or subclass): The target of the melee attack.
+    Returns:
+        (list of :obj:MonsterWeapon): The weapons of the monster.
     """
-    flavor_text = self.name + ' attacks with '
-    logging.info('Number of weapons that {} has is {}'.format(self.name, str(len(self.weapons))))
-    if not self.weapons:
-      flavor_text = flavor_text + 'fists'
-      # TODO add fist logic
-    weapon_to_use = None
-    if len(self.weapons) > 1:
-      weapon_to_use = choice(self.weapons)
-    else:
-      weapon_to_use = self.weapons[0]
+    return list(self.weapons)
 
-    flavor_text = flavor_text + weapon_to_use.name
-    attack_roll = randint(1, 20)
+  def get_weapon_attack_profile(self, weapon):
+    """Returns the attack with one of the monster's weapons, the bonuses come with the weapon.
 
-    critical_hit = False
-    if attack_roll == 20:
-      critical_hit = True
-      flavor_text = flavor_text + ' ' + str(attack_roll) + ' CRITICAL HIT! + ' + str(weapon_to_use.to_hit_bonus)
-    else:
-      flavor_text = flavor_text + ' ' + str(attack_roll) + ' + ' + str(weapon_to_use.to_hit_bonus)
-
-    attack_roll = attack_roll + weapon_to_use.to_hit_bonus
+    Args:
+        weapon (:obj:MonsterWeapon): The weapon to attack with.
 
-    damage = 0
-    if not critical_hit and target.ac > attack_roll:
-      flavor_text = flavor_text + ' and misses!'
-      return flavor_text
-    else:
-      flavor_text = flavor_text + ' and rolls '
-      for die in weapon_to_use.damage:
-        die_roll = randint(1, die.dice_size)
-        damage = damage + die_roll
-        flavor_text = flavor_text + str(die_roll) + '({})'.format(die.dice_size)
-      if critical_hit:
-        for die in weapon_to_use.damage:
-          die_roll = randint(1, die.dice_size)
-          damage = damage + die_roll
-          flavor_text = flavor_text + str(die_roll) + '({})'.format(die.dice_size)
-
-    damage = damage + weapon_to_use.damage_bonus
-    flavor_text = flavor_text + ' dealing {} damage!'.format(damage)
-    target.current_hp = target.current_hp - damage
-    if target.current_hp < 1:
-      flavor_text = flavor_text + ' knocking {} down!'.format(target.name)
-
-    return flavor_text
+    Returns:
+        (:obj:AttackProfile): The attack with the weapon. A natural 1 does not automatically miss for monsters.
+    """
+    return AttackProfile(weapon.name,
+                         weapon.to_hit_bonus,
+                         weapon.damage_bonus,
+                         tuple(die.dice_size for die in weapon.damage),
+                         tuple(die.damage_type for die in weapon.damage),
+                         False)
@@ -0,0 +1,262 @@
+"""The turn by turn combat loop shared by the command line script and the simulation runners.
+
+A combat is fought between a list of GameConstructs/Team objects. Each creature rolls initiative, then every round the
+living creatures take their turn in initiative order, pick a target from the other teams and attack it, until only
+one team has creatures standing.
+
+Nothing is printed or formatted by the engine itself, everything that happens is handed to a sink from the
+CombatEvents module (the NullSink by default, a TextSink narrates the combat).
+
+All the randomness goes through the rng argument, which is anything with the randint and choice methods of the random
+module. By default that is the random module itself, pass a random.Random(seed) to get an independent, reproducible
+stream (for example one per worker process). An rng that also has target_stream(slot) and attack_stream(slot) methods,
+like CommonRandomNumbers/SlotRandom, gives the combatant in every slot its own streams for targeting and attacking.
+
+Fought on a BattleMap/BattleMap the creatures only attack the opponents within their reach or the range of their
+ranged weapons, and move towards the nearest opponent when there are none.
+
+With a StatusEffects/EffectEngine creatures with spells cast them instead of attacking when they have something to do,
+and the effects they leave behind are done at the start of every turn they are due at.
+"""
+
+from CombatEvents import NULL_SINK, render_initiative_order
+from GameConstructs import CombatState
+import logging
+import random
+
+
+# Bump whenever a change to the rules or the order of the rolls changes the outcome of seeded combats, it is part of the
+# key of the results kept by ResultCache
+ENGINE_VERSION = 1
+
+
+class FightResult:
+  """The outcome of a single combat."""
+
+  __slots__ = ('winner', 'rounds')
+
+  def __init__(self, winner, rounds):
+    """Stores the outcome.
+
+    Args:
+        winner (int): The index of the winning team in the teams list, -1 if nobody is left standing or the combat
+          stalled on a BattleMap/BattleMap.
+        rounds (int): The number of rounds the combat lasted.
+    """
+    self.winner = winner
+    self.rounds = rounds
+
+  def __repr__(self):
+    return 'FightResult(winner={}, rounds={})'.format(self.winner, self.rounds)
+
+
+def d20_with_modifier(modifier=0, rng=random):
+  """Rolls a d20 (20 sided dice) and adds the given modifier.
+
+  Args:
+      modifier (int): The number to add the random roll to.
+      rng (random.Random or module, optional): The source of the roll.
+
+  Returns:
+      roll: random number between 1 and 20 + the modifier
+  """
+  roll = rng.randint(1, 20)
+  logging.debug('d20 roll is %s and the modifier is %s', roll, modifier)
+  roll = roll + modifier
+  return roll
+
+
+def print_initiative_order_and_character_state(state):
+  """Prints and returns the combat initiative order and current state of the combat.
+
+  Args:
+      state (GameConstructs/CombatState): The state of the combat, after initiative was rolled.
+
+  Returns:
+      string: The state of the combat, including creature initiative order, HP etc.
+  """
+  initiative_order_string = render_initiative_order(state)
+
+  print(initiative_order_string)
+  logging.info(initiative_order_string)
+  return initiative_order_string
+
+
+def get_initiative_order(state, rng=random, sink=NULL_SINK):
+  """Rolls initiative for every combatant of a combat and orders them by it.
+
+  The rolls go to state.initiative and the order to state.initiative_order.
+
+  Args:
+      state (GameConstructs/CombatState): The state of the combat.
+      rng (random.Random or module, optional): The source of the initiative rolls.
+      sink (CombatEvents/NullSink or subclass, optional): Told about each creatures initiative score.
+
+  Returns:
+      initiative_order: The combatant indices ordered by initiative, the highest first and ties in combatant order.
+  """
+  initiative = state.initiative
+  for index, character in enumerate(state.combatants):
+    initiative[index] = d20_with_modifier(character.get_bonus(character.dexterity), rng)
+    sink.initiative(character, initiative[index])
+
+  state.initiative_order = sorted(range(len(state.combatants)), key=initiative.__getitem__, reverse=True)
+  return state.initiative_order
+
+
+def get_scores(teams):
+  """Gets the text describing the current scores of which teams have won how many combats.
+
+  Args:
+      teams (list): List of GameConstructs/Teams objects.
+
+  Returns:
+      string: The text output of the current state of the multi-combat experience.
+  """
+  score_text = 'And the scores: '
+  for team in teams:
+    score_text = score_text + '\n{}: {}'.format(team.name, team.score)
+  return score_text
+
+
+def run_combat(teams, rng=random, sink=NULL_SINK, state=None, profiler=None, battle_map=None, effects=None):
+  """Fights a single combat between the teams until only one of them has creatures standing.
+
+  The winning team gets its Team.score increased by one.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat, at their starting hit points.
+      rng (random.Random or module, optional): The source of every roll and random choice in the combat.
+      sink (CombatEvents/NullSink or subclass, optional): Receives everything that happens in the combat.
+      state (GameConstructs/CombatState, optional): The state to fight the combat in, as left by its reset(). Callers
+        that fight the same teams many times build it once and reset it between combats, by default a new one is built
+        from the creatures as they are now.
+      profiler (CombatProfiler/CombatProfiler, optional): Times the phases of the combat and counts what happens.
+      battle_map (BattleMap/BattleMap, optional): Fight on this map, every combat starts from the positions placed on
+        it. Without a map every creature can attack every opponent.
+      effects (StatusEffects/EffectEngine, optional): Casts the spells of the creatures and keeps their effects, see
+        StatusEffects.effect_engine. Without it the creatures only attack.
+
+  Returns:
+      FightResult: The index of the winning team and the number of rounds fought.
+  """
+  if state is None:
+    state = CombatState(teams)
+  profiling = profiler is not None
+  slot_streams = hasattr(rng, 'attack_stream')
+  if profiling:
+    sink = profiler.wrap_sink(sink)
+    profiler.start('initiative')
+  combatants = state.combatants
+  index_of = state.index_of
+  get_initiative_order(state, rng, sink)
+  if battle_map is not None:
+    battle_map.start_combat(state)
+  if effects is not None:
+    effects.start_combat(state, sink, battle_map)
+  if profiling:
+    profiler.stop()
+
+  round_number = 0
+
+  while True:
+    if profiling:
+      profiler.start('termination')
+    finished = state.teams_alive() < 2
+    if profiling:
+      profiler.stop()
+    if finished:
+      break
+
+    round_number += 1
+    if profiling:
+      profiler.record_round()
+    sink.round_start(round_number, state)
+    if battle_map is not None:
+      battle_map.new_round()
+
+    for slot, index in enumerate(state.initiative_order):
+      if effects is not None:
+        effects.run_due(round_number, slot, rng)
+      if not state.alive[index]:
+        continue
+      if effects is not None:
+        if effects.incapacitated[index]:
+          continue
+        if effects.cast_spell(index, rng.attack_stream(index) if slot_streams else rng):
+          # the spell was the action of the turn
+          continue
+      if profiling:
+        profiler.start('targeting')
+      creature = combatants[index]
+      ranged_attack = None
+      if battle_map is None:
+        potential_targets = state.potential_targets(index)
+      elif state.teams_standing > 1:
+        potential_targets, ranged_attack, disadvantage = battle_map.plan_turn(index, creature, sink)
+        if not potential_targets:
+          # nobody within reach or range, even after moving
+          if profiling:
+            profiler.stop()
+          continue
+      else:
+        potential_targets = None
+
+      if not potential_targets:
+        if profiling:
+          profiler.stop()
+        break
+
+      turn_rng = rng.target_stream(index) if slot_streams else rng
+      target = creature.pick_target([combatants[other] for other in potential_targets], turn_rng)
+      target_index = index_of[target]
+      state.last_target[index] = target_index
+      if profiling:
+        profiler.stop()
+      sink.target(creature, target)
+      if slot_streams:
+        turn_rng = rng.attack_stream(index)
+      to_hit = effects.to_hit_bonus[index] if effects is not None else 0
+      for attack in range(creature.num_attacks):
+        if profiling:
+          profiler.start('attack')
+        # a concentration check failed by the last attack can take an AC bonus of the target away
+        target_ac = effects.armor_class(target_index) if effects is not None else None
+        if ranged_attack is None:
+          event = creature.melee_attack(target, turn_rng, sink, to_hit, target_ac)
+        else:
+          event = creature.resolve_attack(ranged_attack[0], ranged_attack[1], target, turn_rng, sink, disadvantage,
+                                          to_hit, target_ac)
+        damage = event.damage if event.hit else 0
+        state.damage_dealt[index] += damage
+        dropped = state.apply_damage(target_index, damage)
+        if effects is not None and damage > 0:
+          effects.took_damage(target_index, damage, dropped, turn_rng)
+        if profiling:
+          profiler.stop()
+          profiler.record_attack(event)
+        if dropped:
+          if profiling:
+            profiler.record_knockdown()
+          if battle_map is not None:
+            battle_map.remove(target_index)
+          sink.down(target)
+          break
+
+    if battle_map is not None and battle_map.stalled:
+      # nobody could attack or move for a whole round, the combat ends in a draw
+      break
+
+  if profiling:
+    profiler.start('termination')
+  winner = state.winner() if state.teams_alive() < 2 else -1
+  if winner >= 0:
+    teams[winner].score += 1
+  if profiling:
+    profiler.stop()
+
+  result = FightResult(winner, round_number)
+  if profiling:
+    profiler.record_combat(result)
+  sink.combat_end(teams, result, state)
+  return result
@@ -0,0 +1,303 @@
+"""Structured records of what happens in a combat and the sinks that consume them.
+
+The combat engine and the creatures' attacks do not build any text. Each attack produces a CombatEvent and everything
+that happens in the combat is handed to a sink:
+
+  * NullSink ignores everything, nothing is formatted (this is the default).
+  * CounterSink only counts attacks, hits, crits, damage, knockdowns and so on.
+  * TextSink renders the narration of the combat and prints it.
+  * LogSink renders the same narration to the logging module.
+
+A sink is any object with the methods of NullSink, so custom sinks subclass NullSink and override what they need.
+"""
+
+import logging
+import sys
+
+
+class CombatEvent:
+  """The outcome of a single attack."""
+
+  __slots__ = ('attacker', 'target', 'weapon', 'roll', 'attack_total', 'critical', 'hit', 'damage', 'damage_type')
+
+  def __init__(self, attacker, target, weapon, roll, attack_total, critical, hit, damage, damage_type):
+    """Stores the outcome.
+
+    Args:
+        attacker (BaseCreature or subclass): The creature that made the attack.
+        target (BaseCreature or subclass): The creature that was attacked.
+        weapon (Weapon or MonsterWeapon): The weapon the attack was made with.
+        roll (int): The natural d20 roll.
+        attack_total (int): The d20 roll plus all the to hit bonuses.
+        critical (bool): True if the d20 roll was a natural 20.
+        hit (bool): True if the attack hit the target.
+        damage (int): The damage dealt to the target, 0 on a miss.
+        damage_type (str): The damage type of the weapon, e.g. 'slashing'.
+    """
+    self.attacker = attacker
+    self.target = target
+    self.weapon = weapon
+    self.roll = roll
+    self.attack_total = attack_total
+    self.critical = critical
+    self.hit = hit
+    self.damage = damage
+    self.damage_type = damage_type
+
+  def __repr__(self):
+    return 'CombatEvent({} -> {}, roll={}, total={}, critical={}, hit={}, damage={} {})'.format(
+      self.attacker.name, self.target.name, self.roll, self.attack_total, self.critical, self.hit, self.damage,
+      self.damage_type)
+
+
+class NullSink:
+  """A sink that ignores every event. The base class of all the other sinks."""
+
+  def initiative(self, creature, initiative):
+    """Called after a creature rolled initiative, with its initiative score."""
+
+  def round_start(self, round_number, state):
+    """Called at the start of every round with the GameConstructs/CombatState, state.initiative_order is the order."""
+
+  def move(self, creature, position):
+    """Called when a creature on a BattleMap/BattleMap moves, with the (x, y) square it moved to."""
+
+  def target(self, creature, target):
+    """Called when a creature picks the target of its attacks for this turn."""
+
+  def attack(self, event):
+    """Called with the CombatEvent of every attack."""
+
+  def down(self, creature):
+    """Called when a creature drops to 0 hit points or below."""
+
+  def cast(self, caster, spell, targets):
+    """Called when a creature casts a StatusEffects/Spell, with the creatures it is cast on."""
+
+  def effect(self, creature, name, started):
+    """Called when a status effect starts (started is True) or ends on a creature."""
+
+  def hit_points(self, creature, source, change):
+    """Called when a spell or an effect deals damage to a creature (a negative change) or heals it."""
+
+  def combat_end(self, teams, result, state):
+    """Called when the combat is over with the teams, the CombatEngine/FightResult and the final CombatState."""
+
+
+NULL_SINK = NullSink()
+
+
+class CounterSink(NullSink):
+  """Counts what happens over any number of combats without keeping the events themselves."""
+
+  def __init__(self):
+    self.combats = 0
+    self.rounds = 0
+    self.attacks = 0
+    self.hits = 0
+    self.misses = 0
+    self.critical_hits = 0
+    self.critical_misses = 0
+    self.damage = 0
+    self.knockdowns = 0
+
+  def __repr__(self):
+    return 'CounterSink({})'.format(', '.join('{}={}'.format(key, value) for key, value in self.as_dict().items()))
+
+  def as_dict(self):
+    """Returns the counters as a dictionary."""
+    return {'combats': self.combats,
+            'rounds': self.rounds,
+            'attacks': self.attacks,
+            'hits': self.hits,
+            'misses': self.misses,
+            'critical_hits': self.critical_hits,
+            'critical_misses': self.critical_misses,
+            'damage': self.damage,
+            'knockdowns': self.knockdowns}
+
+  def round_start(self, round_number, state):
+    self.rounds += 1
+
+  def attack(self, event):
+    self.attacks += 1
+    if event.hit:
+      self.hits += 1
+      self.damage += event.damage
+      if event.critical:
+        self.critical_hits += 1
+    else:
+      self.misses += 1
+      if event.roll == 1:
+        self.critical_misses += 1
+
+  def down(self, creature):
+    self.knockdowns += 1
+
+  def combat_end(self, teams, result, state):
+    self.combats += 1
+
+
+def render_initiative_order(state):
+  """Renders the initiative order and the state of each combatant, creatures that are down are struck through.
+
+  Args:
+      state (GameConstructs/CombatState): The state of the combat, after initiative was rolled.
+
+  Returns:
+      str: The rendered text.
+  """
+  lines = ['\nInitiative Order and Creature States:']
+  for initiative_number, index in enumerate(state.initiative_order, 1):
+    combatant = state.combatants[index]
+    text = '{}({}): Name: {}, HP: {}, AC: {}'.format(initiative_number, state.initiative[index], combatant.name,
+                                                     state.hp[index], combatant.ac)
+    if state.hp[index] > 0:
+      lines.append(text)
+    else:
+      # a combining long stroke after every character strikes the text through
+      lines.append('\u0336'.join(text) + '\u0336')
+  return '\n'.join(lines)
+
+
+def render_attack(event):
+  """Renders the narration of a single attack.
+
+  Args:
+      event (CombatEvent): The attack to describe.
+
+  Returns:
+      str: The rendered text.
+  """
+  text = '{} attacks {} with the {} and rolls {}'.format(event.attacker.name, event.target.name, event.weapon.name,
+                                                         event.roll)
+  if event.critical:
+    return text + ', CRITICAL HIT! dealing {} {} damage'.format(event.damage, event.damage_type)
+  if event.roll == 1 and not event.hit:
+    return text + ', OH NO critical miss'
+  if not event.hit:
+    return text + ' for {} and misses'.format(event.attack_total)
+  return text + ' for {} and hits dealing {} {} damage'.format(event.attack_total, event.damage, event.damage_type)
+
+
+class TextSink(NullSink):
+  """Renders the narration of the combat and writes it line by line."""
+
+  def __init__(self, stream=None):
+    """Creates the sink.
+
+    Args:
+        stream (file, optional): Where to write the narration, defaults to standard output.
+    """
+    self.stream = stream
+
+  def write(self, text):
+    """Writes a rendered line of narration."""
+    print(text, file=self.stream or sys.stdout)
+
+  def initiative(self, creature, initiative):
+    self.write('{} gets an initiative score of {}'.format(creature.name, initiative))
+
+  def round_start(self, round_number, state):
+    self.write(render_initiative_order(state))
+    self.write('\nRound {} FIGHT!\n'.format(round_number))
+
+  def move(self, creature, position):
+    self.write('{} moves to {}'.format(creature.name, position))
+
+  def target(self, creature, target):
+    self.write('{} targets {} {} times'.format(creature.name, target.name, creature.num_attacks))
+
+  def attack(self, event):
+    self.write(render_attack(event))
+
+  def down(self, creature):
+    self.write('Putting {} on death saving throws!'.format(creature.name))
+
+  def cast(self, caster, spell, targets):
+    self.write('{} casts {} on {}'.format(caster.name, spell.name, ', '.join(target.name for target in targets)))
+
+  def effect(self, creature, name, started):
+    self.write('{} is {} {}'.format(creature.name, 'now under' if started else 'no longer under', name))
+
+  def hit_points(self, creature, source, change):
+    if change < 0:
+      self.write('{} takes {} damage from {}'.format(creature.name, -change, source))
+    else:
+      self.write('{} regains {} hit points from {}'.format(creature.name, change, source))
+
+  def combat_end(self, teams, result, state):
+    if result.winner >= 0:
+      self.write('{} win after {} rounds'.format(teams[result.winner].name, result.rounds))
+    else:
+      self.write('Nobody is left standing after {} rounds'.format(result.rounds))
+
+
+class LogSink(TextSink):
+  """Renders the same narration as TextSink to the logging module."""
+
+  def __init__(self, logger=None, level=logging.INFO):
+    """Creates the sink.
+
+    Args:
+        logger (logging.Logger, optional): The logger to write to, defaults to the root logger.
+        level (int, optional): The logging level of the narration.
+    """
+    super().__init__()
+    self.logger = logger or logging.getLogger()
+    self.level = level
+
+  def write(self, text):
+    self.logger.log(self.level, text)
+
+
+class MultiSink(NullSink):
+  """Hands every event to several sinks, e.g. printing the narration while counting."""
+
+  def __init__(self, sinks):
+    """Creates the sink.
+
+    Args:
+        sinks (list): The sinks to forward the events to, in order.
+    """
+    self.sinks = list(sinks)
+
+  def initiative(self, creature, initiative):
+    for sink in self.sinks:
+      sink.initiative(creature, initiative)
+
+  def round_start(self, round_number, state):
+    for sink in self.sinks:
+      sink.round_start(round_number, state)
+
+  def move(self, creature, position):
+    for sink in self.sinks:
+      sink.move(creature, position)
+
+  def target(self, creature, target):
+    for sink in self.sinks:
+      sink.target(creature, target)
+
+  def attack(self, event):
+    for sink in self.sinks:
+      sink.attack(event)
+
+  def down(self, creature):
+    for sink in self.sinks:
+      sink.down(creature)
+
+  def cast(self, caster, spell, targets):
+    for sink in self.sinks:
+      sink.cast(caster, spell, targets)
+
+  def effect(self, creature, name, started):
+    for sink in self.sinks:
+      sink.effect(creature, name, started)
+
+  def hit_points(self, creature, source, change):
+    for sink in self.sinks:
+      sink.hit_points(creature, source, change)
+
+  def combat_end(self, teams, result, state):
+    for sink in self.sinks:
+      sink.combat_end(teams, result, state)
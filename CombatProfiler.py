@@ -0,0 +1,214 @@
+"""Opt-in timers and counters for the hot path of the combat engine.
+
+Pass a CombatProfiler to CombatEngine.run_combat and it times every phase of the combat and counts what happens:
+
+  profiler = CombatProfiler()
+  for i in range(combat_attempts):
+    state.reset()
+    run_combat(teams, rng, sink, state, profiler)
+  print(profiler.format_table())
+
+The phases are:
+  * initiative: rolling initiative and sorting the combatants.
+  * termination: checking whether more than one team is standing and finding the winner.
+  * targeting: finding the potential targets of a creature and picking one.
+  * attack: resolving the attack rolls and the damage.
+  * output: the sink, narrating or logging what happened.
+
+The times are exclusive, the output of an attack counts as output and not as attack. Without a profiler run_combat
+skips all of this, the cost is a check of a local variable per phase.
+
+Combats that last long_combat_rounds rounds or more are listed by their number, those are the encounters where the
+teams can barely hurt each other.
+"""
+
+from CombatEvents import NullSink
+import json
+import time
+
+
+PHASES = ('initiative', 'termination', 'targeting', 'attack', 'output')
+
+
+class CombatProfiler:
+  """Cumulative phase timings and counters over any number of combats."""
+
+  def __init__(self, long_combat_rounds=100):
+    """Starts an empty profile.
+
+    Args:
+        long_combat_rounds (int, optional): Combats lasting at least this many rounds are listed in long_combats.
+    """
+    self.long_combat_rounds = long_combat_rounds
+    self.timings = {phase: 0.0 for phase in PHASES}
+    self.calls = {phase: 0 for phase in PHASES}
+    self.combats = 0
+    self.rounds = 0
+    self.max_rounds = 0
+    self.attacks = 0
+    self.hits = 0
+    self.misses = 0
+    self.critical_hits = 0
+    self.critical_misses = 0
+    self.knockdowns = 0
+    self.long_combats = []
+    # the running phases, innermost last, as [phase, time it last started counting]
+    self.running = []
+
+  def __repr__(self):
+    return 'CombatProfiler(combats={}, rounds={}, attacks={})'.format(self.combats, self.rounds, self.attacks)
+
+  def start(self, phase):
+    """Starts timing a phase, the phase it interrupts stops counting until this one stops."""
+    now = time.perf_counter()
+    if self.running:
+      outer = self.running[-1]
+      self.timings[outer[0]] += now - outer[1]
+    self.running.append([phase, now])
+    self.calls[phase] += 1
+
+  def stop(self):
+    """Stops timing the innermost running phase."""
+    now = time.perf_counter()
+    phase, since = self.running.pop()
+    self.timings[phase] += now - since
+    if self.running:
+      self.running[-1][1] = now
+
+  def wrap_sink(self, sink):
+    """Returns a sink that forwards everything to sink and times it as output."""
+    return ProfiledSink(sink, self)
+
+  def record_attack(self, event):
+    """Counts a CombatEvents/CombatEvent."""
+    self.attacks += 1
+    if event.hit:
+      self.hits += 1
+      if event.critical:
+        self.critical_hits += 1
+    else:
+      self.misses += 1
+      if event.roll == 1:
+        self.critical_misses += 1
+
+  def record_knockdown(self):
+    """Counts a creature dropping to 0 hit points."""
+    self.knockdowns += 1
+
+  def record_round(self):
+    """Counts a round."""
+    self.rounds += 1
+
+  def record_combat(self, result):
+    """Counts a finished combat, the CombatEngine/FightResult."""
+    self.combats += 1
+    self.max_rounds = max(self.max_rounds, result.rounds)
+    if result.rounds >= self.long_combat_rounds:
+      self.long_combats.append((self.combats, result.rounds))
+
+  def as_dict(self):
+    """Returns the profile as a dictionary that can be written as JSON."""
+    return {'timings': {phase: {'seconds': self.timings[phase], 'calls': self.calls[phase]} for phase in PHASES},
+            'total_seconds': sum(self.timings.values()),
+            'combats': self.combats,
+            'rounds': self.rounds,
+            'max_rounds': self.max_rounds,
+            'attacks': self.attacks,
+            'hits': self.hits,
+            'misses': self.misses,
+            'critical_hits': self.critical_hits,
+            'critical_misses': self.critical_misses,
+            'knockdowns': self.knockdowns,
+            'long_combats': [{'combat': combat, 'rounds': rounds} for combat, rounds in self.long_combats]}
+
+  def to_json(self, path=None):
+    """Returns the profile as JSON text, and writes it to path if one is given."""
+    text = json.dumps(self.as_dict(), indent=2)
+    if path:
+      with open(path, 'w') as json_file:
+        json_file.write(text + '\n')
+    return text
+
+  def format_table(self):
+    """Renders the profile as a table of the phases followed by the counters."""
+    total = sum(self.timings.values()) or 1.0
+    lines = ['{:<12} {:>10} {:>7} {:>10} {:>12}'.format('phase', 'seconds', 'share', 'calls', 'us/call')]
+    for phase in PHASES:
+      seconds = self.timings[phase]
+      calls = self.calls[phase]
+      lines.append('{:<12} {:>10.4f} {:>7.1%} {:>10} {:>12.2f}'.format(
+        phase, seconds, seconds / total, calls, seconds / calls * 1e6 if calls else 0.0))
+    lines.append('')
+    lines.append('combats: {}, rounds: {} (longest {}), attacks: {}, hits: {}, misses: {}, critical hits: {}, '
+                 'critical misses: {}, knockdowns: {}'.format(self.combats, self.rounds, self.max_rounds,
+                                                             self.attacks, self.hits, self.misses,
+                                                             self.critical_hits, self.critical_misses,
+                                                             self.knockdowns))
+    if self.long_combats:
+      lines.append('{} combats lasted {} rounds or more, e.g. combat {} with {} rounds'.format(
+        len(self.long_combats), self.long_combat_rounds, *max(self.long_combats, key=lambda combat: combat[1])))
+    return '\n'.join(lines)
+
+
+class ProfiledSink(NullSink):
+  """Forwards every event to another sink and times it as the output phase of a CombatProfiler."""
+
+  def __init__(self, sink, profiler):
+    """Wraps a sink.
+
+    Args:
+        sink (CombatEvents/NullSink or subclass): The sink to forward the events to.
+        profiler (CombatProfiler): The profiler to time them with.
+    """
+    self.sink = sink
+    self.profiler = profiler
+
+  def initiative(self, creature, initiative):
+    self.profiler.start('output')
+    self.sink.initiative(creature, initiative)
+    self.profiler.stop()
+
+  def round_start(self, round_number, state):
+    self.profiler.start('output')
+    self.sink.round_start(round_number, state)
+    self.profiler.stop()
+
+  def move(self, creature, position):
+    self.profiler.start('output')
+    self.sink.move(creature, position)
+    self.profiler.stop()
+
+  def target(self, creature, target):
+    self.profiler.start('output')
+    self.sink.target(creature, target)
+    self.profiler.stop()
+
+  def attack(self, event):
+    self.profiler.start('output')
+    self.sink.attack(event)
+    self.profiler.stop()
+
+  def down(self, creature):
+    self.profiler.start('output')
+    self.sink.down(creature)
+    self.profiler.stop()
+
+  def cast(self, caster, spell, targets):
+    self.profiler.start('output')
+    self.sink.cast(caster, spell, targets)
+    self.profiler.stop()
+
+  def effect(self, creature, name, started):
+    self.profiler.start('output')
+    self.sink.effect(creature, name, started)
+    self.profiler.stop()
+
+  def hit_points(self, creature, source, change):
+    self.profiler.start('output')
+    self.sink.hit_points(creature, source, change)
+    self.profiler.stop()
+
+  def combat_end(self, teams, result, state):
+    self.profiler.start('output')
+    self.sink.combat_end(teams, result, state)
+    self.profiler.stop()
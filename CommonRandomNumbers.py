@@ -0,0 +1,199 @@
+"""Compares two variants of an encounter on common random numbers.
+
+Fighting two variants of an encounter with independent random numbers needs a lot of combats to tell a small tweak
+apart from the noise. Here every combat of variant A is paired with a combat of variant B fought with the same random
+numbers:
+
+  * the initiative rolls are drawn in combatant order, so the creature in each slot rolls the same initiative,
+  * every combatant slot has its own streams for picking targets and for its attack and damage rolls, so the creature
+    in a slot rolls the same d20s in both variants until the combats start to differ.
+
+The combats that would have gone the same way in both variants cancel out of the paired difference, leaving only the
+effect of the tweak. Optionally every pair is fought a second time with antithetic numbers (every d20 of 20 becomes a
+1, every damage die of 6 a 1 and so on), which cancels out more of the luck.
+
+Creatures are matched by their slot, the position in the teams, so the variants should list the creatures in the same
+order, e.g. the 70 hit point giant of get_monsters() and the full hit point giant it is compared with both last.
+
+Use it like so:
+  comparison = compare_encounters(teams_a, teams_b, 2000)
+  print(comparison)
+"""
+
+from CombatEngine import run_combat
+from GameConstructs import CombatState
+from ParallelRunner import derive_seed
+from SimulationStatistics import mean_interval, normal_quantile
+import logging
+import math
+import random
+
+
+class AntitheticRandom:
+  """Mirrors every draw of a random.Random: a d20 roll of 1 becomes a 20, a choice of the first item the last."""
+
+  def __init__(self, generator):
+    """Wraps a generator.
+
+    Args:
+        generator (random.Random): The generator whose draws are mirrored.
+    """
+    self.generator = generator
+
+  def randint(self, low, high):
+    return low + high - self.generator.randint(low, high)
+
+  def choice(self, sequence):
+    return sequence[len(sequence) - 1 - self.generator.randrange(len(sequence))]
+
+
+class SlotRandom:
+  """The random numbers of one combat, split into a stream per combatant slot.
+
+  Used as the rng of CombatEngine.run_combat it draws the initiative rolls from its own randint and choice, and gives
+  the combatant in every slot its own streams for picking targets and for attacking.
+  """
+
+  def __init__(self, seed, antithetic=False):
+    """Sets up the streams.
+
+    Args:
+        seed (int): The seed of the combat, the same seed gives the same numbers to the same slots.
+        antithetic (bool, optional): Mirror every draw, see AntitheticRandom.
+    """
+    self.seed = seed
+    self.antithetic = antithetic
+    self.streams = {}
+    self.initiative_stream = self.stream('initiative')
+
+  def stream(self, name):
+    """Returns the stream with this name, creating it on first use."""
+    generator = self.streams.get(name)
+    if generator is None:
+      generator = random.Random(derive_seed(self.seed, name))
+      if self.antithetic:
+        generator = AntitheticRandom(generator)
+      self.streams[name] = generator
+    return generator
+
+  def randint(self, low, high):
+    return self.initiative_stream.randint(low, high)
+
+  def choice(self, sequence):
+    return self.initiative_stream.choice(sequence)
+
+  def target_stream(self, slot):
+    """Returns the stream the combatant in a slot picks its targets with."""
+    return self.stream('target:{}'.format(slot))
+
+  def attack_stream(self, slot):
+    """Returns the stream the combatant in a slot rolls its attacks and damage with."""
+    return self.stream('attack:{}'.format(slot))
+
+
+class PairedComparison:
+  """The paired difference between the rates of two variants of an encounter."""
+
+  def __init__(self, team, outcome, confidence):
+    """Starts an empty comparison.
+
+    Args:
+        team (int): The index of the team whose rate is compared.
+        outcome (str): 'win' or 'loss', see ParallelRunner/SimulationSummary.outcome_count.
+        confidence (float): The confidence level of the intervals.
+    """
+    self.team = team
+    self.outcome = outcome
+    self.confidence = confidence
+    self.pairs = 0
+    self.fights = 0
+    self.outcomes_a = 0.0
+    self.outcomes_b = 0.0
+    self.total = 0.0
+    self.total_of_squares = 0.0
+
+  def __repr__(self):
+    low, high = self.interval()
+    return ('Team {} {} rate A {:.2%}, B {:.2%}, A - B {:+.2%} ({:+.2%} to {:+.2%} at {:.0%} confidence) over {} '
+            'pairs, +/- {:.2%} with independent runs').format(self.team, self.outcome, self.rate_a(), self.rate_b(),
+                                                              self.difference(), low, high, self.confidence,
+                                                              self.pairs, self.independent_half_width())
+
+  def add_pair(self, outcome_a, outcome_b):
+    """Counts a pair of combats (or the average of a pair and its antithetic pair)."""
+    self.pairs += 1
+    self.outcomes_a += outcome_a
+    self.outcomes_b += outcome_b
+    difference = outcome_a - outcome_b
+    self.total += difference
+    self.total_of_squares += difference * difference
+
+  def rate_a(self):
+    """Returns the rate of the outcome in variant A."""
+    return self.outcomes_a / self.pairs if self.pairs else 0.0
+
+  def rate_b(self):
+    """Returns the rate of the outcome in variant B."""
+    return self.outcomes_b / self.pairs if self.pairs else 0.0
+
+  def difference(self):
+    """Returns the rate of variant A minus the rate of variant B."""
+    return self.total / self.pairs if self.pairs else 0.0
+
+  def interval(self):
+    """Returns the confidence interval of the paired difference."""
+    return mean_interval(self.total, self.total_of_squares, self.pairs, self.confidence)
+
+  def independent_half_width(self):
+    """Returns the half width the interval would have had if the two variants had been fought independently."""
+    if not self.pairs:
+      return math.inf
+    z = normal_quantile(1 - (1 - self.confidence) / 2)
+    rate_a, rate_b = self.rate_a(), self.rate_b()
+    return z * math.sqrt((rate_a * (1 - rate_a) + rate_b * (1 - rate_b)) / self.pairs)
+
+
+def fight_outcome(teams, state, rng, team, outcome):
+  """Fights one combat from the reset state and returns 1 if the team had the outcome, 0 if not."""
+  state.reset()
+  won = run_combat(teams, rng, state=state).winner == team
+  return 1 if won == (outcome == 'win') else 0
+
+
+def compare_encounters(teams_a, teams_b, num_pairs, team=0, outcome='win', antithetic=False, confidence=0.95, seed=0):
+  """Fights pairs of combats of two variants of an encounter on common random numbers.
+
+  Like the serial loop the winners are added to the Team.score of the teams of each variant.
+
+  Args:
+      teams_a (list of GameConstructs/Team): Variant A, every combat starts from the state the creatures are in now.
+      teams_b (list of GameConstructs/Team): Variant B, with the creatures in the same slots as variant A.
+      num_pairs (int): The number of pairs of combats.
+      team (int, optional): The index of the team whose rate is compared.
+      outcome (str, optional): 'win' compares the rate the team wins, 'loss' the rate it does not.
+      antithetic (bool, optional): Fight every pair a second time on antithetic numbers and count the average of
+        the two.
+      confidence (float, optional): The confidence level of the interval.
+      seed (int, optional): The seed of the comparison.
+
+  Returns:
+      PairedComparison: The rates of both variants and their paired difference.
+  """
+  if outcome not in ('win', 'loss'):
+    raise ValueError('outcome must be "win" or "loss", got {}'.format(outcome))
+  state_a = CombatState(teams_a)
+  state_b = CombatState(teams_b)
+  comparison = PairedComparison(team, outcome, confidence)
+  for pair in range(num_pairs):
+    pair_seed = derive_seed(seed, pair)
+    outcome_a = fight_outcome(teams_a, state_a, SlotRandom(pair_seed), team, outcome)
+    outcome_b = fight_outcome(teams_b, state_b, SlotRandom(pair_seed), team, outcome)
+    if antithetic:
+      outcome_a = (outcome_a + fight_outcome(teams_a, state_a, SlotRandom(pair_seed, True), team, outcome)) / 2
+      outcome_b = (outcome_b + fight_outcome(teams_b, state_b, SlotRandom(pair_seed, True), team, outcome)) / 2
+    comparison.add_pair(outcome_a, outcome_b)
+  comparison.fights = num_pairs * (4 if antithetic else 2)
+  state_a.reset()
+  state_b.reset()
+  logging.info('Compared the variants over {} pairs: {}'.format(num_pairs, comparison))
+  return comparison
@@ -1,5 +1,10 @@
+from collections import namedtuple
+
+
 class DamageDie:
 
+  __slots__ = ('dice_size', 'damage_type')
+
   def __init__(self, dice_size, damage_type):
     self.dice_size = dice_size
     self.damage_type = damage_type
@@ -9,3 +14,15 @@ class DamageDie:
 
   def __str__(self):
     return 'd{} {}'.format(self.dice_size, self.damage_type)
+
+
+# Everything needed to resolve one attack with a weapon, with all the bonuses of the wielder already added up:
+#   name (str): the name of the weapon
+#   to_hit (int): the total bonus added to the d20 attack roll
+#   damage_bonus (int): the flat bonus added to the damage of a hit
+#   dice (tuple of int): the sizes of the damage dice rolled on a hit (rolled twice on a critical hit)
+#   damage_types (tuple of str): the damage type of each of the dice
+#   natural_one_misses (bool): if a natural 1 misses regardless of the total
+# Profiles are hashable so they can key caches such as the ones in DamageDistribution.
+AttackProfile = namedtuple('AttackProfile', ['name', 'to_hit', 'damage_bonus', 'dice', 'damage_types',
+                                             'natural_one_misses'])
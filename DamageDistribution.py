@@ -0,0 +1,217 @@
+"""Exact damage distributions of single attacks.
+
+A probability mass function (PMF) here is a tuple of probabilities indexed by the damage dealt, so pmf[12] is the
+chance an attack deals exactly 12 damage. Damage never goes below 0.
+
+The distribution of an attack combines:
+  * the damage dice of the weapon, convolved together,
+  * the flat damage bonus (magic and ability score bonuses),
+  * the chance to hit the target's AC with the to hit bonus,
+  * a natural 20 always hitting and rolling the damage dice twice,
+  * a natural 1 always missing (if the profile says so, as it does for player characters),
+  * halved damage for resisted damage types and none for immune damage types.
+
+Everything is computed from an AttackProfile (see DamageConstructs) and cached per (profile, target AC, resistances,
+immunities), so repeated questions like "what does Geoff's greatclub do to AC 15" are answered instantly.
+
+Use it like so:
+  pmf = attack_damage_pmf(profile, 15)
+  print(pmf_mean(pmf), pmf_variance(pmf))
+"""
+
+from functools import lru_cache
+
+
+def die_pmf(dice_size):
+  """Returns the PMF of a single die, 1 to dice_size with equal chance."""
+  return (0.0,) + (1.0 / dice_size,) * dice_size
+
+
+def convolve(first, second):
+  """Returns the PMF of the sum of two independent damage amounts.
+
+  Args:
+      first (tuple of float): The PMF of the first amount.
+      second (tuple of float): The PMF of the second amount.
+
+  Returns:
+      tuple of float: The PMF of the sum.
+  """
+  result = [0.0] * (len(first) + len(second) - 1)
+  for first_damage, first_probability in enumerate(first):
+    if not first_probability:
+      continue
+    for second_damage, second_probability in enumerate(second):
+      result[first_damage + second_damage] += first_probability * second_probability
+  return tuple(result)
+
+
+def add_constant(pmf, constant):
+  """Returns the PMF of a damage amount plus a constant, damage that would go below 0 is 0 instead.
+
+  Args:
+      pmf (tuple of float): The PMF of the damage.
+      constant (int): The amount to add, may be negative.
+
+  Returns:
+      tuple of float: The shifted PMF.
+  """
+  if constant >= 0:
+    return (0.0,) * constant + tuple(pmf)
+  result = [0.0] * max(len(pmf) + constant, 1)
+  for damage, probability in enumerate(pmf):
+    result[max(damage + constant, 0)] += probability
+  return tuple(result)
+
+
+def halve(pmf):
+  """Returns the PMF of a damage amount halved and rounded down, as for a resisted damage type."""
+  result = [0.0] * (len(pmf) // 2 + 1)
+  for damage, probability in enumerate(pmf):
+    result[damage // 2] += probability
+  return tuple(result)
+
+
+def mix(weighted_pmfs):
+  """Returns the PMF of picking one of several damage amounts with the given chances.
+
+  Args:
+      weighted_pmfs (list of tuple): (probability, PMF) pairs, the probabilities should add up to 1.
+
+  Returns:
+      tuple of float: The PMF of the mixture.
+  """
+  result = [0.0] * max(len(pmf) for _, pmf in weighted_pmfs)
+  for weight, pmf in weighted_pmfs:
+    for damage, probability in enumerate(pmf):
+      result[damage] += weight * probability
+  return tuple(result)
+
+
+def pmf_mean(pmf):
+  """Returns the expected damage of a PMF."""
+  return sum(damage * probability for damage, probability in enumerate(pmf))
+
+
+def pmf_variance(pmf):
+  """Returns the variance of the damage of a PMF."""
+  mean = pmf_mean(pmf)
+  return sum((damage - mean) ** 2 * probability for damage, probability in enumerate(pmf))
+
+
+@lru_cache(maxsize=None)
+def dice_pmf(dice):
+  """Returns the PMF of the sum of a tuple of dice sizes, e.g. (8, 8, 8) for 3d8."""
+  pmf = (1.0,)
+  for dice_size in dice:
+    pmf = convolve(pmf, die_pmf(dice_size))
+  return pmf
+
+
+def hit_probabilities(to_hit, target_ac, natural_one_misses=True):
+  """Returns the chance of a normal hit and the chance of a critical hit for one attack roll.
+
+  Args:
+      to_hit (int): The total bonus added to the d20.
+      target_ac (int): The armour class of the target, the attack hits if the total is at least this.
+      natural_one_misses (bool, optional): If a natural 1 misses regardless of the total.
+
+  Returns:
+      tuple of float: (chance of a hit that is not critical, chance of a critical hit)
+  """
+  lowest_roll = 2 if natural_one_misses else 1
+  hitting_rolls = sum(1 for roll in range(lowest_roll, 20) if roll + to_hit >= target_ac)
+  return hitting_rolls / 20.0, 1 / 20.0
+
+
+@lru_cache(maxsize=None)
+def hit_damage_pmf(profile, critical, resistances=frozenset(), immunities=frozenset()):
+  """Returns the PMF of the damage of an attack that hits, before the chance to hit is considered.
+
+  The flat damage bonus counts as the damage type of the first die, like the weapon's main damage.
+
+  Args:
+      profile (DamageConstructs/AttackProfile): The attack.
+      critical (bool): If the damage dice are rolled twice.
+      resistances (frozenset of str, optional): Damage types the target takes half damage from.
+      immunities (frozenset of str, optional): Damage types the target takes no damage from.
+
+  Returns:
+      tuple of float: The PMF of the damage.
+  """
+  dice_per_type = {}
+  for dice_size, damage_type in zip(profile.dice, profile.damage_types):
+    dice_per_type.setdefault(damage_type, []).append(dice_size)
+  main_type = profile.damage_types[0] if profile.damage_types else None
+
+  pmf = (1.0,)
+  if main_type is None:
+    return add_constant(pmf, profile.damage_bonus)
+  for damage_type, dice in dice_per_type.items():
+    if critical:
+      dice = dice + dice
+    type_pmf = dice_pmf(tuple(dice))
+    if damage_type == main_type:
+      type_pmf = add_constant(type_pmf, profile.damage_bonus)
+    if damage_type in immunities:
+      continue
+    if damage_type in resistances:
+      type_pmf = halve(type_pmf)
+    pmf = convolve(pmf, type_pmf)
+  return pmf
+
+
+@lru_cache(maxsize=4096)
+def attack_damage_pmf(profile, target_ac, resistances=frozenset(), immunities=frozenset()):
+  """Returns the PMF of the damage one attack deals to a target, misses count as 0 damage.
+
+  Args:
+      profile (DamageConstructs/AttackProfile): The attack.
+      target_ac (int): The armour class of the target.
+      resistances (frozenset of str, optional): Damage types the target takes half damage from.
+      immunities (frozenset of str, optional): Damage types the target takes no damage from.
+
+  Returns:
+      tuple of float: The PMF of the damage.
+  """
+  hit_chance, critical_chance = hit_probabilities(profile.to_hit, target_ac, profile.natural_one_misses)
+  miss_chance = 1.0 - hit_chance - critical_chance
+  return mix([(miss_chance, (1.0,)),
+              (hit_chance, hit_damage_pmf(profile, False, resistances, immunities)),
+              (critical_chance, hit_damage_pmf(profile, True, resistances, immunities))])
+
+
+def creature_attack_pmf(creature, target_ac, resistances=frozenset(), immunities=frozenset()):
+  """Returns the PMF of the damage of one attack by a creature, a mixture over the weapons it picks from.
+
+  Args:
+      creature (BaseCreature or subclass): The attacking creature.
+      target_ac (int): The armour class of the target.
+      resistances (frozenset of str, optional): Damage types the target takes half damage from.
+      immunities (frozenset of str, optional): Damage types the target takes no damage from.
+
+  Returns:
+      tuple of float: The PMF of the damage.
+  """
+  profiles = creature.get_attack_profiles()
+  if not profiles:
+    return (1.0,)
+  weight = 1.0 / len(profiles)
+  return mix([(weight, attack_damage_pmf(profile, target_ac, frozenset(resistances), frozenset(immunities)))
+              for profile in profiles])
+
+
+def expected_damage(profile, target_ac=None):
+  """Returns the expected damage of one attack.
+
+  Args:
+      profile (DamageConstructs/AttackProfile): The attack.
+      target_ac (int, optional): The armour class of the target. Without one this is the expected damage of a normal
+        hit.
+
+  Returns:
+      float: The expected damage.
+  """
+  if target_ac is None:
+    return pmf_mean(hit_damage_pmf(profile, False))
+  return pmf_mean(attack_damage_pmf(profile, target_ac))
@@ -0,0 +1,326 @@
+"""The danger rating of an encounter, from constant memory statistics over any number of combats.
+
+A DangerAggregator is a sink (see CombatEvents) that measures every combat as it is fought and folds the measurements
+into online estimators, without keeping the combats themselves:
+  * RunningMoments: the count, mean, variance, minimum and maximum (Welford's algorithm).
+  * Histogram: counts in fixed width bins.
+  * QuantileSketch: counts in logarithmic bins, any quantile within a fixed relative error.
+
+Every estimator merges with another of the same kind, so aggregators filled by separate workers or separate runs can
+be combined into the aggregator of all their combats. The counts and histograms merge exactly, the means and variances
+up to floating point rounding.
+
+The measurements per combat, for the players (the first team):
+  player_win, pcs_downed, max_damage_taken (by a single player character, from attacks, spells and effects alike),
+  hits_on_players, misses_on_players, hits_by_players, misses_by_players, rounds and remaining_party_hp (as a
+  fraction of the party's hit points).
+
+danger_score() combines them into a single number from 0 (a walk in the park) to 100 (a total party kill every time).
+
+Use it like so:
+  danger = DangerAggregator(teams)
+  for i in range(combat_attempts):
+    state.reset()
+    run_combat(teams, rng, danger, state)
+  print(danger.report())
+"""
+
+from CombatEvents import NullSink
+import math
+
+
+class RunningMoments:
+  """The count, mean, variance, minimum and maximum of a stream of values."""
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.sum_of_squares = 0.0
+    self.minimum = math.inf
+    self.maximum = -math.inf
+
+  def __repr__(self):
+    return 'RunningMoments(count={}, mean={:.4g}, stddev={:.4g}, min={}, max={})'.format(
+      self.count, self.mean, self.stddev(), self.minimum, self.maximum)
+
+  def add(self, value):
+    """Adds a value, with Welford's update of the mean and the sum of squared differences from it."""
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.sum_of_squares += delta * (value - self.mean)
+    if value < self.minimum:
+      self.minimum = value
+    if value > self.maximum:
+      self.maximum = value
+
+  def merge(self, other):
+    """Adds the values of another RunningMoments to this one (Chan's parallel update), returns self."""
+    if not other.count:
+      return self
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.sum_of_squares += other.sum_of_squares + delta * delta * self.count * other.count / count
+    self.mean += delta * other.count / count
+    self.count = count
+    self.minimum = min(self.minimum, other.minimum)
+    self.maximum = max(self.maximum, other.maximum)
+    return self
+
+  def variance(self):
+    """Returns the sample variance, 0 with fewer than two values."""
+    return self.sum_of_squares / (self.count - 1) if self.count > 1 else 0.0
+
+  def stddev(self):
+    """Returns the sample standard deviation."""
+    return math.sqrt(self.variance())
+
+
+class Histogram:
+  """Counts values in bins of a fixed width between low and high, plus the values below and above that range."""
+
+  def __init__(self, low, high, bins):
+    """Creates the empty bins.
+
+    Args:
+        low (float): The lower edge of the first bin.
+        high (float): The upper edge of the last bin.
+        bins (int): The number of bins.
+    """
+    if high <= low or bins < 1:
+      raise ValueError('A histogram needs low < high and at least one bin, got {}, {} and {}'.format(low, high, bins))
+    self.low = low
+    self.high = high
+    self.width = (high - low) / bins
+    self.counts = [0] * bins
+    self.below = 0
+    self.above = 0
+
+  def __repr__(self):
+    return 'Histogram({} to {}, {} bins, {} below, {} above)'.format(self.low, self.high, len(self.counts),
+                                                                     self.below, self.above)
+
+  def add(self, value):
+    """Counts a value."""
+    if value < self.low:
+      self.below += 1
+    elif value >= self.high:
+      self.above += 1
+    else:
+      self.counts[int((value - self.low) / self.width)] += 1
+
+  def merge(self, other):
+    """Adds the counts of a histogram with the same bins to this one, returns self."""
+    if (other.low, other.high, len(other.counts)) != (self.low, self.high, len(self.counts)):
+      raise ValueError('Cannot merge histograms with different bins: {} and {}'.format(self, other))
+    self.counts = [own + theirs for own, theirs in zip(self.counts, other.counts)]
+    self.below += other.below
+    self.above += other.above
+    return self
+
+  def bins(self):
+    """Returns (lower edge, upper edge, count) for every bin."""
+    return [(self.low + index * self.width, self.low + (index + 1) * self.width, count)
+            for index, count in enumerate(self.counts)]
+
+
+class QuantileSketch:
+  """Estimates quantiles of non negative values within a relative error, in memory logarithmic in their range.
+
+  Every value above 0 is counted in the bin i with gamma^(i-1) < value <= gamma^i, gamma being
+  (1 + relative_accuracy) / (1 - relative_accuracy), and a quantile is answered with the middle of its bin. Values of 0
+  (e.g. no party hit points left) are counted on their own. Merging adds up the bin counts, so it is exact.
+  """
+
+  def __init__(self, relative_accuracy=0.01):
+    """Creates an empty sketch.
+
+    Args:
+        relative_accuracy (float, optional): The largest relative error of a quantile, e.g. 0.01 for 1%.
+    """
+    if not 0.0 < relative_accuracy < 1.0:
+      raise ValueError('relative_accuracy must be between 0 and 1, got {}'.format(relative_accuracy))
+    self.relative_accuracy = relative_accuracy
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.bins = {}
+    self.zeros = 0
+    self.count = 0
+
+  def __repr__(self):
+    return 'QuantileSketch(count={}, bins={}, median={})'.format(self.count, len(self.bins), self.quantile(0.5))
+
+  def add(self, value):
+    """Counts a value, negative values count as 0."""
+    self.count += 1
+    if value <= 0:
+      self.zeros += 1
+      return
+    index = math.ceil(math.log(value) / self.log_gamma)
+    self.bins[index] = self.bins.get(index, 0) + 1
+
+  def merge(self, other):
+    """Adds the counts of a sketch with the same relative accuracy to this one, returns self."""
+    if other.relative_accuracy != self.relative_accuracy:
+      raise ValueError('Cannot merge sketches with relative accuracies {} and {}'.format(self.relative_accuracy,
+                                                                                         other.relative_accuracy))
+    for index, count in other.bins.items():
+      self.bins[index] = self.bins.get(index, 0) + count
+    self.zeros += other.zeros
+    self.count += other.count
+    return self
+
+  def quantile(self, probability):
+    """Returns the estimated quantile, e.g. quantile(0.5) for the median, None if the sketch is empty."""
+    if not self.count:
+      return None
+    rank = probability * (self.count - 1)
+    seen = self.zeros
+    if rank < seen:
+      return 0.0
+    for index in sorted(self.bins):
+      seen += self.bins[index]
+      if rank < seen:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+    return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+# what is measured for every combat, and which of the measurements also get a quantile sketch
+MEASUREMENTS = ('player_win', 'pcs_downed', 'max_damage_taken', 'hits_on_players', 'misses_on_players',
+                'hits_by_players', 'misses_by_players', 'rounds', 'remaining_party_hp')
+SKETCHED = ('rounds', 'remaining_party_hp')
+
+
+class DangerAggregator(NullSink):
+  """Measures every combat it is the sink of and keeps constant memory statistics of the measurements."""
+
+  def __init__(self, teams, relative_accuracy=0.01):
+    """Creates the empty statistics.
+
+    Args:
+        teams (list of GameConstructs/Team): The teams of the combats, the first team are the players.
+        relative_accuracy (float, optional): The relative accuracy of the quantile sketches.
+    """
+    self.players = set(teams[0].team_members)
+    self.party_hp = sum(creature.hp for creature in teams[0].team_members) or 1
+    self.moments = {name: RunningMoments() for name in MEASUREMENTS}
+    self.sketches = {name: QuantileSketch(relative_accuracy) for name in SKETCHED}
+    self.downed_histogram = Histogram(0, len(self.players) + 1, len(self.players) + 1)
+    self.rounds_histogram = Histogram(0, 50, 50)
+    self.start_combat()
+
+  def __getstate__(self):
+    # the creatures are not needed once the combats are over, leave them out when sent between processes
+    state = dict(self.__dict__)
+    state['players'] = set()
+    return state
+
+  def start_combat(self):
+    """Clears the measurements of the current combat."""
+    self.downed = set()
+    self.damage_taken = {}
+    self.hits_on_players = 0
+    self.misses_on_players = 0
+    self.hits_by_players = 0
+    self.misses_by_players = 0
+
+  def attack(self, event):
+    if event.target in self.players:
+      if event.hit:
+        self.hits_on_players += 1
+        self.damage_taken[event.target] = self.damage_taken.get(event.target, 0) + event.damage
+      else:
+        self.misses_on_players += 1
+    elif event.attacker in self.players:
+      if event.hit:
+        self.hits_by_players += 1
+      else:
+        self.misses_by_players += 1
+
+  def hit_points(self, creature, source, change):
+    # the damage of spells and effects, healing does not take damage back
+    if change < 0 and creature in self.players:
+      self.damage_taken[creature] = self.damage_taken.get(creature, 0) - change
+
+  def down(self, creature):
+    if creature in self.players:
+      self.downed.add(creature)
+
+  def combat_end(self, teams, result, state):
+    remaining_hp = sum(max(hp, 0) for hp, team in zip(state.hp, state.team) if team == 0)
+    measured = {'player_win': 1 if result.winner == 0 else 0,
+                'pcs_downed': len(self.downed),
+                'max_damage_taken': max(self.damage_taken.values(), default=0),
+                'hits_on_players': self.hits_on_players,
+                'misses_on_players': self.misses_on_players,
+                'hits_by_players': self.hits_by_players,
+                'misses_by_players': self.misses_by_players,
+                'rounds': result.rounds,
+                'remaining_party_hp': remaining_hp / self.party_hp}
+    for name, value in measured.items():
+      self.moments[name].add(value)
+    for name in SKETCHED:
+      self.sketches[name].add(measured[name])
+    self.downed_histogram.add(measured['pcs_downed'])
+    self.rounds_histogram.add(measured['rounds'])
+    self.start_combat()
+
+  def merge(self, other):
+    """Adds the statistics of an aggregator of the same encounter to this one, returns self."""
+    for name in MEASUREMENTS:
+      self.moments[name].merge(other.moments[name])
+    for name in SKETCHED:
+      self.sketches[name].merge(other.sketches[name])
+    self.downed_histogram.merge(other.downed_histogram)
+    self.rounds_histogram.merge(other.rounds_histogram)
+    return self
+
+  @property
+  def combats(self):
+    """The number of combats measured."""
+    return self.moments['rounds'].count
+
+  def danger_score(self):
+    """Returns the danger of the encounter from 0 to 100.
+
+    Half of it is the chance of the players losing, 30% the average fraction of the party that drops and 20% the
+    average fraction of the party's hit points lost, so an encounter the players always win without anybody dropping
+    can still score up to 20 if it leaves them battered.
+    """
+    if not self.combats:
+      return 0.0
+    num_players = max(len(self.downed_histogram.counts) - 1, 1)
+    loss_rate = 1 - self.moments['player_win'].mean
+    downed_fraction = self.moments['pcs_downed'].mean / num_players
+    hp_lost_fraction = 1 - self.moments['remaining_party_hp'].mean
+    return 100 * (0.5 * loss_rate + 0.3 * downed_fraction + 0.2 * max(0.0, hp_lost_fraction))
+
+  def as_dict(self):
+    """Returns the statistics as a dictionary that can be written as JSON."""
+    return {'combats': self.combats,
+            'danger_score': self.danger_score(),
+            'measurements': {name: {'mean': moments.mean, 'stddev': moments.stddev(), 'min': moments.minimum,
+                                    'max': moments.maximum} for name, moments in self.moments.items()},
+            'quantiles': {name: {str(probability): sketch.quantile(probability)
+                                 for probability in (0.1, 0.5, 0.9, 0.99)} for name, sketch in self.sketches.items()},
+            'pcs_downed_histogram': [count for _, _, count in self.downed_histogram.bins()]}
+
+  def report(self):
+    """Renders the danger rating and the statistics behind it as text."""
+    lines = ['Danger score: {:.1f} / 100 over {} combats'.format(self.danger_score(), self.combats)]
+    for name, moments in self.moments.items():
+      if not moments.count:
+        # nothing was measured, there is no mean or extremes to show
+        lines.append('  {:<20} n/a'.format(name))
+        continue
+      lines.append('  {:<20} mean {:>8.3f}  stddev {:>8.3f}  min {:>8.3f}  max {:>8.3f}'.format(
+        name, moments.mean, moments.stddev(), moments.minimum, moments.maximum))
+    for name, sketch in self.sketches.items():
+      if not sketch.count:
+        lines.append('  {:<20} n/a'.format(name))
+        continue
+      lines.append('  {:<20} 10% {:.3g}, median {:.3g}, 90% {:.3g}, 99% {:.3g}'.format(
+        name, *(sketch.quantile(probability) for probability in (0.1, 0.5, 0.9, 0.99))))
+    lines.append('  player characters downed: {}'.format(', '.join(
+      '{}: {}'.format(int(low), count) for low, _, count in self.downed_histogram.bins())))
+    return '\n'.join(lines)
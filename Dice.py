@@ -0,0 +1,116 @@
+"""The dice the engine rolls with.
+
+Every roll and random choice in a combat goes through the rng handed to CombatEngine.run_combat, which is anything
+with these two methods of the random module:
+  randint(low, high): a whole number from low to high, both included, e.g. randint(1, 20) for a d20.
+  choice(sequence): one of the items of a non empty sequence.
+
+The backends:
+  * random.Random (or the random module itself): one Python call per die, the default.
+  * NumpyDice: rolls large blocks of every kind of die at once with a NumPy Generator and hands them out one by one.
+  * ScriptedDice: returns rolls from a list given up front, for tests and for replaying a combat.
+
+make_dice builds a backend by name, which is what the runners and the command line use:
+  rng = make_dice('numpy', seed=42)
+  run_combat(teams, rng)
+"""
+
+import random
+
+
+BACKENDS = ('random', 'numpy')
+
+
+class NumpyDice:
+  """Hands out rolls from blocks pre-generated by a NumPy Generator, one block per kind of die.
+
+  The rolls have the same distribution as those of random.Random but come from a different stream, so the same seed
+  gives different (and equally valid) combats than the random backend.
+  """
+
+  def __init__(self, seed=None, block_size=4096):
+    """Creates the generator, NumPy is only needed for this backend.
+
+    Args:
+        seed (int, optional): The seed of the NumPy Generator, the same seed gives the same rolls.
+        block_size (int, optional): The number of rolls generated at once for each kind of die.
+    """
+    import numpy
+    self.generator = numpy.random.default_rng(seed)
+    self.block_size = block_size
+    # the unused rolls of every (low, high) range, handed out from the end
+    self.buffers = {}
+
+  def randint(self, low, high):
+    buffer = self.buffers.get((low, high))
+    if not buffer:
+      if high < low:
+        raise ValueError('empty range for randint({}, {})'.format(low, high))
+      buffer = self.generator.integers(low, high + 1, size=self.block_size).tolist()
+      self.buffers[(low, high)] = buffer
+    return buffer.pop()
+
+  def choice(self, sequence):
+    if not sequence:
+      raise IndexError('Cannot choose from an empty sequence')
+    return sequence[self.randint(0, len(sequence) - 1)]
+
+
+class ScriptedDice:
+  """Returns the rolls of a script, in order.
+
+  Every randint returns the next value of the script, which has to be in its range. Every choice takes the next value
+  of the script as the 0 based index of the item to pick. For example ScriptedDice([20, 6, 6]) makes a creature with a
+  single d6 weapon land a critical hit for 12 plus its bonus.
+  """
+
+  def __init__(self, rolls, repeat=False):
+    """Stores the script.
+
+    Args:
+        rolls (list of int): The values to return.
+        repeat (bool, optional): Start again from the first value when the script runs out, instead of raising an
+          IndexError.
+    """
+    self.rolls = list(rolls)
+    self.repeat = repeat
+    self.position = 0
+
+  def next_roll(self):
+    """Returns the next value of the script."""
+    if self.position >= len(self.rolls):
+      if not self.repeat or not self.rolls:
+        raise IndexError('The script of {} rolls ran out'.format(len(self.rolls)))
+      self.position = 0
+    roll = self.rolls[self.position]
+    self.position += 1
+    return roll
+
+  def randint(self, low, high):
+    roll = self.next_roll()
+    if not low <= roll <= high:
+      raise ValueError('Scripted roll {} is not between {} and {}'.format(roll, low, high))
+    return roll
+
+  def choice(self, sequence):
+    index = self.next_roll()
+    if not 0 <= index < len(sequence):
+      raise ValueError('Scripted choice {} is not an index of a sequence of {}'.format(index, len(sequence)))
+    return sequence[index]
+
+
+def make_dice(backend='random', seed=None):
+  """Builds dice by the name of their backend.
+
+  Args:
+      backend (str, optional): 'random' for a random.Random, 'numpy' for NumpyDice.
+      seed (int, optional): The seed of the dice.
+
+  Returns:
+      random.Random or NumpyDice: The dice.
+  """
+  if backend == 'random':
+    return random.Random(seed)
+  if backend == 'numpy':
+    return NumpyDice(seed)
+  raise ValueError('Unknown dice backend {}, pick from {}'.format(backend, ', '.join(BACKENDS)))
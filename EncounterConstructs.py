@@ -0,0 +1,274 @@
+"""Encounters defined in JSON (or TOML) files instead of code.
+
+An encounter file lists the teams and the creatures on each team, for example:
+
+  {
+    "name": "Hill Giants",
+    "teams": [
+      {"name": "Players",
+       "members": [
+         {"type": "player", "name": "Geoff", "max_hp": 140, "strength": 18, "dexterity": 14, "constitution": 14,
+          "intelligence": 8, "wisdom": 13, "charisma": 14, "attacks_per_action": 2, "level": 13,
+          "weapons": [{"name": "greatclub", "magic_bonus": 1, "damage": [[10, "bludgeoning"]]}],
+          "light_armor": {"name": "Studded Leather", "base_ac": 12}}]},
+      {"name": "Monsters",
+       "members": [
+         {"type": "monster", "name": "Hill Giant", "count": 2, "max_hp": 105, "ac": 15, "strength": 21,
+          "dexterity": 8, "constitution": 19, "intelligence": 5, "wisdom": 9, "charisma": 6, "attacks_per_action": 2,
+          "weapons": [{"name": "Greatclub", "to_hit_bonus": 8, "damage_bonus": 5,
+                       "damage": [[8, "bludgeoning"], [8, "bludgeoning"], [8, "bludgeoning"]]}]}]}
+    ]
+  }
+
+Players take the arguments of PlayerCharacter plus "weapons" (give_melee_weapon arguments, or give_ranged_weapon ones
+for a weapon with a "range" of [short, long] in feet), "light_armor", "heavy_armor" and "shield". Monsters take the
+arguments of Monster plus "weapons" (the Monster.give_melee_weapon arguments, monsters have no ranged weapons).
+"count" adds several copies of a creature, numbered "Hill Giant 1", "Hill Giant 2" and so on. Both can have "spells",
+see StatusEffects/Spell.from_spec.
+
+An encounter can also have a "terrain": the rows of its map as text, see Terrain/Terrain.from_rows. It is only used
+when the encounter is fought on a map (--map), with the teams lined up in the middle of it.
+
+A loaded file is compiled into immutable EncounterTemplate and CreatureTemplate objects. They build fresh Team and
+creature objects on demand; a run builds them once and resets them between combats with a GameConstructs/CombatState.
+"""
+
+from CharacterClasses import Monster, PlayerCharacter
+from GameConstructs import Team
+from StatusEffects import Spell
+from Terrain import Terrain
+import json
+import os
+
+try:
+  import tomllib
+except ImportError:
+  tomllib = None
+
+
+PLAYER_STATS = ('max_hp', 'strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma',
+                'attacks_per_action', 'level')
+MONSTER_STATS = ('max_hp', 'strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma',
+                 'attacks_per_action', 'ac')
+
+
+def canonical_json(value):
+  """Returns a JSON string of a spec that is the same for equal specs, whatever the order of their keys."""
+  return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+class CreatureTemplate:
+  """An immutable definition of one creature that builds new PlayerCharacter or Monster objects."""
+
+  __slots__ = ('_spec_json', 'kind', 'name')
+
+  def __init__(self, spec):
+    """Checks and stores a creature spec.
+
+    Args:
+        spec (dict): The creature as read from an encounter file, see the module docstring. It is copied, changing it
+          afterwards does not change the template.
+    """
+    kind = spec.get('type')
+    required = PLAYER_STATS if kind == 'player' else MONSTER_STATS if kind == 'monster' else None
+    if required is None:
+      raise ValueError('Creature {} must have a "type" of "player" or "monster"'.format(spec.get('name')))
+    missing = [stat for stat in ('name',) + required if stat not in spec]
+    if missing:
+      raise ValueError('Creature {} is missing {}'.format(spec.get('name'), ', '.join(missing)))
+    object.__setattr__(self, '_spec_json', canonical_json(spec))
+    object.__setattr__(self, 'kind', kind)
+    object.__setattr__(self, 'name', spec['name'])
+
+  def __setattr__(self, name, value):
+    raise AttributeError('CreatureTemplate is immutable')
+
+  def __eq__(self, other):
+    return isinstance(other, CreatureTemplate) and self._spec_json == other._spec_json
+
+  def __hash__(self):
+    return hash(self._spec_json)
+
+  def __repr__(self):
+    return 'CreatureTemplate({} {})'.format(self.kind, self.name)
+
+  @property
+  def spec(self):
+    """A copy of the creature spec, as a dict."""
+    return json.loads(self._spec_json)
+
+  def with_changes(self, **changes):
+    """Returns a new template with some of the spec replaced, e.g. template.with_changes(max_hp=70)."""
+    spec = self.spec
+    spec.update(changes)
+    return CreatureTemplate(spec)
+
+  def build(self, name=None):
+    """Builds a new creature from the template.
+
+    Args:
+        name (str, optional): The name of the new creature, defaults to the name in the template.
+
+    Returns:
+        PlayerCharacter or Monster: The creature, at full hit points and with its weapons and armour.
+    """
+    spec = self.spec
+    name = name or spec['name']
+    ancillary_characteristics = spec.get('ancillary_characteristics', {})
+    if self.kind == 'player':
+      creature = PlayerCharacter(name, spec['max_hp'], spec['strength'], spec['dexterity'], spec['constitution'],
+                                 spec['intelligence'], spec['wisdom'], spec['charisma'], spec['attacks_per_action'],
+                                 ancillary_characteristics, spec['level'], spec.get('bonus_action_attack', False))
+      for weapon in spec.get('weapons', []):
+        if 'range' in weapon:
+          range_short, range_long = weapon['range']
+          creature.give_ranged_weapon(weapon['name'], weapon.get('magic_bonus', 0),
+                                      [tuple(die) for die in weapon['damage']], range_short, range_long,
+                                      weapon.get('baseline_magic', False))
+        else:
+          creature.give_melee_weapon(weapon['name'], weapon.get('finesse', False), weapon.get('versatile', False),
+                                     weapon.get('magic_bonus', 0), [tuple(die) for die in weapon['damage']],
+                                     weapon.get('baseline_magic', False))
+      if 'light_armor' in spec:
+        creature.give_light_armor(spec['light_armor']['name'], spec['light_armor']['base_ac'])
+      if 'heavy_armor' in spec:
+        creature.give_heavy_armor(spec['heavy_armor']['name'], spec['heavy_armor']['base_ac'])
+      if 'shield' in spec:
+        creature.give_shield(spec['shield']['name'], spec['shield'].get('magic_bonus', 0))
+    else:
+      creature = Monster(name, spec['max_hp'], spec['strength'], spec['dexterity'], spec['constitution'],
+                         spec['intelligence'], spec['wisdom'], spec['charisma'], spec['attacks_per_action'],
+                         ancillary_characteristics, spec['ac'])
+      for weapon in spec.get('weapons', []):
+        if 'range' in weapon:
+          raise ValueError('{} has a ranged weapon {}, only players can have them'.format(name, weapon['name']))
+        creature.give_melee_weapon(weapon['name'], weapon['to_hit_bonus'], weapon['damage_bonus'],
+                                   [tuple(die) for die in weapon['damage']], weapon.get('baseline_magic', False))
+    for spell in spec.get('spells', []):
+      creature.give_spell(Spell.from_spec(spell))
+    return creature
+
+  def build_all(self):
+    """Builds as many creatures as the spec "count" asks for, numbered if there is more than one.
+
+    Returns:
+        list of PlayerCharacter or Monster: The new creatures.
+    """
+    count = self.spec.get('count', 1)
+    if count == 1:
+      return [self.build()]
+    return [self.build('{} {}'.format(self.name, number)) for number in range(1, count + 1)]
+
+
+class EncounterTemplate:
+  """An immutable definition of an encounter: named teams of creature templates, and the terrain of its map."""
+
+  __slots__ = ('name', 'teams', 'terrain')
+
+  def __init__(self, name, teams, terrain=None):
+    """Stores the encounter.
+
+    Args:
+        name (str): The name of the encounter.
+        teams (list of tuple): (team name, list of CreatureTemplate) pairs.
+        terrain (list of str, optional): The rows of the terrain, see Terrain/Terrain.from_rows.
+    """
+    if terrain is not None:
+      if isinstance(terrain, str) or not all(isinstance(row, str) for row in terrain):
+        raise ValueError('The "terrain" of an encounter is a list of rows of text')
+      # fail on a bad drawing when the encounter is read, not when it is first fought on a map
+      Terrain.from_rows(terrain)
+      terrain = tuple(terrain)
+    object.__setattr__(self, 'name', name)
+    object.__setattr__(self, 'teams', tuple((team_name, tuple(members)) for team_name, members in teams))
+    object.__setattr__(self, 'terrain', terrain)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('EncounterTemplate is immutable')
+
+  def __eq__(self, other):
+    return isinstance(other, EncounterTemplate) and self.to_spec() == other.to_spec()
+
+  def __hash__(self):
+    return hash(canonical_json(self.to_spec()))
+
+  def __repr__(self):
+    return 'EncounterTemplate({}: {})'.format(self.name, ' vs '.join(
+      '{} ({})'.format(team_name, len(members)) for team_name, members in self.teams))
+
+  @classmethod
+  def from_spec(cls, spec):
+    """Compiles an encounter spec, as read from an encounter file.
+
+    Args:
+        spec (dict): The encounter, see the module docstring.
+
+    Returns:
+        EncounterTemplate: The compiled encounter.
+    """
+    if len(spec.get('teams', [])) < 2:
+      raise ValueError('An encounter needs at least two teams')
+    teams = []
+    for team in spec['teams']:
+      teams.append((team['name'], [CreatureTemplate(member) for member in team.get('members', [])]))
+    return cls(spec.get('name', ''), teams, spec.get('terrain'))
+
+  def to_spec(self):
+    """Returns the encounter as a spec dict, the inverse of from_spec."""
+    spec = {'name': self.name,
+            'teams': [{'name': team_name, 'members': [member.spec for member in members]}
+                      for team_name, members in self.teams]}
+    if self.terrain is not None:
+      spec['terrain'] = list(self.terrain)
+    return spec
+
+  def build(self):
+    """Builds new teams with new creatures from the templates.
+
+    Returns:
+        list of GameConstructs/Team: The teams ready to fight, with a score of 0.
+    """
+    teams = []
+    for team_name, members in self.teams:
+      team = Team(team_name)
+      for member in members:
+        team.team_members.extend(member.build_all())
+      teams.append(team)
+    return teams
+
+  def build_terrain(self):
+    """Builds a new Terrain/Terrain from the rows of the encounter, None if it has none."""
+    return Terrain.from_rows(self.terrain) if self.terrain is not None else None
+
+
+def load_encounter(path):
+  """Reads and compiles an encounter file.
+
+  Args:
+      path (str): The path of a .json file, or a .toml file on Python 3.11 and later.
+
+  Returns:
+      EncounterTemplate: The compiled encounter, named after the file if the file has no name.
+  """
+  if path.endswith('.toml'):
+    if tomllib is None:
+      raise ValueError('Reading TOML encounters needs Python 3.11 or later, use JSON instead: {}'.format(path))
+    with open(path, 'rb') as toml_file:
+      spec = tomllib.load(toml_file)
+  else:
+    with open(path) as json_file:
+      spec = json.load(json_file)
+  spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+  return EncounterTemplate.from_spec(spec)
+
+
+def save_encounter(template, path):
+  """Writes an encounter template to a JSON file that load_encounter can read back.
+
+  Args:
+      template (EncounterTemplate): The encounter.
+      path (str): The path of the JSON file to write.
+  """
+  with open(path, 'w') as json_file:
+    json.dump(template.to_spec(), json_file, indent=2)
+    json_file.write('\n')
@@ -0,0 +1,275 @@
+"""Suggests monster lineups for a party that hit a target lethality.
+
+Given a party, a pool of monster templates and a target such as "the players win 85-95% of the time and at most 10% of
+the combats see a player character drop", the optimizer tries every mix of the monsters in the pool up to a number of
+monsters and estimates how each lineup does against the party.
+
+Simulating every lineup to a high precision would waste most of the fights on lineups that are obviously far too easy
+or too deadly, so the search races them with successive halving:
+  * every lineup still in the race fights a batch of combats, a few hundred in the first round,
+  * a lineup is dropped as soon as the confidence interval of its rates rules out the target,
+  * only the better half of the rest goes on to the next round, where the batches are twice as large,
+until the remaining lineups are known precisely enough or the budget of fights runs out.
+
+Use it like so:
+  encounter = load_encounter('encounters/hill_giants.json')
+  party = encounter.teams[0][1]
+  pool = [monster.with_changes(count=1) for monster in encounter.teams[1][1]]
+  target = LethalityTarget(min_player_win=0.85, max_player_win=0.95, max_down_rate=0.1)
+  for lineup in optimize_encounter(party, pool, target):
+    print(lineup)
+
+or from the command line:
+  python EncounterOptimizer.py encounters/hill_giants.json --min-win 0.85 --max-win 0.95 --max-down 0.1
+"""
+
+from CombatEngine import run_combat
+from EncounterConstructs import load_encounter
+from GameConstructs import CombatState, Team
+from ParallelRunner import derive_seed
+from SimulationStatistics import wilson_interval
+from itertools import combinations_with_replacement
+import argparse
+import logging
+import random
+
+
+class LethalityTarget:
+  """The outcome the DM is after: a range for the player win rate and an upper bound on player characters dropping."""
+
+  def __init__(self, min_player_win=0.0, max_player_win=1.0, max_down_rate=None):
+    """Stores the target.
+
+    Args:
+        min_player_win (float, optional): The lowest acceptable chance of the players winning.
+        max_player_win (float, optional): The highest acceptable chance of the players winning.
+        max_down_rate (float, optional): The highest acceptable chance of at least one player character dropping to 0
+          hit points in a combat, None for no limit.
+    """
+    if not 0.0 <= min_player_win <= max_player_win <= 1.0:
+      raise ValueError('Need 0 <= min_player_win <= max_player_win <= 1, got {} and {}'.format(min_player_win,
+                                                                                             max_player_win))
+    self.min_player_win = min_player_win
+    self.max_player_win = max_player_win
+    self.max_down_rate = max_down_rate
+
+  def __repr__(self):
+    return 'LethalityTarget(player win {:.0%}-{:.0%}, down rate <= {})'.format(
+      self.min_player_win, self.max_player_win,
+      'any' if self.max_down_rate is None else '{:.0%}'.format(self.max_down_rate))
+
+  def miss(self, player_win_rate, down_rate):
+    """Returns how far the rates are outside the target, 0 if they are on target."""
+    miss = max(0.0, self.min_player_win - player_win_rate) + max(0.0, player_win_rate - self.max_player_win)
+    if self.max_down_rate is not None:
+      miss += max(0.0, down_rate - self.max_down_rate)
+    return miss
+
+  def could_meet(self, win_interval, down_interval):
+    """Returns False if the confidence intervals of the rates rule the target out."""
+    low, high = win_interval
+    if high < self.min_player_win or low > self.max_player_win:
+      return False
+    return self.max_down_rate is None or down_interval[0] <= self.max_down_rate
+
+
+class LineupResult:
+  """A monster lineup and how it fared against the party so far."""
+
+  def __init__(self, lineup, party):
+    """Builds the teams of the lineup, ready to fight.
+
+    Args:
+        lineup (tuple): (EncounterConstructs/CreatureTemplate, count) pairs of the monsters.
+        party (list of EncounterConstructs/CreatureTemplate): The player characters.
+    """
+    self.lineup = lineup
+    self.fights = 0
+    self.player_wins = 0
+    self.downs = 0
+    self.rounds = 0
+    player_team = Team('Players')
+    monster_team = Team('Monsters')
+    for member in party:
+      player_team.team_members.extend(member.build_all())
+    for monster, count in lineup:
+      monster_team.team_members.extend(monster.with_changes(count=count).build_all())
+    self.teams = [player_team, monster_team]
+    self.state = CombatState(self.teams)
+
+  def __repr__(self):
+    low, high = self.win_interval()
+    down_low, down_high = self.down_interval()
+    return '{}: players win {:.1%} ({:.1%}-{:.1%}), a PC drops {:.1%} ({:.1%}-{:.1%}) over {} combats'.format(
+      self.describe(), self.player_win_rate(), low, high, self.down_rate(), down_low, down_high, self.fights)
+
+  def describe(self):
+    """Returns the lineup as text, e.g. '2 x Hill Giant + 1 x Ogre'."""
+    return ' + '.join('{} x {}'.format(count, monster.name) for monster, count in self.lineup)
+
+  def fight(self, num_fights, seed):
+    """Fights more combats against the party and adds them to the tallies.
+
+    Args:
+        num_fights (int): The number of combats.
+        seed (int): The seed of these combats.
+    """
+    rng = random.Random(seed)
+    state = self.state
+    num_players = len(self.teams[0].team_members)
+    for _ in range(num_fights):
+      state.reset()
+      result = run_combat(self.teams, rng, state=state)
+      self.fights += 1
+      self.rounds += result.rounds
+      if result.winner == 0:
+        self.player_wins += 1
+      # the player characters are the first combatants, knockdowns counts every drop even if they were healed up
+      if any(state.knockdowns[index] for index in range(num_players)):
+        self.downs += 1
+    state.reset()
+
+  def player_win_rate(self):
+    """Returns the fraction of the combats the players won."""
+    return self.player_wins / self.fights if self.fights else 0.0
+
+  def down_rate(self):
+    """Returns the fraction of the combats in which at least one player character dropped."""
+    return self.downs / self.fights if self.fights else 0.0
+
+  def win_interval(self, confidence=0.95):
+    """Returns the Wilson confidence interval of the player win rate."""
+    return wilson_interval(self.player_wins, self.fights, confidence)
+
+  def down_interval(self, confidence=0.95):
+    """Returns the Wilson confidence interval of the rate of a player character dropping."""
+    return wilson_interval(self.downs, self.fights, confidence)
+
+  def miss(self, target):
+    """Returns how far the estimated rates are from the target, see LethalityTarget.miss."""
+    return target.miss(self.player_win_rate(), self.down_rate())
+
+
+def get_lineups(pool, min_monsters=1, max_monsters=4):
+  """Returns every mix of monsters from the pool with between min_monsters and max_monsters monsters.
+
+  Args:
+      pool (list of EncounterConstructs/CreatureTemplate): The monsters to pick from.
+      min_monsters (int, optional): The fewest monsters in a lineup.
+      max_monsters (int, optional): The most monsters in a lineup.
+
+  Returns:
+      list of tuple: (CreatureTemplate, count) pairs per lineup, in the order of the pool.
+  """
+  lineups = []
+  for size in range(min_monsters, max_monsters + 1):
+    for picks in combinations_with_replacement(range(len(pool)), size):
+      lineups.append(tuple((pool[index], picks.count(index)) for index in sorted(set(picks))))
+  return lineups
+
+
+def optimize_encounter(party, pool, target, min_monsters=1, max_monsters=4, first_batch=200, keep=5,
+                       precision=0.02, max_fights=200000, confidence=0.95, seed=0):
+  """Searches the monster lineups for the ones closest to a target lethality.
+
+  Args:
+      party (list of EncounterConstructs/CreatureTemplate): The player characters.
+      pool (list of EncounterConstructs/CreatureTemplate): The monsters to build lineups from, each counts as one
+        monster whatever its "count".
+      target (LethalityTarget): The rates to aim for.
+      min_monsters (int, optional): The fewest monsters in a lineup.
+      max_monsters (int, optional): The most monsters in a lineup.
+      first_batch (int, optional): The number of combats every lineup fights in the first round, doubled every round.
+      keep (int, optional): The number of lineups to return.
+      precision (float, optional): Stop once the player win rate of every remaining lineup is known within +/- this.
+      max_fights (int, optional): The budget of combats over all the lineups.
+      confidence (float, optional): The confidence level of the intervals used to drop lineups and to stop.
+      seed (int, optional): The seed of the search, the same seed gives the same lineups.
+
+  Returns:
+      list of LineupResult: Up to keep lineups, the ones that survived the race first, each group sorted by how close
+        its estimated rates are to the target.
+  """
+  if not pool:
+    raise ValueError('The pool of monsters is empty')
+  pool = [monster.with_changes(count=1) for monster in pool]
+  racing = [LineupResult(lineup, party) for lineup in get_lineups(pool, min_monsters, max_monsters)]
+  # every lineup has its own stream of seeds, so a lineup's estimates do not depend on which others are racing
+  seed_of = {candidate: derive_seed(seed, index) for index, candidate in enumerate(racing)}
+  logging.info('Racing {} lineups against {}'.format(len(racing), target))
+
+  eliminated = []
+  batch = first_batch
+  spent = 0
+  race_round = 0
+  while racing:
+    batch = min(batch, (max_fights - spent) // len(racing))
+    if batch <= 0:
+      break
+    for candidate in racing:
+      candidate.fight(batch, derive_seed(seed_of[candidate], race_round))
+    spent += batch * len(racing)
+    race_round += 1
+
+    # drop the lineups that can not meet the target, unless that is all of them
+    contenders = [candidate for candidate in racing
+                  if target.could_meet(candidate.win_interval(confidence), candidate.down_interval(confidence))]
+    contenders = contenders or racing
+    contenders.sort(key=lambda candidate: candidate.miss(target))
+    if len(contenders) > keep:
+      contenders = contenders[:max(keep, len(contenders) // 2)]
+    logging.info('Round {}: {} of {} lineups left after {} combats'.format(race_round, len(contenders), len(racing),
+                                                                           spent))
+    eliminated.extend(candidate for candidate in racing if candidate not in contenders)
+    racing = contenders
+
+    if len(racing) <= keep and all((high - low) / 2 <= precision for low, high in
+                                   (candidate.win_interval(confidence) for candidate in racing)):
+      break
+    batch *= 2
+
+  racing.sort(key=lambda candidate: candidate.miss(target))
+  # fill up with the closest of the dropped lineups if fewer than keep made it to the end
+  eliminated.sort(key=lambda candidate: candidate.miss(target))
+  return (racing + eliminated)[:keep]
+
+
+def parse_arguments(argv=None):
+  """Parses the command line options of the optimizer."""
+  parser = argparse.ArgumentParser(description='Suggest monster lineups for the party of an encounter file that hit a '
+                                               'target lethality. The first team is the party and the monsters of '
+                                               'the other teams are the pool.')
+  parser.add_argument('encounter', help='The encounter file, e.g. encounters/hill_giants.json.')
+  parser.add_argument('--min-win', type=float, default=0.85, help='The lowest acceptable player win rate.')
+  parser.add_argument('--max-win', type=float, default=0.95, help='The highest acceptable player win rate.')
+  parser.add_argument('--max-down', type=float, default=None, help='The highest acceptable chance of a player '
+                                                                   'character dropping in a combat.')
+  parser.add_argument('--min-monsters', type=int, default=1, help='The fewest monsters in a lineup.')
+  parser.add_argument('--max-monsters', type=int, default=4, help='The most monsters in a lineup.')
+  parser.add_argument('--keep', type=int, default=5, help='The number of lineups to suggest.')
+  parser.add_argument('--max-fights', type=int, default=200000, help='The budget of combats.')
+  parser.add_argument('--seed', type=int, default=0, help='The seed of the search.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  options = parse_arguments(argv)
+  encounter = load_encounter(options.encounter)
+  party = list(encounter.teams[0][1])
+  pool = []
+  for _, members in encounter.teams[1:]:
+    for monster in members:
+      monster = monster.with_changes(count=1)
+      if monster not in pool:
+        pool.append(monster)
+
+  target = LethalityTarget(options.min_win, options.max_win, options.max_down)
+  results = optimize_encounter(party, pool, target, options.min_monsters, options.max_monsters, keep=options.keep,
+                               max_fights=options.max_fights, seed=options.seed)
+  print('Lineups closest to {}:'.format(target))
+  for result in results:
+    print(result)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,304 @@
+"""Exact win probabilities of small encounters, without any simulation.
+
+A combat is a Markov chain over the hit points of every combatant and whose turn it is. For a given initiative order
+the chance of each team winning from a state only depends on the states it can move to, so it can be computed by
+dynamic programming over the hit point states, memoising every state that has been solved. The initiative order
+itself is random, so the result is averaged over every possible order, weighted by its exact probability.
+
+The rules are those of the simulation engines: each turn a living creature picks a random living opponent and makes
+all of its attacks against it, stopping early if it drops. The damage of every attack comes from the exact PMFs of
+the DamageDistribution module.
+
+A round in which nobody deals any damage brings the combat back to the state it started the round in, these cycles
+are solved in closed form per hit point state rather than by recursion.
+
+The number of states is the product of the hit points of all the combatants, times the number of initiative orders,
+so this is meant for small encounters (a handful of combatants). The hp_bucket option counts hit points in buckets
+of several points, which shrinks the state space at the cost of an approximation, and max_states bounds the memory.
+
+Use it like so:
+  result = solve_encounter([player_team, monster_team])
+  print(result.win_probabilities)
+"""
+
+from DamageDistribution import creature_attack_pmf
+from itertools import permutations
+import logging
+import sys
+
+
+class ExactResult:
+  """The exact outcome probabilities of an encounter."""
+
+  def __init__(self, teams, win_probabilities, states, orders):
+    """Stores the outcome.
+
+    Args:
+        teams (list of GameConstructs/Team): The teams that fought.
+        win_probabilities (list of float): The chance of each team winning, in the order of teams.
+        states (int): The number of hit point states that were solved.
+        orders (int): The number of initiative orders with a non zero chance.
+    """
+    self.teams = teams
+    self.win_probabilities = win_probabilities
+    self.states = states
+    self.orders = orders
+
+  def __repr__(self):
+    return 'ExactResult({}, states={}, orders={})'.format(
+      ', '.join('{}: {:.4f}'.format(team.name, probability)
+                for team, probability in zip(self.teams, self.win_probabilities)),
+      self.states, self.orders)
+
+
+def initiative_order_probabilities(dexterity_bonuses):
+  """Returns every initiative order with a non zero chance and that chance.
+
+  Each creature rolls a d20 plus its dexterity bonus, the highest goes first and ties keep the original order, as in
+  CombatEngine.get_initiative_order.
+
+  Args:
+      dexterity_bonuses (list of int): The dexterity bonus of each combatant, in the original order.
+
+  Returns:
+      list of tuple: (order, probability) pairs, where order is a tuple of combatant indices.
+  """
+  orders = []
+  lowest = min(dexterity_bonuses) + 1
+  highest = max(dexterity_bonuses) + 20
+  values = range(lowest, highest + 1)
+
+  def roll_chance(index, value):
+    return 0.05 if dexterity_bonuses[index] + 1 <= value <= dexterity_bonuses[index] + 20 else 0.0
+
+  for order in permutations(range(len(dexterity_bonuses))):
+    # chance[value] is the chance that the creatures from this position on are in order, with this position rolling
+    # value, filled in from the last position backwards
+    chance = {value: roll_chance(order[-1], value) for value in values}
+    for position in range(len(order) - 2, -1, -1):
+      # a creature may tie the next one only if it comes first in the original order
+      may_tie = order[position] < order[position + 1]
+      running_total = 0.0
+      below = {}
+      for value in values:
+        if may_tie:
+          running_total += chance[value]
+          below[value] = running_total
+        else:
+          below[value] = running_total
+          running_total += chance[value]
+      chance = {value: roll_chance(order[position], value) * below[value] for value in values}
+    probability = sum(chance.values())
+    if probability > 0:
+      orders.append((order, probability))
+  return orders
+
+
+def bucket_pmf(pmf, hp_bucket):
+  """Converts a damage PMF to hit point buckets, keeping the expected damage the same.
+
+  A damage that falls between two whole buckets is split between them, e.g. with buckets of 10 hit points a damage of
+  13 counts as 1 bucket with a 70% chance and as 2 buckets with a 30% chance.
+
+  Args:
+      pmf (tuple of float): The PMF of the damage in hit points.
+      hp_bucket (int): The number of hit points per bucket.
+
+  Returns:
+      tuple of float: The PMF of the damage in buckets.
+  """
+  if hp_bucket == 1:
+    return pmf
+  result = [0.0] * ((len(pmf) - 1) // hp_bucket + 2)
+  for damage, probability in enumerate(pmf):
+    buckets, remainder = divmod(damage, hp_bucket)
+    result[buckets] += probability * (hp_bucket - remainder) / hp_bucket
+    result[buckets + 1] += probability * remainder / hp_bucket
+  return tuple(result)
+
+
+class EncounterSolver:
+  """Solves the win probabilities of one initiative order, memoising every hit point state."""
+
+  def __init__(self, order, team_of, num_teams, num_attacks, damage_pmfs, max_states):
+    """Sets up the solver.
+
+    Args:
+        order (tuple of int): The combatant indices in initiative order.
+        team_of (list of int): The team index of each combatant.
+        num_teams (int): The number of teams.
+        num_attacks (list of int): The number of attacks of each combatant.
+        damage_pmfs (dict): The damage PMF (in hit point buckets) of one attack keyed by (attacker, target).
+        max_states (int): Raise an error instead of solving more states than this.
+    """
+    self.order = order
+    self.team_of = team_of
+    self.num_teams = num_teams
+    self.num_attacks = num_attacks
+    self.damage_pmfs = damage_pmfs
+    self.max_states = max_states
+    self.memo = {}
+    self.turn_outcomes = {}
+
+  def winner_vector(self, hp):
+    """Returns the win vector of a finished combat or None if more than one team is standing."""
+    alive_teams = set(self.team_of[index] for index, creature_hp in enumerate(hp) if creature_hp > 0)
+    if len(alive_teams) > 1:
+      return None
+    wins = [0.0] * self.num_teams
+    for team in alive_teams:
+      wins[team] = 1.0
+    return wins
+
+  def target_hp_distribution(self, attacker, target, target_hp):
+    """Returns the distribution of a targets hit points after the attacker's turn against it.
+
+    Args:
+        attacker (int): The attacking combatant.
+        target (int): The target combatant.
+        target_hp (int): The targets hit points before the turn.
+
+    Returns:
+        dict: Chances keyed by the targets remaining hit points (0 if it dropped).
+    """
+    key = (attacker, target, target_hp)
+    if key in self.turn_outcomes:
+      return self.turn_outcomes[key]
+    pmf = self.damage_pmfs[(attacker, target)]
+    distribution = {target_hp: 1.0}
+    for _ in range(self.num_attacks[attacker]):
+      next_distribution = {}
+      for hp, chance in distribution.items():
+        if hp <= 0:
+          # the attacker stops attacking a target that dropped
+          next_distribution[hp] = next_distribution.get(hp, 0.0) + chance
+          continue
+        for damage, probability in enumerate(pmf):
+          if probability:
+            remaining = max(hp - damage, 0)
+            next_distribution[remaining] = next_distribution.get(remaining, 0.0) + chance * probability
+      distribution = next_distribution
+    self.turn_outcomes[key] = distribution
+    return distribution
+
+  def solve(self, hp):
+    """Returns the win vector at the start of every turn of a round, for a hit point state.
+
+    Args:
+        hp (tuple of int): The hit points (or buckets) of every combatant, 0 for a creature that is down.
+
+    Returns:
+        list of list of float: Entry i is the chance of each team winning when it is turn i of the round.
+    """
+    if hp in self.memo:
+      return self.memo[hp]
+
+    finished = self.winner_vector(hp)
+    if finished is not None:
+      values = [finished] * len(self.order)
+      self.memo[hp] = values
+      return values
+
+    if len(self.memo) >= self.max_states:
+      raise MemoryError('The encounter needs more than {} states, use a larger hp_bucket'.format(self.max_states))
+
+    # For every turn i the value is V_i = r_i + q_i * V_i+1, where q_i is the chance the turn changes nothing and r_i
+    # the value of all the outcomes that lower somebody's hit points
+    changed_values = []
+    unchanged_chances = []
+    for turn, attacker in enumerate(self.order):
+      next_turn = (turn + 1) % len(self.order)
+      value = [0.0] * self.num_teams
+      if hp[attacker] <= 0:
+        changed_values.append(value)
+        unchanged_chances.append(1.0)
+        continue
+
+      targets = [index for index, creature_hp in enumerate(hp)
+                 if creature_hp > 0 and self.team_of[index] != self.team_of[attacker]]
+      unchanged = 0.0
+      for target in targets:
+        for remaining, chance in self.target_hp_distribution(attacker, target, hp[target]).items():
+          chance = chance / len(targets)
+          if remaining == hp[target]:
+            unchanged += chance
+            continue
+          next_hp = hp[:target] + (remaining,) + hp[target + 1:]
+          next_value = self.solve(next_hp)[next_turn]
+          for team in range(self.num_teams):
+            value[team] += chance * next_value[team]
+      changed_values.append(value)
+      unchanged_chances.append(unchanged)
+
+    # Write every V_i as A_i + B_i * V_0 from the last turn backwards, the turn after the last is turn 0 again
+    offsets = [0.0] * self.num_teams
+    factor = 1.0
+    offsets_per_turn = [None] * len(self.order)
+    factors_per_turn = [None] * len(self.order)
+    for turn in range(len(self.order) - 1, -1, -1):
+      offsets = [changed_values[turn][team] + unchanged_chances[turn] * offsets[team]
+                 for team in range(self.num_teams)]
+      factor = unchanged_chances[turn] * factor
+      offsets_per_turn[turn] = offsets
+      factors_per_turn[turn] = factor
+
+    if factor >= 1.0:
+      # nobody can ever damage anybody, the combat never ends
+      first_value = [0.0] * self.num_teams
+    else:
+      first_value = [offset / (1.0 - factor) for offset in offsets_per_turn[0]]
+
+    values = [[offsets_per_turn[turn][team] + factors_per_turn[turn] * first_value[team]
+               for team in range(self.num_teams)] for turn in range(len(self.order))]
+    self.memo[hp] = values
+    return values
+
+
+def solve_encounter(teams, hp_bucket=1, max_states=2000000):
+  """Computes the exact chance of each team winning an encounter.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat.
+      hp_bucket (int, optional): Count hit points in buckets of this many points. 1 is exact, larger values make the
+        state space smaller by rounding every hit point total up and splitting every damage roll between the two
+        nearest buckets.
+      max_states (int, optional): The most hit point states to solve per initiative order before giving up with a
+        MemoryError.
+
+  Returns:
+      ExactResult: The chance of each team winning.
+  """
+  combatants = []
+  team_of = []
+  for index, team in enumerate(teams):
+    for creature in team.team_members:
+      combatants.append(creature)
+      team_of.append(index)
+
+  damage_pmfs = {}
+  for attacker_index, attacker in enumerate(combatants):
+    for target_index, target in enumerate(combatants):
+      if team_of[attacker_index] != team_of[target_index]:
+        damage_pmfs[(attacker_index, target_index)] = bucket_pmf(creature_attack_pmf(attacker, target.ac), hp_bucket)
+
+  start_hp = tuple(-(-creature.hp // hp_bucket) for creature in combatants)
+  num_attacks = [creature.num_attacks for creature in combatants]
+  orders = initiative_order_probabilities([creature.get_bonus(creature.dexterity) for creature in combatants])
+
+  # every solved state is a couple of stack frames deep below the previous one
+  recursion_limit = sys.getrecursionlimit()
+  sys.setrecursionlimit(max(recursion_limit, 4 * sum(start_hp) + 1000))
+  try:
+    win_probabilities = [0.0] * len(teams)
+    states = 0
+    for order, probability in orders:
+      solver = EncounterSolver(order, team_of, len(teams), num_attacks, damage_pmfs, max_states)
+      values = solver.solve(start_hp)[0]
+      states += len(solver.memo)
+      for team in range(len(teams)):
+        win_probabilities[team] += probability * values[team]
+  finally:
+    sys.setrecursionlimit(recursion_limit)
+
+  logging.info('Solved the encounter exactly over {} initiative orders and {} states'.format(len(orders), states))
+  return ExactResult(teams, win_probabilities, states, len(orders))
@@ -1,3 +1,7 @@
+from array import array
+from bisect import insort
+
+
 class Team:
 
   def __init__(self, name):
@@ -5,3 +9,149 @@ class Team:
     self.score = 0
 
     self.team_members = []
+
+
+class CombatState:
+  """The mutable state of one combat, kept as compact arrays indexed by combatant.
+
+  The creatures themselves are the static stat blocks of the combat. Everything that changes while it is fought lives
+  here as a struct of arrays: the hit points, the initiative, whether each combatant is still standing, the index of
+  the last creature it targeted, the damage it dealt and how many times it dropped. Combatants are numbered team by
+  team in the order of the teams list.
+
+  The state captures the hit points the creatures have when it is created. reset() puts everything back to that point,
+  which is all that is needed to fight the same creatures again:
+    state = CombatState(teams)
+    for i in range(combat_attempts):
+      state.reset()
+      run_combat(teams, state=state)
+
+  This is the only place the hit points of a combat are written, the creatures' own current_hp is what the state
+  starts them at and is left alone.
+
+  The state also keeps an index of who is standing: the living members of every team, the number alive per team and
+  the number of teams with anybody alive. It is only updated when a combatant drops or is revived, so checking if the
+  combat is over costs nothing and finding the potential targets of a combatant only walks its living opponents.
+  """
+
+  __slots__ = ('teams', 'combatants', 'index_of', 'team', 'start_hp', 'hp', 'initiative', 'alive', 'last_target',
+               'damage_dealt', 'knockdowns', 'initiative_order', 'alive_members', 'alive_count', 'teams_standing')
+
+  def __init__(self, teams):
+    """Numbers the combatants and captures their current hit points.
+
+    Args:
+        teams (list of Team): The teams participating in the combat.
+    """
+    self.teams = teams
+    self.combatants = [creature for team in teams for creature in team.team_members]
+    self.index_of = {creature: index for index, creature in enumerate(self.combatants)}
+    self.team = array('i', [team_index for team_index, team in enumerate(teams) for _ in team.team_members])
+    self.start_hp = array('l', [creature.current_hp for creature in self.combatants])
+    self.hp = array('l', self.start_hp)
+    self.initiative = array('l', [0] * len(self.combatants))
+    self.alive = bytearray(hp > 0 for hp in self.start_hp)
+    self.last_target = array('l', [-1] * len(self.combatants))
+    self.damage_dealt = array('l', [0] * len(self.combatants))
+    self.knockdowns = array('l', [0] * len(self.combatants))
+    self.initiative_order = []
+    self.alive_members = [[] for _ in teams]
+    self.alive_count = array('l', [0] * len(teams))
+    self.teams_standing = 0
+    self.index_alive()
+
+  def index_alive(self):
+    """Rebuilds the index of living combatants from the alive flags."""
+    for members in self.alive_members:
+      members.clear()
+    for index, alive in enumerate(self.alive):
+      if alive:
+        self.alive_members[self.team[index]].append(index)
+    for team_index, members in enumerate(self.alive_members):
+      self.alive_count[team_index] = len(members)
+    self.teams_standing = sum(1 for count in self.alive_count if count)
+
+  def reset(self):
+    """Puts the combat back to the state it was in when this object was created."""
+    self.hp[:] = self.start_hp
+    self.alive[:] = bytearray(hp > 0 for hp in self.start_hp)
+    self.last_target[:] = array('l', [-1] * len(self.combatants))
+    self.damage_dealt[:] = array('l', [0] * len(self.combatants))
+    self.knockdowns[:] = array('l', [0] * len(self.combatants))
+    self.initiative_order = []
+    self.index_alive()
+
+  def apply_damage(self, index, damage):
+    """Takes damage off a combatant's hit points.
+
+    Args:
+        index (int): The combatant taking the damage.
+        damage (int): The amount of damage.
+
+    Returns:
+        bool: True if this damage dropped the combatant to 0 hit points or below.
+    """
+    self.hp[index] -= damage
+    if self.alive[index] and self.hp[index] < 1:
+      self.alive[index] = 0
+      self.knockdowns[index] += 1
+      team_index = self.team[index]
+      self.alive_members[team_index].remove(index)
+      self.alive_count[team_index] -= 1
+      if not self.alive_count[team_index]:
+        self.teams_standing -= 1
+      return True
+    return False
+
+  def heal(self, index, healing):
+    """Adds hit points to a combatant, a combatant that was down is revived if it gets above 0.
+
+    A combatant that is down is at 0 hit points, whatever damage dropped it, so the healing counts from 0.
+
+    Args:
+        index (int): The combatant being healed.
+        healing (int): The number of hit points to add.
+
+    Returns:
+        bool: True if this healing revived the combatant.
+    """
+    if not self.alive[index] and self.hp[index] < 0:
+      self.hp[index] = 0
+    self.hp[index] += healing
+    if not self.alive[index] and self.hp[index] > 0:
+      self.alive[index] = 1
+      team_index = self.team[index]
+      # keep the members in combatant order, the order the targets are picked from
+      insort(self.alive_members[team_index], index)
+      if not self.alive_count[team_index]:
+        self.teams_standing += 1
+      self.alive_count[team_index] += 1
+      return True
+    return False
+
+  def potential_targets(self, index):
+    """Returns the indices of the living combatants on other teams than the given combatant.
+
+    Args:
+        index (int): The combatant looking for a target.
+
+    Returns:
+        list of int: The indices of the potential targets.
+    """
+    own_team = self.team[index]
+    targets = []
+    for team_index, members in enumerate(self.alive_members):
+      if team_index != own_team:
+        targets.extend(members)
+    return targets
+
+  def teams_alive(self):
+    """Returns the number of teams with at least one combatant still standing."""
+    return self.teams_standing
+
+  def winner(self):
+    """Returns the index of the first team with a combatant still standing, -1 if there is none."""
+    for team_index, count in enumerate(self.alive_count):
+      if count:
+        return team_index
+    return -1
@@ -1,10 +1,13 @@
 from DamageConstructs import DamageDie
-from random import randint
+from DamageDistribution import dice_pmf, pmf_mean
 import logging
+import random
 
 
 class Weapon:
 
+  __slots__ = ('name', 'finesse', 'versatile', 'magic_bonus', 'tmp_damage_dice_list', 'damage_dice_list', 'magical')
+
   def __init__(self, name, finesse, versatile, magic_bonus, damage_die, baseline_magic=False):
     self.name = name
     self.finesse = finesse
@@ -59,7 +62,7 @@ class Weapon:
           damage_die.append(die)
       try:
         versatile_damage_die_choices.sort(key=lambda x: x.dice_size)
-        logging.info('Versatile damage options: {}'.format(versatile_damage_die_choices))
+        logging.debug('Versatile damage options: %s', versatile_damage_die_choices)
         if two_handed:
           # if wearing a shield pick the lower damage die
           damage_die.append(versatile_damage_die_choices[-1])
@@ -75,22 +78,18 @@ class Weapon:
     return damage_die
 
   def get_average_damage(self, two_handed=False):
-    """returns the average damage that the weapon deals."""
-    damage = 0
+    """returns the exact average damage that the weapon deals on a hit, dice plus magic bonus."""
     damage_die = self.get_appropriate_damage_die(two_handed)
+    return pmf_mean(dice_pmf(tuple(die.dice_size for die in damage_die))) + self.magic_bonus
 
-    for die in damage_die:
-      damage = damage + (die.dice_size / 2)
-    return damage + self.magic_bonus
-
-  def get_melee_damage(self, two_handed=False):
+  def get_melee_damage(self, two_handed=False, rng=random):
     """give the damage of the weapon (all rolls plus magic damage) and flavor text as a tuple."""
     damage = 0
     damage_die = self.get_appropriate_damage_die(two_handed)
 
     flavor_text = 'It rolls '
     for die in damage_die:
-      dice_roll = randint(1, die.dice_size)
+      dice_roll = rng.randint(1, die.dice_size)
       flavor_text = flavor_text + str(dice_roll) + ' on the ' + str(die.dice_size) + ', and '
       damage = damage + dice_roll
 
@@ -102,24 +101,18 @@ class Weapon:
 
 class RangedWeapon(Weapon):
 
+  __slots__ = ('range_short', 'range_long')
+
   def __init__(self, name, magic_bonus, damage_die, range_short, range_long,  baseline_magic=False):
-    self.name = name
-    self.range = range
-    self.magic_bonus = magic_bonus
+    super().__init__(name, False, False, magic_bonus, damage_die, baseline_magic)
     self.range_short = range_short
     self.range_long = range_long
 
-    self.tmp_damage_dice_list = []
-    self.damage_dice_list = []
-    for die in damage_die:
-      self.tmp_damage_dice_list.append(die)
-    for die in self.tmp_damage_dice_list:
-      dice_size, damage_type = die
-      self.damage_dice_list.append(DamageDie(dice_size, damage_type))
-
 
 class Armor:
 
+  __slots__ = ('name', 'ac', 'light')
+
   def __init__(self, name, ac_level, light=False):
     self.name = name
     self.ac = ac_level
@@ -128,6 +121,8 @@ class Armor:
 
 class Shield:
 
+  __slots__ = ('name', 'magic_bonus')
+
   def __init__(self, name, magic_bonus):
     self.name = name
     self.magic_bonus = magic_bonus
@@ -135,6 +130,8 @@ class Shield:
 
 class MonsterWeapon:
 
+  __slots__ = ('name', 'to_hit_bonus', 'damage_bonus', 'damage', 'magical')
+
   def __init__(self, name, to_hit_bonus, damage_bonus, damage_die, baseline_magic=False):
     self.name = name
     self.to_hit_bonus = to_hit_bonus
@@ -0,0 +1,318 @@
+"""Runs many combats over a pool of worker processes and merges their scores.
+
+The requested number of combats is split into one chunk per worker. Every chunk gets its own stream of Dice,
+seeded from the run seed and the chunk number, so the workers never share random state and a run is reproducible
+bit for bit for the same (seed, number of combats, number of workers).
+
+Use it like so:
+  summary = run_parallel([player_team, monster_team], 1000000, seed=42, workers=32)
+
+With danger=True every chunk also measures its combats with a DangerRating/DangerAggregator, and summary.danger holds
+the merged statistics of all of them.
+
+Instead of a fixed number of combats run_until_precise keeps running batches until the confidence interval of a win
+(or loss) rate is as narrow as asked for:
+  summary = run_until_precise([player_team, monster_team], 0.01, team=0, outcome='loss')
+"""
+
+from CombatEngine import run_combat
+from CombatEvents import NULL_SINK
+from DangerRating import DangerAggregator
+from Dice import make_dice
+from GameConstructs import CombatState
+from ResultRecords import ResultWriter
+from SimulationStatistics import wilson_interval
+from StatusEffects import effect_engine
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import hashlib
+import logging
+import os
+
+
+class SimulationSummary:
+  """The merged tallies of a number of combats between the same teams."""
+
+  def __init__(self, num_teams):
+    """Starts an empty summary.
+
+    Args:
+        num_teams (int): The number of teams fighting, wins are counted per team in the same order.
+    """
+    self.wins = [0] * num_teams
+    self.fights = 0
+    self.total_rounds = 0
+    self.max_rounds = 0
+    # the DangerRating/DangerAggregator of the combats, if they were measured
+    self.danger = None
+
+  def __repr__(self):
+    return 'SimulationSummary(wins={}, fights={}, total_rounds={}, max_rounds={})'.format(self.wins,
+                                                                                          self.fights,
+                                                                                          self.total_rounds,
+                                                                                          self.max_rounds)
+
+  def as_dict(self):
+    """Returns the tallies as a dictionary that can be written as JSON."""
+    return {'wins': list(self.wins),
+            'fights': self.fights,
+            'total_rounds': self.total_rounds,
+            'max_rounds': self.max_rounds}
+
+  @classmethod
+  def from_dict(cls, tallies):
+    """Returns a summary with the tallies of a dictionary from as_dict."""
+    summary = cls(len(tallies['wins']))
+    summary.wins = list(tallies['wins'])
+    summary.fights = tallies['fights']
+    summary.total_rounds = tallies['total_rounds']
+    summary.max_rounds = tallies['max_rounds']
+    return summary
+
+  def add_result(self, result):
+    """Counts a single combat.
+
+    Args:
+        result (CombatEngine/FightResult): The outcome of the combat.
+    """
+    if result.winner >= 0:
+      self.wins[result.winner] += 1
+    self.fights += 1
+    self.total_rounds += result.rounds
+    if result.rounds > self.max_rounds:
+      self.max_rounds = result.rounds
+
+  def merge(self, other):
+    """Adds the tallies of another summary of the same teams to this one.
+
+    Args:
+        other (SimulationSummary): The summary to add.
+
+    Returns:
+        SimulationSummary: This summary, to allow chaining.
+    """
+    self.wins = [own + theirs for own, theirs in zip(self.wins, other.wins)]
+    self.fights += other.fights
+    self.total_rounds += other.total_rounds
+    self.max_rounds = max(self.max_rounds, other.max_rounds)
+    if other.danger is not None:
+      # a copy, merging into the aggregator of the other summary would change it too
+      self.danger = copy.deepcopy(other.danger) if self.danger is None else self.danger.merge(other.danger)
+    return self
+
+  def outcome_count(self, team, outcome='win'):
+    """Returns the number of combats a team won or lost.
+
+    Args:
+        team (int): The index of the team.
+        outcome (str, optional): 'win' to count the combats the team won, 'loss' to count the ones it did not win. The
+          losses of the player team are total party kills (TPK).
+
+    Returns:
+        int: The number of combats with that outcome.
+    """
+    if outcome == 'win':
+      return self.wins[team]
+    if outcome == 'loss':
+      return self.fights - self.wins[team]
+    raise ValueError('outcome must be "win" or "loss", got {}'.format(outcome))
+
+  def interval(self, team, outcome='win', confidence=0.95):
+    """Returns the Wilson confidence interval of the rate of a teams wins or losses.
+
+    Args:
+        team (int): The index of the team.
+        outcome (str, optional): 'win' or 'loss', see outcome_count.
+        confidence (float, optional): The confidence level of the interval.
+
+    Returns:
+        tuple of float: The (low, high) bounds of the rate.
+    """
+    return wilson_interval(self.outcome_count(team, outcome), self.fights, confidence)
+
+  def average_rounds(self):
+    """Returns the mean number of rounds per combat, 0 if no combats were run."""
+    if not self.fights:
+      return 0.0
+    return self.total_rounds / self.fights
+
+
+def derive_seed(seed, chunk_index):
+  """Derives the seed of a chunk from the seed of the run.
+
+  Hashing keeps the streams of neighbouring chunks (and neighbouring run seeds) unrelated.
+
+  Args:
+      seed (int): The seed of the whole run.
+      chunk_index (int): The number of the chunk.
+
+  Returns:
+      int: A 64 bit seed for the chunk.
+  """
+  digest = hashlib.sha256('{}:{}'.format(seed, chunk_index).encode('ascii')).digest()
+  return int.from_bytes(digest[:8], 'little')
+
+
+def split_fights(num_fights, num_chunks):
+  """Splits a number of combats into num_chunks nearly equal chunks, the first chunks get the remainder.
+
+  Args:
+      num_fights (int): The total number of combats.
+      num_chunks (int): The number of chunks to split them into.
+
+  Returns:
+      list of int: The number of combats per chunk.
+  """
+  base, remainder = divmod(num_fights, num_chunks)
+  return [base + 1 if index < remainder else base for index in range(num_chunks)]
+
+
+def run_chunk(teams, num_fights, seed, dice='random', records=None, danger=False):
+  """Fights num_fights quiet combats between the teams with its own random stream.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams, in a worker these are the worker's own copy. Every combat starts
+        from the state the creatures are in when the chunk starts, and they are left in that state afterwards.
+      num_fights (int): The number of combats to fight.
+      seed (int): The seed of this chunk's random stream.
+      dice (str, optional): The Dice backend of the stream, 'random' or 'numpy'.
+      records (str, optional): A directory to stream the record of every combat to, see ResultRecords.
+      danger (bool, optional): Measure every combat with a DangerRating/DangerAggregator, kept in summary.danger.
+
+  Returns:
+      SimulationSummary: The tallies of the chunk.
+  """
+  rng = make_dice(dice, seed)
+  summary = SimulationSummary(len(teams))
+  sink = NULL_SINK
+  if danger:
+    sink = summary.danger = DangerAggregator(teams)
+  # run_combat scores the winner, the callers add up the summaries instead so the scores are put back afterwards
+  scores = [team.score for team in teams]
+  state = CombatState(teams)
+  effects = effect_engine(teams)
+  writer = ResultWriter(records, state) if records else None
+  try:
+    for _ in range(num_fights):
+      state.reset()
+      result = run_combat(teams, rng, sink, state, effects=effects)
+      summary.add_result(result)
+      if writer:
+        writer.add(result, state)
+  finally:
+    if writer:
+      writer.close()
+  state.reset()
+  for team, score in zip(teams, scores):
+    team.score = score
+  return summary
+
+
+def run_parallel(teams, num_fights, seed=0, workers=None, dice='random', records=None, first_chunk=0, danger=False):
+  """Fights num_fights combats between the teams spread over a pool of processes.
+
+  The wins are added to the Team.score of the given teams, like the serial loop does.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat, every combat starts from the state
+        the creatures are in now.
+      num_fights (int): The total number of combats.
+      seed (int, optional): The seed of the run.
+      workers (int, optional): The number of processes, defaults to the number of cores. With a single worker the
+        chunk runs in this process.
+      dice (str, optional): The Dice backend of every chunk, 'random' or 'numpy'.
+      records (str, optional): A directory to stream the record of every combat to, every chunk writes its own
+        part-NNNN directory in it, see ResultRecords.
+      first_chunk (int, optional): The number of the first chunk, the chunks are seeded from the run seed and their
+        number. Adding more combats to an earlier run of the same seed starts after its last chunk.
+      danger (bool, optional): Measure every combat with a DangerRating/DangerAggregator, the merged statistics of all
+        the workers are kept in summary.danger.
+
+  Returns:
+      SimulationSummary: The merged tallies of all the workers.
+  """
+  if workers is None:
+    workers = os.cpu_count() or 1
+  workers = max(1, min(workers, num_fights)) if num_fights > 0 else 1
+
+  chunks = split_fights(num_fights, workers)
+  seeds = [derive_seed(seed, first_chunk + index) for index in range(workers)]
+  parts = [os.path.join(records, 'part-{:04d}'.format(first_chunk + index)) if records else None
+           for index in range(workers)]
+
+  if workers == 1:
+    summaries = [run_chunk(teams, chunks[0], seeds[0], dice, parts[0], danger)]
+  else:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      summaries = list(executor.map(run_chunk, [teams] * workers, chunks, seeds, [dice] * workers, parts,
+                                    [danger] * workers))
+
+  # merge in chunk order so the result does not depend on which worker finished first
+  summary = SimulationSummary(len(teams))
+  for chunk_summary in summaries:
+    summary.merge(chunk_summary)
+  logging.info('Ran {} combats over {} workers: {}'.format(num_fights, workers, summary))
+
+  for team, team_wins in zip(teams, summary.wins):
+    team.score += team_wins
+  return summary
+
+
+def run_until_precise(teams, half_width, confidence=0.95, team=0, outcome='win', batch_size=200, max_fights=1000000,
+                      seed=0, workers=1, dice='random'):
+  """Runs batches of combats until the confidence interval of a teams win or loss rate is narrow enough.
+
+  After every round of batches (one batch per worker) the Wilson interval of the rate is checked and the run stops as
+  soon as it is within +/- half_width. Lopsided encounters stop after a few hundred combats, close ones get as many as
+  they need, up to max_fights. Every batch is seeded from the run seed and its number, so a run is reproducible for the
+  same seed, batch size and number of workers.
+
+  The wins are added to the Team.score of the given teams, like the serial loop does.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat.
+      half_width (float): The wanted precision, e.g. 0.01 for a +/- 1% interval.
+      confidence (float, optional): The confidence level of the interval.
+      team (int, optional): The index of the team whose rate is measured.
+      outcome (str, optional): 'win' measures the rate the team wins, 'loss' the rate it does not (for the player
+        team that is the chance of a total party kill).
+      batch_size (int, optional): The number of combats per batch.
+      max_fights (int, optional): Stop after this many combats even if the interval is still too wide.
+      seed (int, optional): The seed of the run.
+      workers (int, optional): The number of processes running batches side by side.
+      dice (str, optional): The Dice backend of every batch, 'random' or 'numpy'.
+
+  Returns:
+      SimulationSummary: The merged tallies, summary.fights tells how many combats were needed.
+  """
+  workers = max(1, workers)
+  summary = SimulationSummary(len(teams))
+  executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+  batch_index = 0
+  try:
+    while summary.fights < max_fights:
+      remaining = max_fights - summary.fights
+      chunks = [min(batch_size, remaining - index * batch_size) for index in range(workers)
+                if remaining > index * batch_size]
+      seeds = [derive_seed(seed, batch_index + index) for index in range(len(chunks))]
+      batch_index += len(chunks)
+
+      if executor:
+        batch_summaries = list(executor.map(run_chunk, [teams] * len(chunks), chunks, seeds, [dice] * len(chunks)))
+      else:
+        batch_summaries = [run_chunk(teams, size, chunk_seed, dice) for size, chunk_seed in zip(chunks, seeds)]
+      for batch_summary in batch_summaries:
+        summary.merge(batch_summary)
+
+      low, high = summary.interval(team, outcome, confidence)
+      logging.info('After {} combats the {} rate of {} is between {:.4f} and {:.4f}'.format(
+        summary.fights, outcome, teams[team].name, low, high))
+      if (high - low) / 2 <= half_width:
+        break
+  finally:
+    if executor:
+      executor.shutdown()
+
+  for scored_team, team_wins in zip(teams, summary.wins):
+    scored_team.score += team_wins
+  return summary
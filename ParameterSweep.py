@@ -0,0 +1,285 @@
+"""Sweeps creature parameters over a grid and estimates how the win rate changes across it.
+
+A sweep starts from an encounter (see EncounterConstructs) and a list of parameters, each a creature field and the
+values to try, e.g. the max_hp, ac and count of the Hill Giants. A parameter applies to every creature template with
+its name, or to every member of a team with its name, so 'Players:level' changes the level of the whole party.
+
+Every point of the grid is compiled into its own EncounterTemplate and fought as one cell. The cells run side by side
+on a single pool of warm worker processes instead of starting a new pool per cell. A worker keeps the creatures of the
+last few encounters it fought (see run_cell), for the services that send it the same encounter again.
+
+Given a ResultCache, cells are looked up first and only the combats that are not cached yet are fought, so running a
+sweep again (or a larger sweep around the same grid) skips the cells that are already computed. A cell of n combats
+fights the same combats as ResultCache.run_cached with a single worker.
+
+Use it like so:
+  encounter = load_encounter('encounters/hill_giants.json')
+  parameters = [parse_parameter('Hill Giant:max_hp=70:140:10'), parse_parameter('Hill Giant:ac=13:17'),
+                parse_parameter('Hill Giant:count=2:5')]
+  cells = run_sweep(encounter, parameters, 2000, cache=ResultCache('.combat_cache'))
+  print(format_table(cells, parameters))
+
+or from the command line:
+  python ParameterSweep.py encounters/hill_giants.json -p 'Hill Giant:max_hp=70:140:10' -p 'Hill Giant:ac=13:17' \\
+    -p 'Hill Giant:count=2:5' -n 2000 --csv hill_giants_sweep.csv
+"""
+
+from Dice import BACKENDS
+from EncounterConstructs import EncounterTemplate, canonical_json, load_encounter
+from ParallelRunner import SimulationSummary, derive_seed, run_chunk
+from ResultCache import ResultCache, encounter_key
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import argparse
+import csv
+import json
+import logging
+import os
+
+
+class SweepParameter:
+  """A creature field and the values a sweep tries for it."""
+
+  def __init__(self, target, field, values):
+    """Stores the parameter.
+
+    Args:
+        target (str): The name of the creature templates to change, or of a team to change all of its members.
+        field (str): The field of the creature spec, e.g. 'max_hp', 'ac', 'count' or 'level'.
+        values (list): The values to try, in order.
+    """
+    if not values:
+      raise ValueError('The parameter {}:{} has no values'.format(target, field))
+    self.target = target
+    self.field = field
+    self.values = list(values)
+
+  def __repr__(self):
+    return 'SweepParameter({}:{}={})'.format(self.target, self.field, self.values)
+
+  @property
+  def label(self):
+    """The name of the parameter in tables and files, e.g. 'Hill Giant:max_hp'."""
+    return '{}:{}'.format(self.target, self.field)
+
+
+def parse_values(text):
+  """Parses the values of a parameter: 'start:stop' or 'start:stop:step' (stop included), or a list like '13,15,17'."""
+  if ':' in text:
+    bounds = [int(bound) for bound in text.split(':')]
+    if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] <= 0):
+      raise ValueError('A range of values is start:stop or start:stop:step with a positive step, got {}'.format(text))
+    step = bounds[2] if len(bounds) == 3 else 1
+    return list(range(bounds[0], bounds[1] + 1, step))
+  return [int(value) for value in text.split(',')]
+
+
+def parse_parameter(text):
+  """Parses a parameter of the form 'target:field=values', e.g. 'Hill Giant:ac=13:17', see parse_values."""
+  name, separator, values = text.partition('=')
+  target, _, field = name.rpartition(':')
+  if not separator or not target or not field:
+    raise ValueError('A parameter is target:field=values, e.g. "Hill Giant:ac=13:17", got {}'.format(text))
+  return SweepParameter(target, field, parse_values(values))
+
+
+def apply_parameters(template, parameters, values):
+  """Compiles a point of the grid.
+
+  Args:
+      template (EncounterConstructs/EncounterTemplate): The encounter the sweep starts from.
+      parameters (list of SweepParameter): The parameters of the sweep.
+      values (tuple): The value of every parameter at this point, in the same order.
+
+  Returns:
+      EncounterConstructs/EncounterTemplate: The encounter with the values applied, on the same terrain.
+  """
+  teams = [(team_name, list(members)) for team_name, members in template.teams]
+  for parameter, value in zip(parameters, values):
+    matched = False
+    for team_name, members in teams:
+      for index, member in enumerate(members):
+        if parameter.target in (member.name, team_name):
+          members[index] = member.with_changes(**{parameter.field: value})
+          matched = True
+    if not matched:
+      raise ValueError('No creature or team called {} in {}'.format(parameter.target, template))
+  return EncounterTemplate(template.name, teams, terrain=template.terrain)
+
+
+class SweepCell:
+  """A point of the grid and the tallies of its combats."""
+
+  def __init__(self, values, template, summary, computed):
+    """Stores the cell.
+
+    Args:
+        values (tuple): The value of every parameter of the sweep.
+        template (EncounterConstructs/EncounterTemplate): The encounter of the cell.
+        summary (ParallelRunner/SimulationSummary): The tallies of its combats.
+        computed (int): The number of combats fought for this sweep, the others came from the cache.
+    """
+    self.values = values
+    self.template = template
+    self.summary = summary
+    self.computed = computed
+
+  def __repr__(self):
+    low, high = self.interval()
+    return 'SweepCell({}: player win {:.2%} ({:.2%} to {:.2%}) over {} combats)'.format(
+      self.values, self.player_win_rate(), low, high, self.summary.fights)
+
+  def player_win_rate(self):
+    """Returns the rate the players (the first team) won."""
+    return self.summary.wins[0] / self.summary.fights if self.summary.fights else 0.0
+
+  def interval(self, confidence=0.95):
+    """Returns the Wilson interval of the player win rate."""
+    return self.summary.interval(0, 'win', confidence)
+
+
+# the teams a worker built most recently, keyed by the spec of their encounter. A long running worker (a
+# SimulationService pool, a BatchManifest of hundreds of encounters) sees many encounters, only the last few are kept.
+_warm_teams = OrderedDict()
+WARM_TEAMS = 8
+
+
+def run_cell(spec_json, num_fights, seed, dice='random'):
+  """Fights the combats of a cell in a worker, reusing the teams if the worker fought the encounter recently.
+
+  Args:
+      spec_json (str): The canonical JSON of the EncounterConstructs/EncounterTemplate spec of the cell.
+      num_fights (int): The number of combats.
+      seed (int): The seed of the chunk.
+      dice (str, optional): The Dice backend.
+
+  Returns:
+      ParallelRunner/SimulationSummary: The tallies of the combats.
+  """
+  teams = _warm_teams.get(spec_json)
+  if teams is None:
+    teams = _warm_teams[spec_json] = EncounterTemplate.from_spec(json.loads(spec_json)).build()
+    if len(_warm_teams) > WARM_TEAMS:
+      _warm_teams.popitem(last=False)
+  else:
+    _warm_teams.move_to_end(spec_json)
+  return run_chunk(teams, num_fights, seed, dice)
+
+
+def run_sweep(template, parameters, num_fights, cache=None, seed=0, workers=None, dice='random'):
+  """Fights num_fights combats for every point of the grid of parameter values.
+
+  Args:
+      template (EncounterConstructs/EncounterTemplate): The encounter the sweep starts from, the players first.
+      parameters (list of SweepParameter): The parameters of the sweep.
+      num_fights (int): The number of combats per cell.
+      cache (ResultCache/ResultCache, optional): Where to look up cells before fighting them and to store them after.
+      seed (int, optional): The seed of every cell, cells are told apart by their creatures.
+      workers (int, optional): The number of processes, defaults to the number of cores. With a single worker the
+        cells run in this process.
+      dice (str, optional): The Dice backend.
+
+  Returns:
+      list of SweepCell: The cells, in the order of the grid (the last parameter changes fastest).
+  """
+  if workers is None:
+    workers = os.cpu_count() or 1
+  cells = []
+  pending = []
+  for values in product(*(parameter.values for parameter in parameters)):
+    cell_template = apply_parameters(template, parameters, values)
+    teams = cell_template.build()
+    key = encounter_key(teams, seed, dice)
+    cached = cache.get(key) if cache else None
+    summary, chunks = cached if cached else (SimulationSummary(len(teams)), 0)
+    cell = SweepCell(values, cell_template, summary, 0)
+    cells.append(cell)
+    if summary.fights < num_fights:
+      cell.computed = num_fights - summary.fights
+      pending.append((cell, key, chunks))
+  logging.info('Sweeping {} cells, {} need combats'.format(len(cells), len(pending)))
+
+  specs = [canonical_json(cell.template.to_spec()) for cell, _, _ in pending]
+  sizes = [cell.computed for cell, _, _ in pending]
+  seeds = [derive_seed(seed, chunks) for _, _, chunks in pending]
+  if workers == 1 or len(pending) < 2:
+    summaries = map(run_cell, specs, sizes, seeds, [dice] * len(pending))
+    executor = None
+  else:
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(pending)))
+    summaries = executor.map(run_cell, specs, sizes, seeds, [dice] * len(pending))
+  try:
+    for (cell, key, chunks), summary in zip(pending, summaries):
+      cell.summary.merge(summary)
+      if cache:
+        cache.put(key, cell.summary, chunks + 1)
+  finally:
+    if executor:
+      executor.shutdown()
+  return cells
+
+
+def format_table(cells, parameters, confidence=0.95):
+  """Renders the cells as a text table, one row per cell."""
+  labels = [parameter.label for parameter in parameters]
+  widths = [max(len(label), 6) for label in labels]
+  lines = ['  '.join(label.rjust(width) for label, width in zip(labels, widths)) +
+           '  {:>9}  {:>17}  {:>8}'.format('win rate', 'interval', 'combats')]
+  for cell in cells:
+    low, high = cell.interval(confidence)
+    lines.append('  '.join(str(value).rjust(width) for value, width in zip(cell.values, widths)) +
+                 '  {:>9.2%}  {:>7.2%} - {:>7.2%}  {:>8}'.format(cell.player_win_rate(), low, high,
+                                                                 cell.summary.fights))
+  return '\n'.join(lines)
+
+
+def write_csv(cells, parameters, path, confidence=0.95):
+  """Writes the cells to a CSV file in long form, one row per cell, ready for a heatmap of any two parameters."""
+  with open(path, 'w', newline='') as csv_file:
+    writer = csv.writer(csv_file)
+    writer.writerow([parameter.label for parameter in parameters] +
+                    ['combats', 'player_wins', 'player_win_rate', 'low', 'high', 'average_rounds'])
+    for cell in cells:
+      low, high = cell.interval(confidence)
+      writer.writerow(list(cell.values) + [cell.summary.fights, cell.summary.wins[0],
+                                           '{:.6f}'.format(cell.player_win_rate()), '{:.6f}'.format(low),
+                                           '{:.6f}'.format(high), '{:.4f}'.format(cell.summary.average_rounds())])
+
+
+def parse_arguments(argv=None):
+  """Parses the command line options of the sweep."""
+  parser = argparse.ArgumentParser(description='Estimate the player win rate of an encounter file over a grid of '
+                                               'creature parameters.')
+  parser.add_argument('encounter', help='The encounter file, e.g. encounters/hill_giants.json.')
+  parser.add_argument('-p', '--parameter', action='append', required=True, metavar='TARGET:FIELD=VALUES',
+                      help='A creature or team name, a field and its values as start:stop[:step] or a list, e.g. '
+                           '"Hill Giant:max_hp=70:140:10" or "Players:level=5,9,13". Repeat for every parameter.')
+  parser.add_argument('-n', '--attempts', type=int, default=1000, help='The number of combats per cell.')
+  parser.add_argument('--seed', type=int, default=0, help='The seed of every cell.')
+  parser.add_argument('--dice', choices=sorted(BACKENDS), default='random', help='The Dice backend.')
+  parser.add_argument('--workers', type=int, default=None, help='The number of processes, defaults to the number '
+                                                                'of cores.')
+  parser.add_argument('--cache', default='.combat_cache', metavar='DIRECTORY',
+                      help='The ResultCache the cells are looked up in and stored to, so a rerun skips them.')
+  parser.add_argument('--no-cache', action='store_true', help='Fight every cell, without the cache.')
+  parser.add_argument('--confidence', type=float, default=0.95, help='The confidence level of the intervals.')
+  parser.add_argument('--csv', default=None, metavar='FILE', help='Also write the cells to a CSV file.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  options = parse_arguments(argv)
+  parameters = [parse_parameter(text) for text in options.parameter]
+  cache = None if options.no_cache else ResultCache(options.cache)
+  cells = run_sweep(load_encounter(options.encounter), parameters, options.attempts, cache, options.seed,
+                    options.workers, options.dice)
+  print(format_table(cells, parameters, options.confidence))
+  print('{} cells, {} combats fought, {} from the cache'.format(
+    len(cells), sum(cell.computed for cell in cells), sum(cell.summary.fights - cell.computed for cell in cells)))
+  if options.csv:
+    write_csv(cells, parameters, options.csv, options.confidence)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,172 @@
+"""Keeps the tallies of simulation runs on disk, so the same encounter is never simulated twice.
+
+A cache entry is keyed by a hash of everything that decides the outcome of the combats:
+  * the definition of every combatant in team order (hit points, ability scores, AC, number of attacks, the compiled
+    attack of every weapon and the resistances and immunities), but not their names,
+  * CombatEngine.ENGINE_VERSION,
+  * the seed family of the run: its seed and its Dice backend.
+
+It holds the merged ParallelRunner/SimulationSummary of every combat fought for that key so far and the number of
+chunks they were fought in. Asking for as many combats as are cached, or fewer, returns the cached tallies at once.
+Asking for more only fights the missing combats, in new chunks seeded after the cached ones, and merges them in.
+
+Every entry is a small JSON file in the cache directory. Reading an entry marks it as used, and when the directory
+grows past max_bytes the least recently used entries are deleted.
+
+Use it like so:
+  cache = ResultCache('.combat_cache')
+  summary = run_cached([player_team, monster_team], 100000, cache, seed=42, workers=8)
+"""
+
+from CombatEngine import ENGINE_VERSION
+from EncounterConstructs import canonical_json
+from ItemConstructs import RangedWeapon
+from ParallelRunner import SimulationSummary, run_parallel
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+def describe_creature(creature):
+  """Returns everything about a creature that affects the outcome of a combat, as a dict that can be written as JSON."""
+  description = {'type': type(creature).__name__,
+                 'hp': creature.current_hp,
+                 'max_hp': creature.hp,
+                 'abilities': [creature.strength, creature.dexterity, creature.constitution, creature.intelligence,
+                               creature.wisdom, creature.charisma],
+                 'ac': creature.ac,
+                 'num_attacks': creature.num_attacks,
+                 'attacks': [list(profile) for profile in creature.get_attack_profiles()],
+                 'resistances': sorted(creature.resistances),
+                 'immunities': sorted(creature.immunities)}
+  ranged = [weapon for weapon in creature.weapons if isinstance(weapon, RangedWeapon)]
+  if ranged:
+    # ranged weapons are only used on a BattleMap/BattleMap, the melee attacks above leave them out
+    description['ranged'] = [[weapon.range_short, weapon.range_long] + list(creature.get_weapon_attack_profile(weapon))
+                             for weapon in ranged]
+  if creature.spells:
+    description['spells'] = [spell.to_spec() for spell in creature.spells]
+  return description
+
+
+def encounter_key(teams, seed, dice='random'):
+  """Returns the cache key of a run of an encounter.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams, in the state every combat starts from.
+      seed (int): The seed of the run.
+      dice (str, optional): The Dice backend of the run.
+
+  Returns:
+      str: A hex digest that is the same for the same combatants, engine version and seed family.
+  """
+  description = {'teams': [[describe_creature(creature) for creature in team.team_members] for team in teams],
+                 'engine_version': ENGINE_VERSION,
+                 'seed': seed,
+                 'dice': dice}
+  return hashlib.sha256(canonical_json(description).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+  """A directory of cached run tallies with a size cap."""
+
+  def __init__(self, directory, max_bytes=16 * 1024 * 1024):
+    """Opens the cache, creating the directory if needed.
+
+    Args:
+        directory (str): Where the entries are kept.
+        max_bytes (int, optional): The most bytes the entries may take up before the least recently used are deleted.
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, key):
+    """Returns the path of the file of an entry."""
+    return os.path.join(self.directory, key + '.json')
+
+  def get(self, key):
+    """Returns an entry and marks it as the most recently used, None if there is none.
+
+    Returns:
+        tuple: The ParallelRunner/SimulationSummary of the entry and the number of chunks it was fought in.
+    """
+    path = self.path(key)
+    try:
+      with open(path) as entry_file:
+        entry = json.load(entry_file)
+    except (OSError, ValueError):
+      return None
+    os.utime(path)
+    return SimulationSummary.from_dict(entry['summary']), entry['chunks']
+
+  def put(self, key, summary, chunks):
+    """Stores an entry, replacing the previous one for the key, then evicts entries if the cache is too big.
+
+    Args:
+        key (str): The key from encounter_key.
+        summary (ParallelRunner/SimulationSummary): All the combats fought for the key.
+        chunks (int): The number of chunks they were fought in.
+    """
+    path = self.path(key)
+    # write a new file and move it over the old one, so a reader never sees half an entry
+    with open(path + '.tmp', 'w') as entry_file:
+      json.dump({'summary': summary.as_dict(), 'chunks': chunks, 'saved': time.time()}, entry_file)
+    os.replace(path + '.tmp', path)
+    self.evict()
+
+  def evict(self):
+    """Deletes the least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.endswith('.json'):
+        stat = os.stat(os.path.join(self.directory, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      os.remove(os.path.join(self.directory, name))
+      total -= size
+      logging.info('Evicted {} from the result cache'.format(name))
+
+
+def run_cached(teams, num_fights, cache, seed=0, workers=None, dice='random'):
+  """Returns the tallies of at least num_fights combats, only fighting the ones that are not in the cache yet.
+
+  The wins are added to the Team.score of the given teams, like the serial loop does.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat, every combat starts from the state
+        the creatures are in now.
+      num_fights (int): The number of combats wanted. If more are cached all of them are returned.
+      cache (ResultCache): The cache.
+      seed (int, optional): The seed of the run.
+      workers (int, optional): The number of processes fighting the missing combats, see run_parallel.
+      dice (str, optional): The Dice backend of the run.
+
+  Returns:
+      ParallelRunner/SimulationSummary: The tallies of the cached and the new combats.
+  """
+  key = encounter_key(teams, seed, dice)
+  cached = cache.get(key)
+  summary, chunks = cached if cached else (SimulationSummary(len(teams)), 0)
+  if summary.fights >= num_fights:
+    logging.info('Found {} combats in the result cache'.format(summary.fights))
+    for team, team_wins in zip(teams, summary.wins):
+      team.score += team_wins
+    return summary
+
+  missing = num_fights - summary.fights
+  if workers is None:
+    workers = os.cpu_count() or 1
+  workers = max(1, min(workers, missing))
+  logging.info('Found {} combats in the result cache, fighting {} more'.format(summary.fights, missing))
+  # run_parallel scores the new combats, the cached ones are scored here
+  for team, team_wins in zip(teams, summary.wins):
+    team.score += team_wins
+  summary.merge(run_parallel(teams, missing, seed, workers, dice, first_chunk=chunks))
+  cache.put(key, summary, chunks + workers)
+  return summary
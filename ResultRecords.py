@@ -0,0 +1,158 @@
+"""Streams a record of every combat to columnar files on disk, with a fixed amount of memory.
+
+Team.score only keeps the wins. A ResultWriter keeps a record of every combat instead:
+  winner (N,): the index of the winning team, -1 if nobody was left standing.
+  rounds (N,): the number of rounds fought.
+  pcs_downed (N,): the number of player characters (the first team) that dropped to 0 hit points during the combat.
+  surviving_hp (N, C): the hit points of every combatant at the end, 0 or below for the ones that are down.
+  damage_dealt (N, C): the damage every combatant dealt.
+where N is the number of combats and C the number of combatants, numbered team by team as in GameConstructs/CombatState.
+
+Every column is a NumPy .npy file of 32 bit integers. The records are collected in small in-memory buffers that are
+appended to the files whenever they hold buffer_size combats, and the headers of the files are written with the final
+number of rows when the writer is closed. Writing does not need NumPy. Reading does, and maps the files into memory
+instead of loading them, so runs of any size can be analysed out of core:
+
+  with ResultWriter('runs/hill_giants', state) as writer:
+    for i in range(combat_attempts):
+      state.reset()
+      writer.add(run_combat(teams, rng, state=state), state)
+
+  records = read_records('runs/hill_giants')
+  print(records['rounds'].mean(), (records['pcs_downed'] > 0).mean())
+
+A schema.json next to the columns holds the number of combats and the names and teams of the combatants.
+"""
+
+from array import array
+import json
+import os
+import sys
+
+
+SCALAR_COLUMNS = ('winner', 'rounds', 'pcs_downed')
+COMBATANT_COLUMNS = ('surviving_hp', 'damage_dealt')
+# 32 bit signed integers in the byte order of this machine, which is what array('i') holds
+NPY_DESCR = ('<' if sys.byteorder == 'little' else '>') + 'i4'
+# room for the header to be rewritten with any number of rows without moving the data
+NPY_HEADER_SIZE = 128
+
+
+def npy_header(shape):
+  """Returns the .npy (version 1.0) header of a C ordered array of 32 bit integers, padded to NPY_HEADER_SIZE bytes."""
+  description = "{{'descr': '{}', 'fortran_order': False, 'shape': {!r}, }}".format(NPY_DESCR, tuple(shape))
+  padding = NPY_HEADER_SIZE - 10 - len(description) - 1
+  if padding < 0:
+    raise ValueError('The shape {} does not fit in the .npy header'.format(shape))
+  return b'\x93NUMPY\x01\x00' + (NPY_HEADER_SIZE - 10).to_bytes(2, 'little') + \
+         (description + ' ' * padding + '\n').encode('latin1')
+
+
+class ResultWriter:
+  """Buffers the records of combats and appends them to the column files."""
+
+  def __init__(self, directory, state, buffer_size=65536):
+    """Creates the directory and the empty column files.
+
+    Args:
+        directory (str): Where to write the columns, created if needed. Existing columns are overwritten.
+        state (GameConstructs/CombatState): The state the combats are fought in, for the number and names of the
+          combatants.
+        buffer_size (int, optional): The number of combats held in memory before they are written.
+    """
+    if array('i').itemsize != 4:
+      raise RuntimeError('The records need 32 bit integers, array("i") has {} bytes here'.format(array('i').itemsize))
+    self.directory = directory
+    self.buffer_size = buffer_size
+    self.num_combatants = len(state.combatants)
+    self.num_players = len(state.teams[0].team_members)
+    self.schema = {'combats': 0,
+                   'combatants': [creature.name for creature in state.combatants],
+                   'teams': [team.name for team in state.teams],
+                   'team_of': list(state.team)}
+    self.rows = 0
+    self.buffered = 0
+    self.buffers = {column: array('i') for column in SCALAR_COLUMNS + COMBATANT_COLUMNS}
+    os.makedirs(directory, exist_ok=True)
+    self.files = {}
+    for column in SCALAR_COLUMNS + COMBATANT_COLUMNS:
+      column_file = open(os.path.join(directory, column + '.npy'), 'wb')
+      column_file.write(npy_header(self.shape(column)))
+      self.files[column] = column_file
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def shape(self, column):
+    """Returns the shape of a column with the records written so far."""
+    if column in COMBATANT_COLUMNS:
+      return self.rows, self.num_combatants
+    return self.rows,
+
+  def add(self, result, state):
+    """Records a combat.
+
+    Args:
+        result (CombatEngine/FightResult): The outcome of the combat.
+        state (GameConstructs/CombatState): The state the combat was fought in, before it is reset.
+    """
+    buffers = self.buffers
+    buffers['winner'].append(result.winner)
+    buffers['rounds'].append(result.rounds)
+    buffers['pcs_downed'].append(sum(1 for knockdowns in state.knockdowns[:self.num_players] if knockdowns))
+    buffers['surviving_hp'].fromlist(state.hp.tolist())
+    buffers['damage_dealt'].fromlist(state.damage_dealt.tolist())
+    self.buffered += 1
+    if self.buffered >= self.buffer_size:
+      self.flush()
+
+  def flush(self):
+    """Appends the buffered records to the column files and empties the buffers."""
+    for column, buffer in self.buffers.items():
+      buffer.tofile(self.files[column])
+      del buffer[:]
+    self.rows += self.buffered
+    self.buffered = 0
+
+  def close(self):
+    """Writes the remaining records and the final headers, and closes the files."""
+    if not self.files:
+      return
+    self.flush()
+    for column, column_file in self.files.items():
+      column_file.seek(0)
+      column_file.write(npy_header(self.shape(column)))
+      column_file.close()
+    self.files = {}
+    self.schema['combats'] = self.rows
+    with open(os.path.join(self.directory, 'schema.json'), 'w') as schema_file:
+      json.dump(self.schema, schema_file, indent=2)
+      schema_file.write('\n')
+
+
+def record_directories(directory):
+  """Returns the directories with records under a directory, itself or its parts as written by a parallel run."""
+  if os.path.exists(os.path.join(directory, 'schema.json')):
+    return [directory]
+  return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                if os.path.exists(os.path.join(directory, name, 'schema.json')))
+
+
+def read_records(directory):
+  """Maps the columns written by a ResultWriter into memory, NumPy is needed for this.
+
+  Args:
+      directory (str): The directory of a ResultWriter.
+
+  Returns:
+      dict: The columns as read only numpy.memmap arrays keyed by name, plus the 'schema' dict.
+  """
+  import numpy
+  with open(os.path.join(directory, 'schema.json')) as schema_file:
+    records = {'schema': json.load(schema_file)}
+  for column in SCALAR_COLUMNS + COMBATANT_COLUMNS:
+    records[column] = numpy.load(os.path.join(directory, column + '.npy'), mmap_mode='r')
+  return records
@@ -0,0 +1,340 @@
+"""A long running local service that simulates encounters for other programs, e.g. an encounter design tool.
+
+Starting Python and importing the simulator for every request is slow. The service starts once, keeps a pool of warm
+worker processes (see ParameterSweep.run_cell) and takes jobs over a Unix socket or a local TCP port.
+
+The protocol is one JSON object per line in both directions. A client sends requests:
+  {"op": "run", "encounter": {...}, "fights": 10000, "seed": 0, "dice": "random", "batch_size": 500}
+      Queues a job. "encounter" is an encounter spec as in EncounterConstructs, the other fields are optional.
+  {"op": "cancel", "job": 3}
+      Stops listening to a job, the job itself stops once nobody listens to it any more.
+  {"op": "status"}
+      Returns the number of queued and running jobs.
+and gets back messages, each with the "job" it is about:
+  {"type": "accepted", "job": 3, "coalesced": false}
+  {"type": "progress", "job": 3, "fights": 500, "wins": [301, 199], "player_win_rate": 0.602, "low": ..., "high": ...}
+  {"type": "done", ...the same fields as progress...}
+  {"type": "cancelled", "job": 3}
+  {"type": "error", "job": null, "message": "..."}
+
+Jobs wait in a queue for one of the job runners, one per worker process. A runner fights its job in batches on the
+pool and sends a progress message after every batch, so a client can show a preview after the first batch and stop
+listening when the interval is narrow enough. A batch that is already running when a job is cancelled is finished.
+
+Identical jobs (the same creatures, number of combats, seed and dice) that are queued or running at the same time are
+coalesced into a single job whose messages go to every client that asked for it.
+
+Use it like so:
+  python SimulationService.py --socket /tmp/combat_simulator.sock
+
+and from a client:
+  for message in request('/tmp/combat_simulator.sock', {'op': 'run', 'encounter': spec, 'fights': 5000}):
+    print(message)
+"""
+
+from Dice import BACKENDS
+from EncounterConstructs import EncounterTemplate, canonical_json
+from ParallelRunner import SimulationSummary, derive_seed
+from ParameterSweep import run_cell
+from ResultCache import encounter_key
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+
+
+class Job:
+  """An encounter being simulated for one or more clients."""
+
+  def __init__(self, number, key, spec_json, fights, seed, dice, batch_size):
+    """Creates a job that has not started yet.
+
+    Args:
+        number (int): The number of the job, unique while the service runs.
+        key (str): The coalescing key of the job.
+        spec_json (str): The canonical JSON of the encounter spec.
+        fights (int): The number of combats.
+        seed (int): The seed of the job, batch i is seeded with ParallelRunner.derive_seed(seed, i).
+        dice (str): The Dice backend.
+        batch_size (int): The number of combats between two progress messages.
+    """
+    self.number = number
+    self.key = key
+    self.spec_json = spec_json
+    self.fights = fights
+    self.seed = seed
+    self.dice = dice
+    self.batch_size = batch_size
+    self.summary = None
+    self.subscribers = set()
+    self.cancelled = False
+    self.last_message = None
+
+  def __repr__(self):
+    return 'Job({}, {} combats, {} listening)'.format(self.number, self.fights, len(self.subscribers))
+
+  def publish(self, message):
+    """Sends a message to every client listening to the job and remembers it for clients that join later."""
+    self.last_message = message
+    for queue in self.subscribers:
+      queue.put_nowait(message)
+
+  def progress(self, message_type):
+    """Returns a progress or done message with the tallies so far."""
+    summary = self.summary
+    low, high = summary.interval(0, 'win')
+    return {'type': message_type,
+            'job': self.number,
+            'fights': summary.fights,
+            'of': self.fights,
+            'wins': summary.wins,
+            'player_win_rate': summary.wins[0] / summary.fights if summary.fights else 0.0,
+            'low': low,
+            'high': high,
+            'average_rounds': summary.average_rounds()}
+
+
+class SimulationService:
+  """The job queue, the job runners and the pool of worker processes."""
+
+  def __init__(self, workers=None, batch_size=500, max_fights=10000000):
+    """Sets up the service, nothing runs until start() is called.
+
+    Args:
+        workers (int, optional): The number of worker processes and job runners, defaults to the number of cores.
+        batch_size (int, optional): The default number of combats between two progress messages.
+        max_fights (int, optional): The most combats a single job may ask for.
+    """
+    self.workers = workers or os.cpu_count() or 1
+    self.batch_size = batch_size
+    self.max_fights = max_fights
+    self.numbers = itertools.count(1)
+    self.jobs = {}
+    self.queue = None
+    self.pool = None
+    self.runners = []
+
+  def start(self):
+    """Starts the worker processes and the job runners, in the running event loop."""
+    self.queue = asyncio.Queue()
+    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+    self.runners = [asyncio.create_task(self.run_jobs()) for _ in range(self.workers)]
+
+  async def close(self):
+    """Stops the job runners and the worker processes."""
+    for runner in self.runners:
+      runner.cancel()
+    await asyncio.gather(*self.runners, return_exceptions=True)
+    self.pool.shutdown(cancel_futures=True)
+
+  def submit(self, request):
+    """Queues the job of a run request, or joins the identical job that is already queued or running.
+
+    Args:
+        request (dict): The run request, see the module docstring.
+
+    Returns:
+        tuple: The Job and the asyncio.Queue its messages are sent to.
+    """
+    # everything is checked here, a job that is accepted only fails if the combats themselves do
+    spec = request['encounter']
+    if not isinstance(spec, dict):
+      raise ValueError('encounter must be an object with "name" and "teams", got {}'.format(json.dumps(spec)))
+    try:
+      template = EncounterTemplate.from_spec(spec)
+      teams = template.build()
+    except (AttributeError, TypeError) as error:
+      raise ValueError('Invalid encounter: {}'.format(error))
+    empty = [team.name for team in teams if not team.team_members]
+    if empty:
+      raise ValueError('Every team of an encounter needs members, {} has none'.format(', '.join(empty)))
+    fights = int(request.get('fights', 1000))
+    if not 0 < fights <= self.max_fights:
+      raise ValueError('fights must be between 1 and {}, got {}'.format(self.max_fights, fights))
+    seed = int(request.get('seed', 0))
+    dice = request.get('dice', 'random')
+    if dice not in BACKENDS:
+      raise ValueError('Unknown dice {}, pick from {}'.format(dice, ', '.join(BACKENDS)))
+    batch_size = max(1, int(request.get('batch_size', self.batch_size)))
+    key = '{}:{}:{}'.format(encounter_key(teams, seed, dice), fights, batch_size)
+
+    queue = asyncio.Queue()
+    job = self.jobs.get(key)
+    if job is None:
+      job = Job(next(self.numbers), key, canonical_json(template.to_spec()), fights, seed, dice, batch_size)
+      self.jobs[key] = job
+      job.subscribers.add(queue)
+      queue.put_nowait({'type': 'accepted', 'job': job.number, 'coalesced': False})
+      self.queue.put_nowait(job)
+    else:
+      job.subscribers.add(queue)
+      queue.put_nowait({'type': 'accepted', 'job': job.number, 'coalesced': True})
+      if job.last_message:
+        queue.put_nowait(job.last_message)
+    return job, queue
+
+  def unsubscribe(self, job, queue):
+    """Stops sending the messages of a job to a queue, and cancels the job if nobody listens to it any more."""
+    job.subscribers.discard(queue)
+    if not job.subscribers and not job.cancelled:
+      job.cancelled = True
+      self.jobs.pop(job.key, None)
+      logging.info('Cancelled job {}'.format(job.number))
+
+  async def run_jobs(self):
+    """A job runner: takes jobs from the queue one at a time and fights them batch by batch."""
+    loop = asyncio.get_running_loop()
+    while True:
+      job = await self.queue.get()
+      try:
+        if not job.cancelled:
+          await self.run_job(job, loop)
+      except Exception as error:
+        logging.exception('Job {} failed'.format(job.number))
+        job.publish({'type': 'error', 'job': job.number, 'message': str(error)})
+      finally:
+        if self.jobs.get(job.key) is job:
+          del self.jobs[job.key]
+        self.queue.task_done()
+
+  async def run_job(self, job, loop):
+    """Fights the batches of a job on the pool, publishing the tallies after every batch."""
+    teams = len(json.loads(job.spec_json)['teams'])
+    job.summary = SimulationSummary(teams)
+    for batch, start in enumerate(range(0, job.fights, job.batch_size)):
+      if job.cancelled:
+        return
+      size = min(job.batch_size, job.fights - start)
+      summary = await loop.run_in_executor(self.pool, run_cell, job.spec_json, size, derive_seed(job.seed, batch),
+                                           job.dice)
+      job.summary.merge(summary)
+      if job.summary.fights < job.fights:
+        job.publish(job.progress('progress'))
+    # no new clients can join a finished job
+    self.jobs.pop(job.key, None)
+    job.publish(job.progress('done'))
+
+  async def handle_connection(self, reader, writer):
+    """Serves one client: reads its requests and sends it the messages of its jobs."""
+    subscriptions = {}
+    forwarders = []
+
+    async def send(message):
+      writer.write((json.dumps(message) + '\n').encode('utf-8'))
+      await writer.drain()
+
+    async def forward(job, queue):
+      try:
+        while True:
+          message = await queue.get()
+          await send(message)
+          if message['type'] in ('done', 'error', 'cancelled'):
+            subscriptions.pop(job.number, None)
+            return
+      except ConnectionError:
+        pass
+
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        try:
+          request = json.loads(line)
+          if not isinstance(request, dict):
+            raise ValueError('A request is a JSON object, got {}'.format(line.decode('utf-8', 'replace').strip()))
+          operation = request.get('op')
+          if operation == 'run':
+            job, queue = self.submit(request)
+            subscriptions[job.number] = (job, queue)
+            forwarders.append(asyncio.create_task(forward(job, queue)))
+          elif operation == 'cancel':
+            job, queue = subscriptions.pop(request.get('job'), (None, None))
+            if job is None:
+              raise ValueError('Not listening to a job {}'.format(request.get('job')))
+            self.unsubscribe(job, queue)
+            queue.put_nowait({'type': 'cancelled', 'job': job.number})
+          elif operation == 'status':
+            await send({'type': 'status', 'job': None, 'queued': self.queue.qsize(), 'jobs': len(self.jobs)})
+          else:
+            raise ValueError('Unknown op {}, pick from run, cancel and status'.format(operation))
+        except (ValueError, KeyError, TypeError) as error:
+          await send({'type': 'error', 'job': None, 'message': str(error)})
+    except ConnectionError:
+      pass
+    finally:
+      # a client that goes away stops listening to all of its jobs
+      for job, queue in subscriptions.values():
+        self.unsubscribe(job, queue)
+      for forwarder in forwarders:
+        forwarder.cancel()
+      writer.close()
+
+
+async def serve(service, path=None, host='127.0.0.1', port=None):
+  """Runs the service on a Unix socket at path, or on a TCP port of host, until it is cancelled."""
+  service.start()
+  if path:
+    server = await asyncio.start_unix_server(service.handle_connection, path)
+  else:
+    server = await asyncio.start_server(service.handle_connection, host, port)
+  logging.info('Serving on {}'.format(path or '{}:{}'.format(host, port)))
+  try:
+    async with server:
+      await server.serve_forever()
+  finally:
+    await service.close()
+
+
+def request(address, message):
+  """Sends a request to a service and yields the messages that come back until its job is over.
+
+  Args:
+      address (str or tuple): The path of the Unix socket, or a (host, port) pair.
+      message (dict): The request, see the module docstring.
+
+  Yields:
+      dict: The messages of the service.
+  """
+  family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+  with socket.socket(family, socket.SOCK_STREAM) as connection:
+    connection.connect(address)
+    connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+    with connection.makefile('r', encoding='utf-8') as lines:
+      for line in lines:
+        reply = json.loads(line)
+        yield reply
+        if reply['type'] in ('done', 'error', 'cancelled', 'status'):
+          return
+
+
+def parse_arguments(argv=None):
+  """Parses the command line options of the service."""
+  parser = argparse.ArgumentParser(description='Simulate encounters for other programs, over a Unix socket or a local '
+                                               'TCP port.')
+  parser.add_argument('--socket', default=None, metavar='PATH', help='The path of the Unix socket to listen on.')
+  parser.add_argument('--host', default='127.0.0.1', help='The address to listen on without --socket.')
+  parser.add_argument('--port', type=int, default=8765, help='The TCP port to listen on without --socket.')
+  parser.add_argument('--workers', type=int, default=None, help='The number of worker processes, defaults to the '
+                                                                'number of cores.')
+  parser.add_argument('--batch-size', type=int, default=500, help='The default number of combats between two '
+                                                                  'progress messages.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  options = parse_arguments(argv)
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s : %(levelname)s : %(message)s')
+  service = SimulationService(options.workers, options.batch_size)
+  try:
+    asyncio.run(serve(service, options.socket, options.host, options.port))
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,72 @@
+"""Statistics used to judge how precise the results of a simulation are."""
+
+import math
+
+
+def normal_quantile(probability):
+  """Returns the value below which the standard normal distribution falls with the given probability.
+
+  Args:
+      probability (float): A probability strictly between 0 and 1.
+
+  Returns:
+      float: The quantile, e.g. 1.96 for 0.975.
+  """
+  if not 0.0 < probability < 1.0:
+    raise ValueError('probability must be between 0 and 1, got {}'.format(probability))
+  low, high = -40.0, 40.0
+  # bisection on the normal CDF, 100 halvings are far below float precision
+  for _ in range(100):
+    middle = (low + high) / 2
+    if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < probability:
+      low = middle
+    else:
+      high = middle
+  return (low + high) / 2
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+  """Returns the Wilson score interval of a proportion.
+
+  Unlike the usual mean +/- z * standard error interval it behaves well for proportions close to 0 or 1 and for few
+  trials, which is exactly where lopsided encounters end up.
+
+  Args:
+      successes (int): The number of trials that were a success, e.g. the number of combats the players won.
+      trials (int): The number of trials.
+      confidence (float, optional): The confidence level of the interval.
+
+  Returns:
+      tuple of float: The (low, high) bounds of the interval, (0, 1) if there were no trials.
+  """
+  if trials <= 0:
+    return 0.0, 1.0
+  z = normal_quantile(1 - (1 - confidence) / 2)
+  proportion = successes / trials
+  denominator = 1 + z * z / trials
+  centre = (proportion + z * z / (2 * trials)) / denominator
+  spread = z * math.sqrt(proportion * (1 - proportion) / trials + z * z / (4 * trials * trials)) / denominator
+  return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+def mean_interval(total, total_of_squares, count, confidence=0.95):
+  """Returns the normal confidence interval of a mean, from running sums of the samples.
+
+  Used for the paired differences of two encounters, which take the values -1, 0 and 1 (or halves of them) and are
+  averaged over enough pairs for the normal approximation to hold.
+
+  Args:
+      total (float): The sum of the samples.
+      total_of_squares (float): The sum of the squares of the samples.
+      count (int): The number of samples.
+      confidence (float, optional): The confidence level of the interval.
+
+  Returns:
+      tuple of float: The (low, high) bounds of the interval, (-inf, inf) with fewer than two samples.
+  """
+  if count < 2:
+    return -math.inf, math.inf
+  mean = total / count
+  variance = max(0.0, (total_of_squares - count * mean * mean) / (count - 1))
+  spread = normal_quantile(1 - (1 - confidence) / 2) * math.sqrt(variance / count)
+  return mean - spread, mean + spread
@@ -0,0 +1,245 @@
+"""Fights mass battles of identical creatures as squads instead of one object per creature.
+
+A Squad is the stat block of identical creatures (see stat_block), their number and the hit points of each of them.
+The rules are those of CombatEngine.run_combat: every creature rolls its own initiative, has its own hit points and
+picks a random living opponent on its turn, so the results follow the same distribution as the serial engine. The
+damage of a turn is drawn once from its exact distribution (see DamageDistribution) instead of rolling every attack.
+
+There are no sinks, and fighting on a BattleMap or casting spells needs the serial engine.
+
+Use it like so:
+  wins = run_squads(teams, 10000, seed=42)
+or, without building a creature for every "count" of an encounter file:
+  battle = SquadBattle(template_squads(load_encounter('encounters/goblin_army.json')))
+  result = battle.fight(np.random.default_rng(42))
+"""
+
+from CombatEngine import FightResult
+from DamageDistribution import convolve, creature_attack_pmf
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+import logging
+import numpy as np
+
+
+def stat_block(creature):
+  """Returns everything that makes a creature fight the way it does, creatures with the same one can share a Squad."""
+  return (type(creature), creature.current_hp, creature.ac, creature.get_bonus(creature.dexterity),
+          creature.num_attacks, tuple(creature.get_attack_profiles()))
+
+
+class Squad:
+  """Identical creatures on a team: one stat block, the number of creatures and the hit points of each of them."""
+
+  def __init__(self, creature, count, team, indices=None):
+    """Stores the squad at its starting hit points.
+
+    Args:
+        creature (BaseCreature or subclass): The creature every member of the squad is a copy of, at its starting hit
+          points. It is read but not changed, apart from a PlayerCharacter picking its preferred melee weapon.
+        count (int): The number of creatures in the squad.
+        team (int): The index of the team of the squad.
+        indices (list of int, optional): The combatant index of every creature (see GameConstructs/CombatState), ties
+          in initiative go to the lowest. Defaults to 0 to count - 1.
+    """
+    if not creature.get_attack_profiles():
+      raise ValueError('{} has no melee weapon to attack with'.format(creature.name))
+    if creature.spells:
+      raise ValueError('{} has spells, which need the serial engine'.format(creature.name))
+    if count < 1:
+      raise ValueError('A squad of {} needs at least one creature, got {}'.format(creature.name, count))
+    self.creature = creature
+    self.name = creature.name
+    self.count = count
+    self.team = team
+    self.indices = list(range(count)) if indices is None else list(indices)
+    if len(self.indices) != count:
+      raise ValueError('A squad of {} {} needs {} combatant indices'.format(count, creature.name, count))
+    self.start_hp = creature.current_hp
+    self.ac = creature.ac
+    self.dexterity_bonus = creature.get_bonus(creature.dexterity)
+    self.hp = array('l')
+    # the members standing in no particular order, and where each of them is in it
+    self.standing = []
+    self.slot = []
+    self.reset()
+
+  def __repr__(self):
+    return 'Squad({} x{}, {} standing)'.format(self.name, self.count, len(self.standing))
+
+  def reset(self):
+    """Puts every member back on its starting hit points."""
+    self.hp[:] = array('l', [self.start_hp]) * self.count
+    self.standing[:] = range(self.count) if self.start_hp > 0 else []
+    self.slot[:] = range(self.count)
+
+  def drop(self, member):
+    """Takes a member that dropped out of the standing members."""
+    slot = self.slot[member]
+    last = self.standing.pop()
+    if last != member:
+      self.standing[slot] = last
+      self.slot[last] = slot
+
+
+def turn_damage_cdf(creature, target_ac):
+  """Returns the cumulative distribution of the damage a creature deals to a target on its turn.
+
+  Args:
+      creature (BaseCreature or subclass): The attacking creature.
+      target_ac (int): The armour class of the target.
+
+  Returns:
+      list of float: The chance the turn deals at most each amount of damage, the last one exactly 1.
+  """
+  attack_pmf = creature_attack_pmf(creature, target_ac)
+  pmf = (1.0,)
+  for _ in range(creature.num_attacks):
+    pmf = convolve(pmf, attack_pmf)
+  cdf = list(accumulate(pmf))
+  cdf[-1] = 1.0
+  return cdf
+
+
+def build_squads(teams):
+  """Groups the creatures of every team with the same stat_block into squads.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams, the creatures are read but not changed.
+
+  Returns:
+      list of Squad: The squads, team by team.
+  """
+  squads = []
+  index = 0
+  for team_index, team in enumerate(teams):
+    groups = {}
+    for creature in team.team_members:
+      groups.setdefault(stat_block(creature), []).append((creature, index))
+      index += 1
+    for members in groups.values():
+      squads.append(Squad(members[0][0], len(members), team_index, [member_index for _, member_index in members]))
+  return squads
+
+
+def template_squads(template):
+  """Builds a squad for every creature template of an encounter, one creature each whatever its "count".
+
+  Args:
+      template (EncounterConstructs/EncounterTemplate): The encounter.
+
+  Returns:
+      list of Squad: The squads, team by team.
+  """
+  squads = []
+  index = 0
+  for team_index, (_, members) in enumerate(template.teams):
+    for member in members:
+      count = member.spec.get('count', 1)
+      squads.append(Squad(member.build(), count, team_index, range(index, index + count)))
+      index += count
+  return squads
+
+
+class SquadBattle:
+  """The squads of an encounter, to fight the same encounter many times."""
+
+  def __init__(self, squads):
+    """Works out who fights whom and the damage distribution of every squad against every armour class it faces.
+
+    Args:
+        squads (list of Squad): The squads, on at least two teams.
+    """
+    teams = sorted({squad.team for squad in squads})
+    if len(teams) < 2:
+      raise ValueError('A battle needs squads on at least two teams')
+    self.squads = squads
+    self.num_teams = teams[-1] + 1
+    self.opponents = [[other for other in squads if other.team != squad.team] for squad in squads]
+    self.cdfs = [{other.ac: turn_damage_cdf(squad.creature, other.ac) for other in opponents}
+                 for squad, opponents in zip(squads, self.opponents)]
+    # every creature once, in the order the combatants are numbered, for initiative
+    self.members = [(squad_index, member) for squad_index, squad in enumerate(squads) for member in range(squad.count)]
+    self.dexterity_bonus = np.array([squads[squad_index].dexterity_bonus for squad_index, _ in self.members])
+    self.indices = np.array([squads[squad_index].indices[member] for squad_index, member in self.members])
+
+  def __repr__(self):
+    return 'SquadBattle({})'.format(', '.join('{} x{}'.format(squad.name, squad.count) for squad in self.squads))
+
+  def teams_alive(self):
+    """Returns the number of teams with at least one creature standing."""
+    return len({squad.team for squad in self.squads if squad.standing})
+
+  def fight(self, rng):
+    """Fights one combat from the starting hit points, see CombatEngine.run_combat for the rules.
+
+    Args:
+        rng (numpy.random.Generator): The source of every roll and random choice in the combat.
+
+    Returns:
+        CombatEngine/FightResult: The index of the winning team and the number of rounds fought.
+    """
+    squads = self.squads
+    for squad in squads:
+      squad.reset()
+    initiative = rng.integers(1, 21, size=len(self.members)) + self.dexterity_bonus
+    # the highest initiative first, ties to the lowest combatant index like the stable sort of the serial engine
+    turns = [(squads[squad_index], self.opponents[squad_index], self.cdfs[squad_index], member)
+             for squad_index, member in (self.members[index] for index in np.lexsort((self.indices, -initiative)))]
+
+    rounds = 0
+    while self.teams_alive() > 1:
+      rounds += 1
+      # two random numbers per turn: the target and the damage
+      uniforms = rng.random(2 * len(turns)).tolist()
+      draw = 0
+      for squad, opponents, cdfs, member in turns:
+        if squad.hp[member] < 1:
+          continue
+        standing = 0
+        for opponent in opponents:
+          standing += len(opponent.standing)
+        if not standing:
+          # nobody left to attack
+          break
+        pick = int(uniforms[draw] * standing)
+        for target in opponents:
+          if pick < len(target.standing):
+            break
+          pick -= len(target.standing)
+        target_member = target.standing[pick]
+        hp = target.hp[target_member] - bisect_right(cdfs[target.ac], uniforms[draw + 1])
+        target.hp[target_member] = hp
+        if hp < 1:
+          target.drop(target_member)
+        draw += 2
+
+    standing = sorted({squad.team for squad in squads if squad.standing})
+    winner = standing[0] if len(standing) == 1 else -1
+    return FightResult(winner, rounds)
+
+
+def run_squads(teams, num_fights, seed=None):
+  """Runs num_fights combats between the teams with their identical creatures in squads and adds the wins to each
+  Team.score.
+
+  Args:
+      teams (list of GameConstructs/Team): The teams participating in the combat.
+      num_fights (int): How many combats to fight.
+      seed (int, optional): Seed for the NumPy random generator, the same seed gives the same results.
+
+  Returns:
+      list of int: The number of combats each team won, in the same order as teams.
+  """
+  battle = SquadBattle(build_squads(teams))
+  logging.info('Fighting {}'.format(battle))
+  rng = np.random.default_rng(seed)
+  wins = [0] * len(teams)
+  for _ in range(num_fights):
+    result = battle.fight(rng)
+    if result.winner >= 0:
+      wins[result.winner] += 1
+  for team, team_wins in zip(teams, wins):
+    team.score += team_wins
+  return wins
@@ -0,0 +1,448 @@
+"""Spells and the status effects they leave behind, scheduled on a heap for CombatEngine.run_combat.
+
+An Effect lasts on a creature for a number of rounds and can:
+  * change its AC or the to hit bonus of its attacks, e.g. +2 AC from Shield of Faith or +2 to hit from Bless,
+  * deal damage at the start of each of its turns, e.g. burning or poison,
+  * let it make a saving throw at the end of each of its turns to end the effect early,
+  * keep it from taking its turn (incapacitated), e.g. Hold Person.
+A Spell is what a creature casts instead of attacking: healing or damage (halved by a successful saving throw) for a
+number of targets, and an Effect on each of them. The effects of a concentration spell end when the caster drops,
+casts another concentration spell or fails the Constitution saving throw it makes when it takes damage.
+
+Nothing is polled. Every turn of a combat is an initiative slot, and everything an effect has to do is pushed on a heap
+keyed by the (round, initiative slot, start or end of the turn) it is due at: the damage at the start of the target's
+turns, the saving throws at the end of them and the end of the duration (at the start of the caster's turn). The engine
+asks for what is due at the start of every turn, which is a look at the top of the heap unless something is due. An
+effect that ends early is marked as ended and its entries are skipped when they come up.
+
+AC and to hit modifiers are added up per combatant when an effect starts or ends, in ac_bonus and to_hit_bonus. The
+creatures themselves are never changed: CombatEngine.run_combat passes the to hit bonus of the attacker and the AC of
+the target (armor_class) to every attack.
+
+Spells come with the creatures, see BaseCreature.give_spell and the "spells" of an encounter file:
+  {"name": "Bless", "target": "ally", "targets": 3, "concentration": true,
+   "effect": {"name": "Blessed", "duration": 10, "to_hit": 2}}
+A creature casts the first of its spells with uses left that has something to do: healing for the allies at half of
+their hit points or less (the allies that are down first, healing gets them back up), an effect for allies or
+opponents that do not have it yet, or damage. Spells reach every creature, on a BattleMap/BattleMap too.
+
+Use it like so:
+  effects = effect_engine(teams)
+  run_combat(teams, rng, sink, state, effects=effects)
+"""
+
+from heapq import heappop, heappush
+import itertools
+
+
+START_OF_TURN = 0
+END_OF_TURN = 1
+# what a heap entry does when it comes up
+TICK = 'tick'
+SAVE = 'save'
+EXPIRE = 'expire'
+ABILITIES = ('strength', 'dexterity', 'constitution', 'intelligence', 'wisdom', 'charisma')
+
+
+def roll(dice, bonus, rng):
+  """Rolls a tuple of dice sizes and adds a bonus."""
+  total = bonus
+  for dice_size in dice:
+    total += rng.randint(1, dice_size)
+  return total
+
+
+def saving_throw(creature, save, rng):
+  """Returns True if a creature makes a saving throw.
+
+  Args:
+      creature (BaseCreature or subclass): The creature making the saving throw.
+      save (tuple): The (ability, DC) of the saving throw, e.g. ('wisdom', 13).
+      rng (random.Random or module): The source of the roll.
+  """
+  ability, dc = save
+  return rng.randint(1, 20) + creature.get_bonus(getattr(creature, ability)) >= dc
+
+
+def parse_save(spec):
+  """Checks the saving throw of a spec, a [ability, DC] pair or None."""
+  if spec is None:
+    return None
+  ability, dc = spec
+  if ability not in ABILITIES:
+    raise ValueError('Unknown ability {} for a saving throw, pick from {}'.format(ability, ', '.join(ABILITIES)))
+  return ability, int(dc)
+
+
+class Effect:
+  """What a status effect does to the creature it is on, shared by every creature it is put on."""
+
+  __slots__ = ('name', 'duration', 'ac', 'to_hit', 'damage', 'damage_bonus', 'save', 'incapacitated')
+
+  def __init__(self, name, duration=10, ac=0, to_hit=0, damage=(), damage_bonus=0, save=None, incapacitated=False):
+    """Stores the effect.
+
+    Args:
+        name (str): The name of the effect.
+        duration (int, optional): The number of rounds it lasts, it ends at the start of the caster's turn. None lasts
+          until the combat is over, or the caster's concentration ends.
+        ac (int, optional): Added to the AC of the creature.
+        to_hit (int, optional): Added to the attack rolls of the creature.
+        damage (tuple of int, optional): The sizes of the dice of damage the creature takes at the start of each of
+          its turns.
+        damage_bonus (int, optional): Added to that damage.
+        save (tuple, optional): The (ability, DC) of the saving throw the creature makes at the end of each of its
+          turns, the effect ends if it succeeds.
+        incapacitated (bool, optional): The creature does not take its turns.
+    """
+    self.name = name
+    self.duration = duration
+    self.ac = ac
+    self.to_hit = to_hit
+    self.damage = tuple(damage)
+    self.damage_bonus = damage_bonus
+    self.save = save
+    self.incapacitated = incapacitated
+
+  def __repr__(self):
+    return 'Effect({}, {} rounds)'.format(self.name, self.duration)
+
+  @classmethod
+  def from_spec(cls, spec):
+    """Builds an effect from its spec in an encounter file, the arguments of the constructor as keys."""
+    return cls(spec['name'], spec.get('duration', 10), spec.get('ac', 0), spec.get('to_hit', 0),
+               spec.get('damage', ()), spec.get('damage_bonus', 0), parse_save(spec.get('save')),
+               spec.get('incapacitated', False))
+
+  def to_spec(self):
+    """Returns the spec of the effect, the inverse of from_spec."""
+    return {'name': self.name, 'duration': self.duration, 'ac': self.ac, 'to_hit': self.to_hit,
+            'damage': list(self.damage), 'damage_bonus': self.damage_bonus,
+            'save': list(self.save) if self.save else None, 'incapacitated': self.incapacitated}
+
+
+class Spell:
+  """A spell a creature casts as its action instead of attacking."""
+
+  __slots__ = ('name', 'target', 'targets', 'uses', 'healing', 'damage', 'bonus', 'save', 'effect', 'concentration')
+
+  def __init__(self, name, target='enemy', targets=1, uses=1, healing=(), damage=(), bonus=0, save=None, effect=None,
+               concentration=False):
+    """Stores the spell.
+
+    Args:
+        name (str): The name of the spell.
+        target (str, optional): 'ally' for the caster's own team (the caster included) or 'enemy'.
+        targets (int, optional): The most creatures the spell affects.
+        uses (int, optional): The number of times the creature can cast it per combat.
+        healing (tuple of int, optional): The sizes of the dice of hit points every target regains.
+        damage (tuple of int, optional): The sizes of the dice of damage every target takes.
+        bonus (int, optional): Added to the healing or damage.
+        save (tuple, optional): The (ability, DC) of the saving throw of every target, one that succeeds takes half
+          damage and no effect.
+        effect (Effect, optional): The effect put on every target.
+        concentration (bool, optional): The effects last only as long as the caster's concentration.
+    """
+    if target not in ('ally', 'enemy'):
+      raise ValueError('A spell targets "ally" or "enemy", got {}'.format(target))
+    self.name = name
+    self.target = target
+    self.targets = targets
+    self.uses = uses
+    self.healing = tuple(healing)
+    self.damage = tuple(damage)
+    self.bonus = bonus
+    self.save = save
+    self.effect = effect
+    self.concentration = concentration
+
+  def __repr__(self):
+    return 'Spell({}, {} uses)'.format(self.name, self.uses)
+
+  @classmethod
+  def from_spec(cls, spec):
+    """Builds a spell from its spec in an encounter file, the arguments of the constructor as keys."""
+    effect = Effect.from_spec(spec['effect']) if spec.get('effect') else None
+    return cls(spec['name'], spec.get('target', 'enemy'), spec.get('targets', 1), spec.get('uses', 1),
+               spec.get('healing', ()), spec.get('damage', ()), spec.get('bonus', 0), parse_save(spec.get('save')),
+               effect, spec.get('concentration', False))
+
+  def to_spec(self):
+    """Returns the spec of the spell, the inverse of from_spec."""
+    return {'name': self.name, 'target': self.target, 'targets': self.targets, 'uses': self.uses,
+            'healing': list(self.healing), 'damage': list(self.damage), 'bonus': self.bonus,
+            'save': list(self.save) if self.save else None,
+            'effect': self.effect.to_spec() if self.effect else None, 'concentration': self.concentration}
+
+
+class ActiveEffect:
+  """An effect on a creature during a combat."""
+
+  __slots__ = ('effect', 'target', 'source', 'active')
+
+  def __init__(self, effect, target, source):
+    self.effect = effect
+    self.target = target
+    self.source = source
+    self.active = True
+
+  def __repr__(self):
+    return 'ActiveEffect({} on {} from {})'.format(self.effect.name, self.target, self.source)
+
+
+class EffectEngine:
+  """The spells cast and the effects active in a combat, with the heap of what they do next."""
+
+  def __init__(self):
+    self.state = None
+    self.sink = None
+    self.battle_map = None
+    self.heap = []
+    self.sequence = itertools.count()
+    # the point of the combat the engine is at, new entries are scheduled after it
+    self.now = (0, 0, START_OF_TURN)
+    self.slot_of = []
+    self.effects = []
+    # caster: (the spell it concentrates on, the ActiveEffects of the spell)
+    self.concentration = {}
+    self.uses = []
+    self.ac_bonus = []
+    self.to_hit_bonus = []
+    self.incapacitated = []
+
+  def __repr__(self):
+    return 'EffectEngine({} scheduled, {} concentrating)'.format(len(self.heap), len(self.concentration))
+
+  def start_combat(self, state, sink, battle_map=None):
+    """Clears the effects and spell uses of the last combat, CombatEngine.run_combat calls this after initiative.
+
+    Args:
+        state (GameConstructs/CombatState): The state of the combat, with its initiative order.
+        sink (CombatEvents/NullSink or subclass): Receives the spells, effects and hit point changes.
+        battle_map (BattleMap/BattleMap, optional): The map of the combat, creatures that drop are taken off it.
+    """
+    combatants = state.combatants
+    self.state = state
+    self.sink = sink
+    self.battle_map = battle_map
+    self.heap = []
+    self.now = (0, 0, START_OF_TURN)
+    self.slot_of = [0] * len(combatants)
+    for slot, index in enumerate(state.initiative_order):
+      self.slot_of[index] = slot
+    self.effects = [[] for _ in combatants]
+    self.concentration = {}
+    self.uses = [[spell.uses for spell in creature.spells] for creature in combatants]
+    self.ac_bonus = [0] * len(combatants)
+    self.to_hit_bonus = [0] * len(combatants)
+    self.incapacitated = [0] * len(combatants)
+
+  def schedule(self, when, kind, active):
+    """Pushes what an active effect does next on the heap, when is a (round, slot, start or end of turn) tuple."""
+    heappush(self.heap, (when, next(self.sequence), kind, active))
+
+  def next_turn(self, index, phase):
+    """Returns when the next start or end of a creature's turn is, after the point the combat is at."""
+    round_number, slot, _ = self.now
+    when = (round_number, self.slot_of[index], phase)
+    return when if when > self.now else (round_number + 1, self.slot_of[index], phase)
+
+  def run_due(self, round_number, slot, rng):
+    """Does everything due up to the start of a turn, CombatEngine.run_combat calls this before every turn.
+
+    Args:
+        round_number (int): The round of the turn.
+        slot (int): The initiative slot of the turn.
+        rng (random.Random or module): The source of the damage and saving throw rolls.
+    """
+    self.now = now = (round_number, slot, START_OF_TURN)
+    heap = self.heap
+    while heap and heap[0][0] <= now:
+      when, _, kind, active = heappop(heap)
+      if not active.active:
+        continue
+      effect = active.effect
+      if kind == EXPIRE:
+        self.end(active)
+      elif kind == TICK:
+        if self.state.alive[active.target]:
+          self.damage(active.target, roll(effect.damage, effect.damage_bonus, rng), effect.name, rng)
+        if active.active:
+          self.schedule((when[0] + 1,) + when[1:], TICK, active)
+      elif self.state.alive[active.target] and saving_throw(self.state.combatants[active.target], effect.save, rng):
+        self.end(active)
+      else:
+        self.schedule((when[0] + 1,) + when[1:], SAVE, active)
+
+  def apply(self, effect, target, source):
+    """Puts an effect on a creature and schedules what it does.
+
+    Args:
+        effect (Effect): The effect.
+        target (int): The combatant the effect is put on.
+        source (int): The combatant that cast it.
+
+    Returns:
+        ActiveEffect: The effect on the creature.
+    """
+    active = ActiveEffect(effect, target, source)
+    self.effects[target].append(active)
+    if effect.ac or effect.to_hit:
+      self.ac_bonus[target] += effect.ac
+      self.to_hit_bonus[target] += effect.to_hit
+    if effect.incapacitated:
+      self.incapacitated[target] += 1
+    if effect.damage or effect.damage_bonus:
+      self.schedule(self.next_turn(target, START_OF_TURN), TICK, active)
+    if effect.save:
+      self.schedule(self.next_turn(target, END_OF_TURN), SAVE, active)
+    if effect.duration:
+      self.schedule((self.now[0] + effect.duration, self.slot_of[source], START_OF_TURN), EXPIRE, active)
+    self.sink.effect(self.state.combatants[target], effect.name, True)
+    return active
+
+  def end(self, active):
+    """Ends an active effect, its entries on the heap are skipped from now on."""
+    if not active.active:
+      return
+    active.active = False
+    effect = active.effect
+    target = active.target
+    self.effects[target].remove(active)
+    if effect.ac or effect.to_hit:
+      self.ac_bonus[target] -= effect.ac
+      self.to_hit_bonus[target] -= effect.to_hit
+    if effect.incapacitated:
+      self.incapacitated[target] -= 1
+    self.sink.effect(self.state.combatants[target], effect.name, False)
+
+  def armor_class(self, index):
+    """Returns the AC of a combatant with the modifiers of the effects on it."""
+    return self.state.combatants[index].ac + self.ac_bonus[index]
+
+  def end_concentration(self, caster):
+    """Ends every effect of the concentration spell of a caster."""
+    _, actives = self.concentration.pop(caster, (None, ()))
+    for active in actives:
+      self.end(active)
+
+  def took_damage(self, index, damage, dropped, rng):
+    """Checks the concentration of a creature that took damage, CombatEngine.run_combat calls this after attacks.
+
+    Args:
+        index (int): The combatant that took the damage.
+        damage (int): The damage.
+        dropped (bool): If the damage dropped the combatant.
+        rng (random.Random or module): The source of the saving throw.
+    """
+    if index not in self.concentration:
+      return
+    if dropped or not saving_throw(self.state.combatants[index], ('constitution', max(10, damage // 2)), rng):
+      self.end_concentration(index)
+
+  def damage(self, index, damage, source_name, rng):
+    """Deals damage to a combatant from a spell or an effect, and takes it off the map if it drops."""
+    state = self.state
+    creature = state.combatants[index]
+    dropped = state.apply_damage(index, damage)
+    self.sink.hit_points(creature, source_name, -damage)
+    if dropped:
+      if self.battle_map is not None:
+        self.battle_map.remove(index)
+      self.sink.down(creature)
+    if damage > 0:
+      self.took_damage(index, damage, dropped, rng)
+
+  def heal(self, index, healing, source_name):
+    """Gives a combatant hit points, up to its maximum, and puts it back on the map if that gets it back up."""
+    state = self.state
+    creature = state.combatants[index]
+    # a combatant that is down is at 0 hit points
+    healing = max(0, min(healing, creature.hp - max(state.hp[index], 0)))
+    revived = state.heal(index, healing)
+    self.sink.hit_points(creature, source_name, healing)
+    if revived and self.battle_map is not None:
+      self.battle_map.revive(index)
+
+  def choose_targets(self, index, spell, rng):
+    """Returns the combatants a spell would do something to, an empty list if casting it is pointless now."""
+    state = self.state
+    own_team = state.team[index]
+    if spell.target == 'ally':
+      if spell.healing:
+        # the allies that are down too, they are the lowest
+        hurt = [ally for ally, team in enumerate(state.team)
+                if team == own_team and state.hp[ally] * 2 <= state.combatants[ally].hp]
+        return sorted(hurt, key=lambda ally: max(state.hp[ally], 0))[:spell.targets]
+      allies = list(state.alive_members[own_team])
+      if spell.effect:
+        allies = [ally for ally in allies if not self.has_effect(ally, spell.effect)]
+      return allies[:spell.targets]
+    opponents = state.potential_targets(index)
+    if spell.effect and not spell.damage:
+      opponents = [opponent for opponent in opponents if not self.has_effect(opponent, spell.effect)]
+    targets = []
+    while opponents and len(targets) < spell.targets:
+      target = rng.choice(opponents)
+      opponents.remove(target)
+      targets.append(target)
+    return targets
+
+  def has_effect(self, index, effect):
+    """Returns True if a combatant has an effect on it."""
+    return any(active.effect is effect for active in self.effects[index])
+
+  def cast_spell(self, index, rng):
+    """Casts the first spell of a combatant that has uses left and something to do, as the action of its turn.
+
+    A concentration spell ends the one the caster is concentrating on, but is not cast again while the caster still
+    concentrates on it.
+
+    Args:
+        index (int): The combatant whose turn it is.
+        rng (random.Random or module): The source of the target picks and the rolls.
+
+    Returns:
+        bool: True if it cast a spell, False if it should attack instead.
+    """
+    uses = self.uses[index]
+    if not uses:
+      return False
+    caster = self.state.combatants[index]
+    concentrating_on = self.concentration[index][0] if index in self.concentration else None
+    for number, spell in enumerate(caster.spells):
+      if not uses[number] or (spell.concentration and spell is concentrating_on):
+        continue
+      targets = self.choose_targets(index, spell, rng)
+      if not targets:
+        continue
+      uses[number] -= 1
+      if spell.concentration:
+        self.end_concentration(index)
+        self.concentration[index] = (spell, [])
+      if self.battle_map is not None:
+        self.battle_map.stalled = False
+      self.sink.cast(caster, spell, [self.state.combatants[target] for target in targets])
+      for target in targets:
+        # only healing reaches the allies that are down
+        if not self.state.alive[target] and not spell.healing:
+          continue
+        saved = spell.save is not None and saving_throw(self.state.combatants[target], spell.save, rng)
+        if spell.healing:
+          self.heal(target, roll(spell.healing, spell.bonus, rng), spell.name)
+        if spell.damage:
+          damage = roll(spell.damage, spell.bonus, rng)
+          self.damage(target, damage // 2 if saved else damage, spell.name, rng)
+        if spell.effect and not saved and self.state.alive[target]:
+          active = self.apply(spell.effect, target, index)
+          if spell.concentration and index in self.concentration:
+            self.concentration[index][1].append(active)
+      return True
+    return False
+
+
+def effect_engine(teams):
+  """Returns an EffectEngine for the teams if any of their creatures has spells, None otherwise."""
+  if any(creature.spells for team in teams for creature in team.team_members):
+    return EffectEngine()
+  return None
@@ -0,0 +1,203 @@
+"""Terrain for a BattleMap/BattleMap: walls, difficult terrain, line of sight and the cost of walking around them.
+
+Every square of a Terrain is open, difficult (it costs double to walk into) or a wall (nothing walks through it or sees
+through it). A terrain is easiest to draw as rows of text:
+
+  terrain = Terrain.from_rows(['..........',
+                               '...####...',
+                               '..~~~~~~..',
+                               '..........'])
+
+with '.' for open ground, '~' for difficult terrain and '#' for walls.
+
+Working out what a creature can see and the cheapest way around the walls on every turn would cost far more than the
+rest of the combat, so the terrain works both out once and keeps them:
+  * can_see(square, other) traces the line between two squares the first time it is asked for and keeps the answer as
+    a bit of two bitsets (Python ints, bit y * width + x) of the first square: the squares asked about and the ones
+    of those it can see. Only the pairs a combat asks about are ever traced, at the cost of one line each,
+  * distance_field(goal) is the cost of the cheapest walk from every square to the goal square, from a Dijkstra search
+    outwards from the goal the first time it is asked for. The most recently used fields are kept, up to max_fields.
+A BattleMap fought over and over in a run keeps the same Terrain, so every combat after the first few only looks its
+answers up. Changing a square (set_square) throws all of them away, and bumps the version of the terrain.
+"""
+
+from array import array
+from collections import OrderedDict
+import heapq
+
+
+OPEN = 1
+DIFFICULT = 2
+WALL = 0
+SYMBOLS = {'.': OPEN, '~': DIFFICULT, '#': WALL}
+# the cost of walking to a square with no way to the goal
+UNREACHABLE = 1 << 30
+
+
+def line_squares(start, end):
+  """Yields the squares on the line between two squares, without the two squares themselves (Bresenham's)."""
+  x, y = start
+  end_x, end_y = end
+  delta_x, delta_y = abs(end_x - x), -abs(end_y - y)
+  step_x = 1 if x < end_x else -1
+  step_y = 1 if y < end_y else -1
+  error = delta_x + delta_y
+  while (x, y) != (end_x, end_y):
+    double_error = 2 * error
+    if double_error >= delta_y:
+      error += delta_y
+      x += step_x
+    if double_error <= delta_x:
+      error += delta_x
+      y += step_y
+    if (x, y) != (end_x, end_y):
+      yield x, y
+
+
+class Terrain:
+  """The kind of every square of a map, with the line of sight and walking costs worked out from it."""
+
+  def __init__(self, width, height, max_fields=1024):
+    """Creates open terrain.
+
+    Args:
+        width (int): The width of the map in squares.
+        height (int): The height of the map in squares.
+        max_fields (int, optional): The most distance fields kept, the least recently used are dropped.
+    """
+    self.width = width
+    self.height = height
+    self.max_fields = max_fields
+    self.costs = bytearray([OPEN]) * (width * height)
+    self.version = 0
+    # square: [bitset of the squares traced from it, bitset of those with a clear line]
+    self.sight = {}
+    self.fields = OrderedDict()
+
+  def __repr__(self):
+    return 'Terrain({}x{} squares, {} walls, {} difficult, version {})'.format(
+      self.width, self.height, self.costs.count(WALL), self.costs.count(DIFFICULT), self.version)
+
+  @classmethod
+  def from_rows(cls, rows, max_fields=1024):
+    """Builds a terrain from rows of text, see the module docstring.
+
+    Args:
+        rows (list of str): The rows from y = 0 down, all of the same length.
+        max_fields (int, optional): The most distance fields kept.
+
+    Returns:
+        Terrain: The terrain.
+    """
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+      raise ValueError('A terrain needs rows of the same length')
+    terrain = cls(len(rows[0]), len(rows), max_fields)
+    for y, row in enumerate(rows):
+      for x, symbol in enumerate(row):
+        if symbol not in SYMBOLS:
+          raise ValueError('Unknown terrain {!r} at ({}, {}), use . ~ or #'.format(symbol, x, y))
+        terrain.costs[y * terrain.width + x] = SYMBOLS[symbol]
+    return terrain
+
+  def rows(self):
+    """Returns the terrain as rows of text, the inverse of from_rows."""
+    symbols = {cost: symbol for symbol, cost in SYMBOLS.items()}
+    return [''.join(symbols[cost] for cost in self.costs[y * self.width:(y + 1) * self.width])
+            for y in range(self.height)]
+
+  def on_map(self, square):
+    """Returns True if the square is on the map."""
+    return 0 <= square[0] < self.width and 0 <= square[1] < self.height
+
+  def cost(self, square):
+    """Returns the cost of walking into a square: 1 for open ground, 2 for difficult terrain, 0 for a wall."""
+    return self.costs[square[1] * self.width + square[0]]
+
+  def passable(self, square):
+    """Returns True if the square is on the map and not a wall."""
+    return self.on_map(square) and self.costs[square[1] * self.width + square[0]] != WALL
+
+  def set_square(self, square, kind):
+    """Changes a square, e.g. a wall that collapses, and throws away everything worked out from the old terrain.
+
+    Args:
+        square (tuple of int): The (x, y) square.
+        kind (int): OPEN, DIFFICULT or WALL.
+    """
+    if kind not in (OPEN, DIFFICULT, WALL):
+      raise ValueError('A square is OPEN, DIFFICULT or WALL, got {}'.format(kind))
+    if not self.on_map(square):
+      raise ValueError('{} is not on the {}x{} map'.format(square, self.width, self.height))
+    index = square[1] * self.width + square[0]
+    if self.costs[index] != kind:
+      self.costs[index] = kind
+      self.version += 1
+      self.sight.clear()
+      self.fields.clear()
+
+  def can_see(self, square, other):
+    """Returns True if there is a clear line of sight between two squares, the same both ways, traced on first use."""
+    # the line is always traced from the first of the two squares, so the answer does not depend on who looks
+    if (square[1], square[0]) > (other[1], other[0]):
+      square, other = other, square
+    bit = 1 << (other[1] * self.width + other[0])
+    known = self.sight.get(square)
+    if known is None:
+      known = self.sight[square] = [0, 0]
+    elif known[0] & bit:
+      return known[1] & bit != 0
+    width = self.width
+    costs = self.costs
+    clear = all(costs[line_y * width + line_x] != WALL for line_x, line_y in line_squares(square, other))
+    known[0] |= bit
+    if clear:
+      known[1] |= bit
+    return clear
+
+  def distance_field(self, goal):
+    """Returns the cost of the cheapest walk from every square to the goal, worked out on first use.
+
+    Walking into a square costs its cost, a diagonal step the same as a straight one. Walls and squares with no way to
+    the goal cost UNREACHABLE.
+
+    Args:
+        goal (tuple of int): The (x, y) square to walk to.
+
+    Returns:
+        array: The costs, square (x, y) at index y * width + x.
+    """
+    field = self.fields.get(goal)
+    if field is not None:
+      self.fields.move_to_end(goal)
+      return field
+    width, height = self.width, self.height
+    costs = self.costs
+    field = array('l', [UNREACHABLE]) * (width * height)
+    goal_index = goal[1] * width + goal[0]
+    field[goal_index] = 0
+    # the search walks backwards from the goal, the cost of a step is the cost of the square it walks into
+    queue = [(0, goal_index)]
+    while queue:
+      distance, index = heapq.heappop(queue)
+      if distance > field[index]:
+        continue
+      x, y = index % width, index // width
+      entry_cost = costs[index] or 1
+      for neighbour_y in (y - 1, y, y + 1):
+        if not 0 <= neighbour_y < height:
+          continue
+        for neighbour_x in (x - 1, x, x + 1):
+          if not 0 <= neighbour_x < width:
+            continue
+          neighbour = neighbour_y * width + neighbour_x
+          if costs[neighbour] == WALL:
+            continue
+          # stepping from the neighbour into this square
+          neighbour_distance = distance + entry_cost
+          if neighbour_distance < field[neighbour]:
+            field[neighbour] = neighbour_distance
+            heapq.heappush(queue, (neighbour_distance, neighbour))
+    self.fields[goal] = field
+    if len(self.fields) > self.max_fields:
+      self.fields.popitem(last=False)
+    return field
@@ -0,0 +1,68 @@
+"""Tests of BattleMap, and of the tactics behind the win rates of --map."""
+
+from BattleMap import BattleMap
+from CombatEngine import run_combat
+from CombatEvents import NULL_SINK
+from EncounterConstructs import load_encounter
+from GameConstructs import CombatState
+import random
+import unittest
+
+
+def win_counts(path, feet, fights=500, seed=4):
+  """Returns the wins of both teams of an encounter file, on a map with the teams lined up feet apart or no map."""
+  teams = load_encounter(path).build()
+  battle_map = BattleMap.line_up(teams, feet) if feet is not None else None
+  state = CombatState(teams)
+  rng = random.Random(seed)
+  wins = [0, 0]
+  for _ in range(fights):
+    state.reset()
+    result = run_combat(teams, rng, NULL_SINK, state, battle_map=battle_map)
+    if result.winner >= 0:
+      wins[result.winner] += 1
+  return wins
+
+
+class TacticsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.teams = load_encounter('encounters/hill_giants_archer.json').build()
+    self.state = CombatState(self.teams)
+    self.state.initiative_order = list(range(len(self.state.combatants)))
+
+  def test_an_archer_in_range_shoots_instead_of_closing(self):
+    battle_map = BattleMap.line_up(self.teams, 60)
+    battle_map.start_combat(self.state)
+    bob = self.teams[0].team_members[2]
+    index = self.state.index_of[bob]
+    position = battle_map.positions[index]
+    targets, ranged_attack, disadvantage = battle_map.plan_turn(index, bob, NULL_SINK)
+    self.assertTrue(targets)
+    self.assertEqual(ranged_attack[0].name, 'longbow')
+    self.assertFalse(disadvantage)
+    self.assertEqual(battle_map.positions[index], position)
+
+  def test_lines_60_feet_apart_arrive_one_at_a_time(self):
+    battle_map = BattleMap.line_up(self.teams, 60)
+    battle_map.start_combat(self.state)
+    giant = self.teams[1].team_members[0]
+    geoff = self.teams[0].team_members[0]
+    # the first to move covers half of the 12 squares and attacks nobody
+    self.assertEqual(battle_map.plan_turn(self.state.index_of[giant], giant, NULL_SINK), ([], None, False))
+    # the next one walks the rest of the way and attacks first
+    targets, ranged_attack, _ = battle_map.plan_turn(self.state.index_of[geoff], geoff, NULL_SINK)
+    self.assertEqual(targets, [self.state.index_of[giant]])
+    self.assertIsNone(ranged_attack)
+
+  def test_the_players_win_less_the_further_apart_the_lines_start(self):
+    close = win_counts('encounters/hill_giants.json', 5)
+    no_map = win_counts('encounters/hill_giants.json', None)
+    far = win_counts('encounters/hill_giants.json', 60)
+    self.assertGreater(close[0], no_map[0])
+    self.assertGreater(no_map[0], far[0])
+    self.assertLess(far[0], far[1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,22 @@
+"""Tests of CharacterClasses."""
+
+from CharacterClasses import Monster
+import random
+import unittest
+
+
+class ResolveAttackTest(unittest.TestCase):
+
+  def test_a_negative_damage_bonus_never_heals(self):
+    rat = Monster('Weak Rat', 2, 2, 11, 9, 2, 10, 4, 1, {}, 10)
+    rat.give_melee_weapon('Bite', 8, -3, [(4, 'piercing')])
+    target = Monster('Scarecrow', 36, 11, 13, 11, 10, 10, 13, 1, {}, 0)
+    rng = random.Random(7)
+    events = [rat.melee_attack(target, rng) for _ in range(200)]
+    damages = [event.damage for event in events if event.hit]
+    self.assertEqual(min(damages), 0)
+    self.assertEqual(max(damages), 5)
+
+
+if __name__ == '__main__':
+  unittest.main()
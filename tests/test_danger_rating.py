@@ -0,0 +1,32 @@
+"""Tests of DangerRating."""
+
+from CombatEngine import FightResult
+from CombatEvents import CombatEvent
+from DangerRating import DangerAggregator
+from EncounterConstructs import load_encounter
+from GameConstructs import CombatState
+import unittest
+
+
+class DangerAggregatorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.teams = load_encounter('encounters/hill_giants.json').build()
+    self.player = self.teams[0].team_members[0]
+    self.giant = self.teams[1].team_members[0]
+    self.danger = DangerAggregator(self.teams)
+
+  def test_spell_and_effect_damage_is_damage_taken(self):
+    weapon = self.giant.weapons[0]
+    self.danger.attack(CombatEvent(self.giant, self.player, weapon, 15, 23, False, True, 20, 'bludgeoning'))
+    self.danger.hit_points(self.player, 'Stinking Cloud', -7)
+    self.danger.hit_points(self.player, 'Poisoned', -3)
+    self.danger.hit_points(self.player, 'Cure Wounds', 12)
+    self.danger.hit_points(self.giant, 'Fire Bolt', -10)
+    self.danger.combat_end(self.teams, FightResult(0, 3), CombatState(self.teams))
+    self.assertEqual(self.danger.moments['max_damage_taken'].mean, 30)
+    self.assertEqual(self.danger.moments['hits_on_players'].mean, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
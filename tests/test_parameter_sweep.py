@@ -0,0 +1,29 @@
+"""Tests of ParameterSweep."""
+
+from EncounterConstructs import load_encounter
+from ParameterSweep import apply_parameters, parse_arguments, parse_parameter, run_sweep
+import unittest
+
+
+class ParameterSweepTest(unittest.TestCase):
+
+  def test_sweep_keeps_the_terrain(self):
+    encounter = load_encounter('encounters/hill_giants_ruins.json')
+    parameters = [parse_parameter('Hill Giant:max_hp=70,105')]
+    swept = apply_parameters(encounter, parameters, (70,))
+    self.assertEqual(swept.terrain, encounter.terrain)
+    cells = run_sweep(encounter, parameters, 20, workers=1)
+    self.assertEqual([cell.values for cell in cells], [(70,), (105,)])
+    for cell in cells:
+      self.assertEqual(cell.template.terrain, encounter.terrain)
+      self.assertEqual(cell.summary.fights, 20)
+
+  def test_dice_choices_are_the_backends(self):
+    options = parse_arguments(['encounters/hill_giants.json', '-p', 'Hill Giant:ac=13', '--dice', 'numpy'])
+    self.assertEqual(options.dice, 'numpy')
+    with self.assertRaises(SystemExit):
+      parse_arguments(['encounters/hill_giants.json', '-p', 'Hill Giant:ac=13', '--dice', 'loaded'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,32 @@
+"""Tests of SimulationService."""
+
+from EncounterConstructs import load_encounter
+from SimulationService import SimulationService
+import asyncio
+import unittest
+
+
+class SubmitTest(unittest.TestCase):
+
+  def setUp(self):
+    self.service = SimulationService(workers=1)
+    self.spec = load_encounter('encounters/hill_giants.json').to_spec()
+
+  def test_rejects_an_empty_team(self):
+    self.spec['teams'][1]['members'] = []
+    with self.assertRaisesRegex(ValueError, 'Monsters has none'):
+      self.service.submit({'op': 'run', 'encounter': self.spec, 'fights': 10})
+
+  def test_rejects_a_single_team(self):
+    del self.spec['teams'][1]
+    with self.assertRaisesRegex(ValueError, 'at least two teams'):
+      self.service.submit({'op': 'run', 'encounter': self.spec, 'fights': 10})
+
+  def test_accepts_a_full_encounter(self):
+    self.service.queue = asyncio.Queue()
+    job, queue = self.service.submit({'op': 'run', 'encounter': self.spec, 'fights': 10})
+    self.assertEqual(queue.get_nowait(), {'type': 'accepted', 'job': job.number, 'coalesced': False})
+
+
+if __name__ == '__main__':
+  unittest.main()
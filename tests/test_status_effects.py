@@ -0,0 +1,64 @@
+"""Tests of StatusEffects."""
+
+from BattleMap import BattleMap
+from CombatEngine import get_initiative_order
+from CombatEvents import NULL_SINK
+from EncounterConstructs import load_encounter
+from GameConstructs import CombatState
+from StatusEffects import EffectEngine, Spell
+import random
+import unittest
+
+
+class HealingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.teams = load_encounter('encounters/hill_giants.json').build()
+    self.healer, self.downed = self.teams[0].team_members[:2]
+    self.healer.spells = []
+    self.healer.give_spell(Spell('Cure Wounds', 'ally', uses=2, healing=(8,), bonus=3))
+    self.state = CombatState(self.teams)
+    self.rng = random.Random(1)
+    get_initiative_order(self.state, self.rng, NULL_SINK)
+
+  def start(self, battle_map=None):
+    effects = EffectEngine()
+    if battle_map is not None:
+      battle_map.start_combat(self.state)
+    effects.start_combat(self.state, NULL_SINK, battle_map)
+    return effects
+
+  def drop(self, battle_map=None):
+    index = self.state.index_of[self.downed]
+    self.assertTrue(self.state.apply_damage(index, self.state.hp[index] + 20))
+    if battle_map is not None:
+      battle_map.remove(index)
+    return index
+
+  def test_healing_gets_a_downed_ally_back_up(self):
+    effects = self.start()
+    index = self.drop()
+    self.assertTrue(effects.cast_spell(self.state.index_of[self.healer], self.rng))
+    self.assertTrue(self.state.alive[index])
+    # the healing counts from 0, not from the damage beyond it
+    self.assertTrue(4 <= self.state.hp[index] <= 11)
+    self.assertIn(index, self.state.alive_members[0])
+    self.assertEqual(self.state.alive_count[0], len(self.teams[0].team_members))
+
+  def test_a_revived_ally_is_back_on_the_map(self):
+    battle_map = BattleMap.line_up(self.teams, 30)
+    effects = self.start(battle_map)
+    index = self.drop(battle_map)
+    position = battle_map.positions[index]
+    self.assertNotIn(position, battle_map.occupied)
+    effects.cast_spell(self.state.index_of[self.healer], self.rng)
+    self.assertIn(position, battle_map.occupied)
+    self.assertEqual(battle_map.indexes[0].positions[index], position)
+
+  def test_standing_allies_above_half_are_not_healed(self):
+    effects = self.start()
+    self.assertFalse(effects.cast_spell(self.state.index_of[self.healer], self.rng))
+
+
+if __name__ == '__main__':
+  unittest.main()